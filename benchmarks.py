@@ -0,0 +1,329 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from database import DrugDatabase
+from drugbank_parser import parse_drugbank_xml
+from etl import DrugETL
+from optimizer import DrugOptimizer, FETCH_WORKERS
+from rules import RuleEngine
+from synthetic_drugbank import SyntheticDrugBank
+from vocabulary import ConditionVocabulary
+
+DB_PATH = 'drug_project.db'
+
+# Synthetic database sizes (drugs) the stage suite runs at
+STAGE_SCALES = (500, 2000, 8000)
+
+# Stored stage results that new runs are compared against
+BASELINE_PATH = 'benchmark_baseline.json'
+
+# A stage regresses when its median exceeds the baseline by this fraction and by REGRESSION_MIN_MS
+REGRESSION_TOLERANCE = 0.25
+REGRESSION_MIN_MS = 2.0
+
+# Condition sets for the optimizer stages, drawn from the synthetic indication vocabulary
+STAGE_CONDITION_SETS = [
+    ['hypertension'],
+    ['hypertension', 'type 2 diabetes', 'depression'],
+    ['hypertension', 'type 2 diabetes', 'depression', 'asthma', 'migraine', 'insomnia'],
+]
+
+DEFAULT_CONDITION_SETS = [
+    ['hypertension', 'diabetes'],
+    ['headache', 'fever', 'insomnia'],
+    ['hypertension', 'diabetes', 'anxiety', 'cholesterol', 'depression'],
+    ['hypertension', 'diabetes', 'anxiety', 'insomnia', 'cholesterol',
+     'depression', 'gerd', 'headache', 'fever', 'bacterial infection'],
+]
+
+# Misspelled / run-together conditions as NER tends to return them
+NOISY_CONDITIONS = ['hypertensoin', 'high blod pressure', 'diabetis', 'insomina', 'migrane', 'anxeity',
+                    'depresion', 'cholestrol', 'fevr', 'acid reflx', 'stomachache', 'glaucoma']
+
+
+def bench_formulations(db_path, condition_sets, formulations=('pairwise', 'compact'), time_limit=60):
+    """
+    Model size, build time and CBC time of each conflict formulation on the same
+    candidate set, conflict graph and greedy warm start. Returns one row per run.
+    """
+    engine = DrugOptimizer(db_path)
+    rows = []
+
+    for conditions in condition_sets:
+        with contextlib.redirect_stdout(io.StringIO()):
+            candidates, coverage_map, drug_info = engine._fetch_candidates(conditions)
+            if not candidates:
+                continue
+            direct_conflicts, all_conflicts = engine._get_conflicts(candidates)
+            greedy_ids, _ = engine._greedy_select(conditions, candidates, coverage_map, drug_info, all_conflicts)
+        covered = [c for c in conditions if coverage_map[c]]
+
+        for formulation in formulations:
+            t = time.perf_counter()
+            prob, x = engine._build_model(covered, candidates, coverage_map, drug_info, direct_conflicts,
+                                          all_conflicts, set(greedy_ids), lambda: False, formulation)
+            build_s = time.perf_counter() - t
+
+            t = time.perf_counter()
+            status, objective, bound = engine._run_cbc(prob, time_limit)
+            solve_s = time.perf_counter() - t
+
+            rows.append({
+                'conditions': len(conditions),
+                'candidates': len(candidates),
+                'conflict_pairs': len(all_conflicts),
+                'formulation': formulation,
+                'variables': prob.numVariables(),
+                'constraints': prob.numConstraints(),
+                'build_s': round(build_s, 3),
+                'solve_s': round(solve_s, 3),
+                'status': status,
+                'objective': round(objective, 4) if objective is not None else None,
+            })
+    return rows
+
+
+def bench_fetch(db_path, conditions, repeats=5, workers=FETCH_WORKERS):
+    """
+    Candidate retrieval latency for the first 1..len(conditions) conditions, sequential
+    vs. concurrent (`workers` threads). Median of `repeats` runs after one warm-up.
+    """
+    engine = DrugOptimizer(db_path)
+    rows = []
+
+    def median_ms(conds, workers):
+        times = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine._fetch_candidates(conds, workers=workers)
+            for _ in range(repeats):
+                t = time.perf_counter()
+                engine._fetch_candidates(conds, workers=workers)
+                times.append(time.perf_counter() - t)
+        return statistics.median(times) * 1000
+
+    for n in range(1, len(conditions) + 1):
+        conds = conditions[:n]
+        sequential = median_ms(conds, 1)
+        concurrent = median_ms(conds, workers)
+        rows.append({
+            'conditions': n,
+            'workers': min(workers, n),
+            'sequential_ms': round(sequential, 1),
+            'concurrent_ms': round(concurrent, 1),
+            'speedup': round(sequential / concurrent, 2) if concurrent else None,
+        })
+    return rows
+
+
+def bench_normalize(db_path, conditions, repeats=5):
+    """
+    Condition normalization latency per input: first lookup (fuzzy search) and repeat
+    lookup (memoized). The vocabulary is built before timing starts.
+    """
+    vocabulary = ConditionVocabulary(db_path, RuleEngine())
+    with contextlib.redirect_stdout(io.StringIO()):
+        vocabulary.normalize('')
+    rows = []
+
+    for condition in conditions:
+        first = []
+        for _ in range(repeats):
+            vocabulary._memo.clear()
+            t = time.perf_counter()
+            canonical, how, _ = vocabulary.normalize(condition)
+            first.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        vocabulary.normalize(condition)
+        repeat = time.perf_counter() - t
+        rows.append({
+            'condition': condition,
+            'canonical': canonical,
+            'how': how or '-',
+            'first_us': round(statistics.median(first) * 1e6, 1),
+            'memo_us': round(repeat * 1e6, 1),
+        })
+    return rows
+
+
+def bench_stages(scales=STAGE_SCALES, repeats=3, interactions=20, seed=1, work_dir=None, time_limit=60):
+    """
+    Times every pipeline stage on synthetic DrugBank data at each scale: XML parsing, the ETL
+    load, then candidate retrieval, enzyme conflicts, solve_ilp and solve_greedy per condition
+    set. Parse and ETL run once per scale; optimizer stages report the median of `repeats`
+    runs after one warm-up. Returns one row per (scale, stage, conditions).
+    """
+    rows = []
+    cleanup = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='regimen-bench-')
+
+    def timed(fn, n):
+        times = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+            for _ in range(n):
+                t = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - t)
+        return result, times
+
+    def row(scale, stage, times, conditions=None, **extra):
+        rows.append(dict({
+            'scale': scale,
+            'stage': stage,
+            'conditions': conditions,
+            'median_ms': round(statistics.median(times) * 1000, 2),
+            'min_ms': round(min(times) * 1000, 2),
+        }, **extra))
+
+    try:
+        for scale in scales:
+            scale_dir = os.path.join(work_dir, str(scale))
+            data_dir = os.path.join(scale_dir, 'data')
+            db_path = os.path.join(scale_dir, 'drug_project.db')
+            xml_path = SyntheticDrugBank(scale, interactions, seed=seed).write(os.path.join(data_dir, 'database.xml'))
+
+            # 1. Parse and load: one timed run each (they rewrite their outputs)
+            with contextlib.redirect_stdout(io.StringIO()):
+                t = time.perf_counter()
+                parse_drugbank_xml(xml_path, data_dir)
+                parse_s = time.perf_counter() - t
+
+                if os.path.exists(db_path):
+                    os.remove(db_path)
+                db = DrugDatabase(db_path)
+                db.create_schema()
+                t = time.perf_counter()
+                stats = DrugETL(db).load_csv_to_db(data_dir=data_dir, precompute_regimens=False)
+                etl_s = time.perf_counter() - t
+            row(scale, 'parse', [parse_s], xml_mb=round(os.path.getsize(xml_path) / 1e6, 1))
+            row(scale, 'etl', [etl_s], rows=sum(s['rows'] for s in stats.values()))
+
+            # 2. Optimizer stages on the loaded database
+            engine = DrugOptimizer(db_path)
+            for conditions in STAGE_CONDITION_SETS:
+                (candidates, _, _), times = timed(lambda: engine._fetch_candidates(conditions), repeats)
+                row(scale, 'fetch', times, len(conditions), candidates=len(candidates))
+
+                conflicts, times = timed(lambda: engine._get_enzyme_conflicts(candidates), repeats)
+                row(scale, 'enzyme_conflicts', times, len(conditions), conflict_pairs=len(conflicts))
+
+                result, times = timed(lambda: engine.solve_ilp(conditions), repeats)
+                row(scale, 'solve_ilp', times, len(conditions), status=result.get('solver_status'))
+
+                result, times = timed(lambda: engine.solve_greedy(conditions), repeats)
+                row(scale, 'solve_greedy', times, len(conditions), status=result.get('solver_status'))
+    finally:
+        if cleanup:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return rows
+
+
+def stage_key(row):
+    return row['scale'], row['stage'], row['conditions']
+
+
+def save_results(rows, path, params):
+    """Writes stage rows with the run's parameters and environment as JSON."""
+    with open(path, 'w') as f:
+        json.dump({
+            'params': params,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': rows,
+        }, f, indent=2)
+
+
+def compare_to_baseline(rows, baseline_path, tolerance=REGRESSION_TOLERANCE, min_ms=REGRESSION_MIN_MS):
+    """
+    Rows of (stage, baseline ms, new ms, ratio, verdict) for every stage in both runs.
+    A stage regresses when it is slower by more than `tolerance` and by more than `min_ms`.
+    """
+    with open(baseline_path) as f:
+        baseline = {stage_key(r): r for r in json.load(f)['results']}
+
+    comparison = []
+    for r in rows:
+        base = baseline.get(stage_key(r))
+        if base is None:
+            continue
+        old, new = base['median_ms'], r['median_ms']
+        ratio = new / old if old else None
+        regressed = ratio is not None and ratio > 1 + tolerance and new - old > min_ms
+        comparison.append({
+            'scale': r['scale'],
+            'stage': r['stage'],
+            'conditions': r['conditions'] if r['conditions'] is not None else '-',
+            'baseline_ms': old,
+            'new_ms': new,
+            'ratio': round(ratio, 2) if ratio is not None else '-',
+            'verdict': 'REGRESSION' if regressed else 'ok',
+        })
+    return comparison
+
+
+def print_table(rows):
+    if not rows:
+        print("No results.")
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(str(r[c]).rjust(widths[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimizer benchmarks")
+    parser.add_argument('benchmark', choices=['formulations', 'fetch', 'normalize', 'stages'])
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--time-limit', type=float, default=60, help="CBC time limit per solve (seconds)")
+    parser.add_argument('--repeats', type=int, default=5, help="Timed runs per point (fetch, normalize)")
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS, help="Concurrent queries (fetch)")
+    parser.add_argument('--scales', type=lambda s: [int(x) for x in s.split(',')], default=STAGE_SCALES,
+                        help="Synthetic database sizes in drugs, comma separated (stages)")
+    parser.add_argument('--interactions', type=float, default=20, help="Mean interactions per drug (stages)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Stage results JSON (stages)")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Stage results to compare against (stages)")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the baseline (stages)")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help="Allowed slowdown against the baseline, as a fraction (stages)")
+    args = parser.parse_args()
+
+    if args.benchmark == 'formulations':
+        print_table(bench_formulations(args.db, DEFAULT_CONDITION_SETS, time_limit=args.time_limit))
+    elif args.benchmark == 'fetch':
+        print_table(bench_fetch(args.db, DEFAULT_CONDITION_SETS[-1], repeats=args.repeats, workers=args.workers))
+    elif args.benchmark == 'normalize':
+        print_table(bench_normalize(args.db, NOISY_CONDITIONS, repeats=args.repeats))
+    elif args.benchmark == 'stages':
+        rows = bench_stages(args.scales, repeats=args.repeats, interactions=args.interactions)
+        columns = ('scale', 'stage', 'conditions', 'median_ms', 'min_ms')
+        print_table([{c: '-' if r[c] is None else r[c] for c in columns} for r in rows])
+        params = {'scales': list(args.scales), 'interactions': args.interactions, 'repeats': args.repeats}
+        save_results(rows, args.output, params)
+        print(f"Results written to {args.output}")
+
+        if args.save_baseline:
+            save_results(rows, args.baseline, params)
+            print(f"Baseline stored in {args.baseline}")
+        elif not os.path.exists(args.baseline):
+            print(f"❌ No baseline at {args.baseline}, so nothing was checked for regressions. "
+                  f"Store one on this machine with --save-baseline.")
+            sys.exit(2)
+        else:
+            comparison = compare_to_baseline(rows, args.baseline, tolerance=args.tolerance)
+            print(f"\nCompared with {args.baseline}:")
+            print_table(comparison)
+            if any(c['verdict'] == 'REGRESSION' for c in comparison):
+                sys.exit(1)
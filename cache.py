@@ -0,0 +1,365 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from database import DrugDatabase
+
+
+def normalize_condition(condition):
+    return " ".join(condition.lower().split())
+
+
+def condition_set(conditions):
+    """Order-independent, case/whitespace-insensitive form of a condition list."""
+    return sorted({normalize_condition(c) for c in conditions if c and c.strip()})
+
+
+def request_key(namespace, conditions, mode=None, weights=None, version=None):
+    parts = {
+        'ns': namespace,
+        'conditions': condition_set(conditions),
+        'mode': mode,
+        'weights': sorted(weights.items()) if weights else None,
+        'version': version,
+    }
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+def relabel_conditions(result, conditions):
+    """
+    Cached results carry the condition labels of the request that produced them.
+    Rewrites regimen coverage (including each Pareto frontier regimen) and graph
+    condition nodes to this request's spelling and order.
+    """
+    labels = {}
+    for c in conditions:
+        labels.setdefault(normalize_condition(c), c)
+    order = {norm: i for i, norm in enumerate(labels)}
+
+    def relabel(c):
+        return labels.get(normalize_condition(c), c)
+
+    def position(c):
+        return order.get(normalize_condition(c), len(order))
+
+    regimens = [result.get('regimen') or []] + [point['regimen'] for point in result.get('frontier') or []]
+    for drug in (d for regimen in regimens for d in regimen):
+        covered = {relabel(c) for c in drug.get('covered_conditions', [])}
+        drug['covered_conditions'] = sorted(covered, key=position)
+
+    if 'nodes' in result:
+        condition_nodes, drug_nodes, seen = [], [], set()
+        for node in result['nodes']:
+            if node.get('group') != 'condition':
+                drug_nodes.append(node)
+                continue
+            label = relabel(node['id'])
+            if label not in seen:
+                seen.add(label)
+                condition_nodes.append(dict(node, id=label, name=label))
+        result['nodes'] = sorted(condition_nodes, key=lambda n: position(n['id'])) + drug_nodes
+
+        links, seen = [], set()
+        for link in result.get('links', []):
+            link = dict(link, source=relabel(link['source']))
+            if (link['source'], link['target']) not in seen:
+                seen.add((link['source'], link['target']))
+                links.append(link)
+        result['links'] = links
+
+    return result
+
+
+class DataVersion:
+    """
+    Current data_version of the drug database. The meta table is only re-read
+    when the file changes on disk, so checking it per request is a stat() call.
+    """
+
+    def __init__(self, db_path):
+        self.db = DrugDatabase(db_path)
+        self._signature = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            st = os.stat(self.db.db_name)
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+
+        with self._lock:
+            if signature != self._signature:
+                version = self.db.get_data_version() if signature else None
+                # Databases loaded before the meta table fall back to the file signature
+                self._version = version or ("file-%s-%s-%s" % signature if signature else "missing")
+                self._signature = signature
+            return self._version
+
+
+class PrecomputedRegimens:
+    """
+    Read side of the precomputed_regimens table: rows solved for the current data
+    version, held in memory and looked up by condition set and weights. Reloaded
+    when the database file changes, so a regeneration is picked up without a restart.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.data_version = DataVersion(db_path)
+        self._signature = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = defaultdict(int)
+
+    def _ensure(self):
+        try:
+            st = os.stat(self.db_path)
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._entries = self._load() if signature else {}
+                    self._signature = signature
+
+    def _load(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT key, result FROM precomputed_regimens WHERE data_version = ?",
+                                (self.data_version.current(),)).fetchall()
+        except sqlite3.OperationalError:
+            rows = []  # Database built before the table existed
+        finally:
+            conn.close()
+        return dict(rows)
+
+    def get(self, conditions, weights):
+        """Returns a fresh copy of the precomputed result, or None."""
+        self._ensure()
+        payload = self._entries.get(request_key('precomputed', conditions, weights=weights))
+        with self._lock:
+            self._stats['hits' if payload is not None else 'misses'] += 1
+        return json.loads(payload) if payload is not None else None
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, entries=len(self._entries),
+                        hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else 0.0)
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: an in-process LRU with TTL, plus an optional SQLite
+    file shared by all workers. Keys embed the data version, and both tiers are
+    purged as soon as the database is rebuilt.
+    """
+
+    def __init__(self, data_version, max_entries=1024, ttl=600, disk_path=None):
+        self.data_version = data_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+
+        self._entries = OrderedDict()  # key -> (expires_at, payload json)
+        self._lock = threading.Lock()
+        self._version = None
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+        if disk_path:
+            conn = self._disk_connection()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    data_version TEXT,
+                    expires_at REAL,
+                    payload TEXT
+                )
+            ''')
+            conn.commit()
+            conn.close()
+
+    def _disk_connection(self):
+        return sqlite3.connect(self.disk_path, timeout=5)
+
+    def make_key(self, namespace, conditions, mode=None, weights=None):
+        return request_key(namespace, conditions, mode, weights, version=self._check_version())
+
+    def _check_version(self):
+        version = self.data_version.current()
+        if version != self._version:
+            with self._lock:
+                if self._version is not None:
+                    self._entries.clear()
+                    self._stats['_all']['invalidations'] += 1
+                self._version = version
+            if self.disk_path:
+                conn = self._disk_connection()
+                conn.execute("DELETE FROM response_cache WHERE data_version != ?", (version,))
+                conn.commit()
+                conn.close()
+        return version
+
+    def get(self, key):
+        """Returns a fresh copy of the cached value, or None on a miss."""
+        namespace = key.split(':', 1)[0]
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats[namespace]['memory_hits'] += 1
+                    return json.loads(payload)
+                del self._entries[key]
+                self._stats[namespace]['expirations'] += 1
+
+        if self.disk_path:
+            conn = self._disk_connection()
+            row = conn.execute(
+                "SELECT expires_at, payload FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            conn.close()
+            if row:
+                self._store(key, row[1], row[0])
+                with self._lock:
+                    self._stats[namespace]['disk_hits'] += 1
+                return json.loads(row[1])
+
+        with self._lock:
+            self._stats[namespace]['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        payload = json.dumps(value)
+        expires_at = time.time() + self.ttl
+        self._store(key, payload, expires_at)
+
+        if self.disk_path:
+            conn = self._disk_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, data_version, expires_at, payload) VALUES (?, ?, ?, ?)",
+                (key, self._version, expires_at, payload)
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            conn.close()
+
+    def _store(self, key, payload, expires_at):
+        namespace = key.split(':', 1)[0]
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._stats[evicted.split(':', 1)[0]]['evictions'] += 1
+            self._stats[namespace]['stores'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_path:
+            conn = self._disk_connection()
+            conn.execute("DELETE FROM response_cache")
+            conn.commit()
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            namespaces = {}
+            for namespace, counts in self._stats.items():
+                if namespace == '_all':
+                    continue
+                hits = counts['memory_hits'] + counts['disk_hits']
+                lookups = hits + counts['misses']
+                namespaces[namespace] = dict(counts, hit_rate=round(hits / lookups, 4) if lookups else 0.0)
+
+            return {
+                'data_version': self._version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'disk_tier': bool(self.disk_path),
+                'invalidations': self._stats['_all']['invalidations'],
+                'namespaces': namespaces,
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the
+    computation, callers arriving while it is in flight wait and get their own
+    copy of its result (or its exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def do(self, key, fn):
+        """Returns (result, shared); shared is True when another caller did the work."""
+        namespace = key.split(':', 1)[0] if isinstance(key, str) else key[0]
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats[namespace]['executions'] += 1
+            else:
+                flight.waiters += 1
+                self._stats[namespace]['coalesced'] += 1
+                self._stats[namespace]['max_waiters'] = max(self._stats[namespace]['max_waiters'], flight.waiters)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result), True
+
+        result = None
+        try:
+            result = fn()
+            return result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                waiters = flight.waiters
+            # Snapshot before the leader's caller can mutate the result
+            if waiters and flight.error is None:
+                flight.result = copy.deepcopy(result)
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for namespace, counts in self._stats.items():
+                calls = counts['executions'] + counts['coalesced']
+                out[namespace] = dict(counts, coalesce_rate=round(counts['coalesced'] / calls, 4) if calls else 0.0)
+            out['in_flight'] = len(self._flights)
+            return out
@@ -0,0 +1,132 @@
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import time
+
+# Set REGIMEN_CAPTURE_DIR to a directory to record requests (off by default)
+CAPTURE_DIR = os.environ.get('REGIMEN_CAPTURE_DIR')
+
+# Rotation: bytes per file and rotated files kept (capture.jsonl, capture.jsonl.1, ...)
+CAPTURE_MAX_BYTES = int(os.environ.get('REGIMEN_CAPTURE_MAX_BYTES', 50 * 1024 * 1024))
+CAPTURE_BACKUPS = int(os.environ.get('REGIMEN_CAPTURE_BACKUPS', 10))
+
+# One file per process: uvicorn workers rotating a shared file would lose or clobber lines
+CAPTURE_FILE = 'capture-{pid}.jsonl'
+CAPTURE_GLOB = 'capture*.jsonl*'
+
+# /optimize/text free text is a clinical note: only its extracted conditions are captured unless
+# this is set to 1, and the text is then redacted (which cannot catch names or other identifiers)
+CAPTURE_RAW_TEXT = os.environ.get('REGIMEN_CAPTURE_RAW_TEXT') == '1'
+
+# Stateless endpoints whose requests can be replayed on their own
+CAPTURE_ROUTES = {'/optimize', '/optimize/text', '/optimize/pareto', '/graph'}
+
+# Request fields kept; anything else a client sends is dropped
+CAPTURE_FIELDS = ('conditions', 'text', 'mode', 'deadline_ms', 'points', 'current_medications',
+                  'top_n', 'collapse', 'offset', 'limit')
+
+# Identifiers redacted from free text before it is written
+REDACTIONS = [
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.]+'), '<email>'),
+    (re.compile(r'\b\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}\b'), '<date>'),
+    (re.compile(r'\+?\d[\d ()-]{7,}\d'), '<phone>'),
+    (re.compile(r'\b\d{4,}\b'), '<number>'),
+]
+
+
+def redact(text):
+    for pattern, label in REDACTIONS:
+        text = pattern.sub(label, text)
+    return text
+
+
+def sanitize(payload, raw_text=CAPTURE_RAW_TEXT):
+    """Keeps the known request fields; free text is dropped, or redacted with raw_text."""
+    if not isinstance(payload, dict):
+        return {}
+    clean = {k: payload[k] for k in CAPTURE_FIELDS if k in payload}
+    if 'text' in clean:
+        if raw_text and isinstance(clean['text'], str):
+            clean['text'] = redact(clean['text'])
+        else:
+            del clean['text']
+    return clean
+
+
+class TrafficCapture:
+    """
+    Appends one JSON line per captured request to rotating files in `directory`, one
+    file per process. Lines are handed to a listener thread, so a slow disk never holds
+    up a request.
+    """
+
+    def __init__(self, directory, max_bytes=CAPTURE_MAX_BYTES, backups=CAPTURE_BACKUPS, raw_text=CAPTURE_RAW_TEXT):
+        os.makedirs(directory, exist_ok=True)
+        self.raw_text = raw_text
+        self.path = os.path.join(directory, CAPTURE_FILE.format(pid=os.getpid()))
+        handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._queue = queue.Queue(-1)
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+
+        self._logger = logging.getLogger(f'regimen.capture.{id(self)}')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(logging.handlers.QueueHandler(self._queue))
+
+    def wants(self, method, path):
+        return method == 'POST' and path in CAPTURE_ROUTES
+
+    def record(self, route, body, status, seconds, spans=None, data_version=None, extracted=None):
+        """`extracted` holds fields the handler derived, e.g. the conditions found in free text."""
+        try:
+            payload = sanitize(json.loads(body), self.raw_text) if body else {}
+        except ValueError:
+            payload = {}
+        payload.update(extracted or {})
+        self._logger.info(json.dumps({
+            'ts': round(time.time(), 3),
+            'route': route,
+            'payload': payload,
+            'mode': payload.get('mode'),
+            'status': status,
+            'duration_ms': round(seconds * 1000, 2),
+            'spans_ms': {stage: round(s * 1000, 2) for stage, s in (spans or {}).items()},
+            'data_version': data_version,
+        }))
+
+    def close(self):
+        self._listener.stop()
+
+
+def read_capture(paths):
+    """
+    Captured records from files or capture directories (rotated files included),
+    in request order.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, CAPTURE_GLOB))
+        else:
+            files.append(path)
+
+    records = []
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"⚠️ Skipping malformed capture line in {path}")
+    records.sort(key=lambda r: r.get('ts', 0))
+    return records
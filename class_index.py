@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+from collections import defaultdict
+
+from cache import DataVersion
+from metrics import log
+
+# ATC code lengths of the class levels: anatomical group, therapeutic, pharmacological, chemical subgroup
+ATC_PREFIXES = (1, 3, 4, 5)
+
+
+class ClassIndex:
+    """
+    Inverted index from ATC class code (every level of each drug's ATC code, e.g. 'J01',
+    'J01F', 'J01FA') to the set of drug ids in it. Search terms are mapped onto classes
+    only through the curated class_terms table of the rule file, never by matching class
+    names, so 'insulin' cannot select "... EXCL. INSULINS". Built on first use and rebuilt
+    when the database version changes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.data_version = DataVersion(db_path)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        version = self.data_version.current()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build()
+                    self._version = version
+
+    def _build(self):
+        conn = sqlite3.connect(self.db_path)
+        members = defaultdict(set)
+        for rid, code in conn.execute("SELECT drugbank_id, atc_code FROM atc_codes"):
+            code = (code or '').strip().upper()
+            for length in ATC_PREFIXES:
+                if len(code) >= length:
+                    members[code[:length]].add(rid)
+            if code:
+                members[code].add(rid)
+        conn.close()
+
+        self.members = {code: frozenset(ids) for code, ids in members.items()}
+        log(f"Class index: {len(self.members)} classes")
+
+    def lookup(self, terms, class_codes):
+        """
+        Splits search terms into class terms and text terms. `class_codes(term)` returns
+        the curated ATC code prefixes of a term, or None. A term whose classes have no
+        drugs in this database (e.g. no ATC data loaded) stays a text term.
+        Returns (ids in any matched class, {term: codes}, unmatched terms).
+        """
+        self._ensure()
+        ids = set()
+        matched = {}
+        unmatched = []
+        for term in terms:
+            term_ids = set()
+            for code in class_codes(term) or ():
+                term_ids |= self.members.get(code.upper(), frozenset())
+            if term_ids:
+                matched[term] = tuple(class_codes(term))
+                ids |= term_ids
+            else:
+                unmatched.append(term)
+        return ids, matched, unmatched
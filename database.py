@@ -1,8 +1,37 @@
 import sqlite3
 import os
+import uuid
 
 DB_NAME = 'drug_project.db'
 
+# Index plan: every per-request lookup is keyed by drugbank_id. Covering indexes
+# carry the projected columns so the hot queries never touch the table rows.
+# Indication text search uses LIKE '%term%', which no b-tree index can serve.
+# The ETL drops them for the bulk load and builds them once the data is in.
+INDEXES = {
+    # Conflict graph: drugbank_id IN (...) AND target_drug_id IN (...)
+    'idx_interactions': 'interactions(drugbank_id, target_drug_id)',
+    # Candidate query: LEFT JOIN toxicity (length of toxicity_text)
+    'idx_toxicity_drug': 'toxicity(drugbank_id)',
+    # Candidate query: LEFT JOIN prices -> cost
+    'idx_prices_drug': 'prices(drugbank_id, cost)',
+    # Route EXISTS check and enrichment dosage list
+    'idx_dosages_drug': 'dosages(drugbank_id, route, form, strength)',
+    # Metabolic conflicts and enrichment enzyme list
+    'idx_enzymes_drug': 'enzymes(drugbank_id, organism, enzyme_name, action, '
+                        'inhibition_strength, induction_strength)',
+    # Class retrieval: excluded terms checked against each class member's indications
+    'idx_indications_drug': 'indications(drugbank_id)',
+    # Enrichment lists
+    'idx_synonyms_drug': 'synonyms(drugbank_id, synonym)',
+    'idx_food_interactions_drug': 'food_interactions(drugbank_id, interaction_text)',
+    'idx_pathways_drug': 'pathways(drugbank_id, pathway_name)',
+    'idx_targets_drug': 'targets(drugbank_id, organism, target_name, known_action)',
+}
+
+# Indexes from earlier schemas that no query can use
+OBSOLETE_INDEXES = ['idx_indications']
+
 class DrugDatabase:
     def __init__(self, db_name=DB_NAME):
         self.db_name = db_name
@@ -37,7 +66,6 @@ class DrugDatabase:
                 FOREIGN KEY(drugbank_id) REFERENCES drugs(drugbank_id)
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_indications ON indications(indication_text)')
 
         # Interactions (Drug-Drug)
         cursor.execute('''
@@ -49,7 +77,6 @@ class DrugDatabase:
                 FOREIGN KEY(drugbank_id) REFERENCES drugs(drugbank_id)
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_interactions ON interactions(drugbank_id, target_drug_id)')
 
         # Food Interactions
         cursor.execute('''
@@ -213,10 +240,57 @@ class DrugDatabase:
             )
         ''')
 
+        # Meta (data_version changes on every load so caches can tell a rebuilt database apart)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # Precomputed regimens for frequent condition combinations (rebuilt by precompute.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS precomputed_regimens (
+                key TEXT PRIMARY KEY,
+                conditions TEXT,
+                data_version TEXT,
+                result TEXT,
+                solved_at REAL
+            )
+        ''')
+
+        self.create_indexes(cursor)
+
         conn.commit()
         conn.close()
         print(f"Database {self.db_name} schema fully initialized with all 17 tables.")
 
+    def bump_data_version(self, cursor):
+        version = uuid.uuid4().hex
+        cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('data_version', ?)", (version,))
+        return version
+
+    def get_data_version(self):
+        """Version stamp of the loaded data, or None for databases built before the meta table."""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+            return row[0] if row else None
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            conn.close()
+
+    def drop_indexes(self, cursor):
+        for name in OBSOLETE_INDEXES + list(INDEXES):
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+    def create_indexes(self, cursor):
+        for name in OBSOLETE_INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+        for name, target in INDEXES.items():
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
 if __name__ == "__main__":
     if os.path.exists(DB_NAME):
         print(f"Note: '{DB_NAME}' already exists. Ensure it matches the new schema or delete it to rebuild.")
@@ -21,32 +21,33 @@ def get_primary_id(drug_element):
     return ids[0].text if ids else "Unknown"
 
 
-def parse_drugbank_xml(xml_file):
+def parse_drugbank_xml(xml_file, out_dir='data'):
     if not os.path.exists(xml_file):
         print(f"Error: {xml_file} not found.")
         return
 
     print(f"Processing {xml_file}...")
+    os.makedirs(out_dir, exist_ok=True)
 
     # Open CSV files
     files = {
-        'drugs': open('data/drugs.csv', 'w', newline='', encoding='utf-8'),
-        'indications': open('data/drug_indications.csv', 'w', newline='', encoding='utf-8'),
-        'interactions': open('data/drug_interactions.csv', 'w', newline='', encoding='utf-8'),
-        'synonyms': open('data/drug_synonyms.csv', 'w', newline='', encoding='utf-8'),
-        'food': open('data/food_interactions.csv', 'w', newline='', encoding='utf-8'),
-        'toxicity': open('data/drug_toxicity.csv', 'w', newline='', encoding='utf-8'),
-        'snp_adverse': open('data/snp_adverse_reactions.csv', 'w', newline='', encoding='utf-8'),
-        'enzymes': open('data/drug_enzymes.csv', 'w', newline='', encoding='utf-8'),
-        'targets': open('data/drug_targets.csv', 'w', newline='', encoding='utf-8'),
-        'prices': open('data/drug_prices.csv', 'w', newline='', encoding='utf-8'),
-        'products': open('data/drug_products.csv', 'w', newline='', encoding='utf-8'),
-        'categories': open('data/drug_categories.csv', 'w', newline='', encoding='utf-8'),
-        'transporters': open('data/drug_transporters.csv', 'w', newline='', encoding='utf-8'),
-        'carriers': open('data/drug_carriers.csv', 'w', newline='', encoding='utf-8'),
-        'pathways': open('data/drug_pathways.csv', 'w', newline='', encoding='utf-8'),
-        'dosages': open('data/drug_dosages.csv', 'w', newline='', encoding='utf-8'),
-        'atc_codes': open('data/drug_atc_codes.csv', 'w', newline='', encoding='utf-8')
+        'drugs': open(os.path.join(out_dir, 'drugs.csv'), 'w', newline='', encoding='utf-8'),
+        'indications': open(os.path.join(out_dir, 'drug_indications.csv'), 'w', newline='', encoding='utf-8'),
+        'interactions': open(os.path.join(out_dir, 'drug_interactions.csv'), 'w', newline='', encoding='utf-8'),
+        'synonyms': open(os.path.join(out_dir, 'drug_synonyms.csv'), 'w', newline='', encoding='utf-8'),
+        'food': open(os.path.join(out_dir, 'food_interactions.csv'), 'w', newline='', encoding='utf-8'),
+        'toxicity': open(os.path.join(out_dir, 'drug_toxicity.csv'), 'w', newline='', encoding='utf-8'),
+        'snp_adverse': open(os.path.join(out_dir, 'snp_adverse_reactions.csv'), 'w', newline='', encoding='utf-8'),
+        'enzymes': open(os.path.join(out_dir, 'drug_enzymes.csv'), 'w', newline='', encoding='utf-8'),
+        'targets': open(os.path.join(out_dir, 'drug_targets.csv'), 'w', newline='', encoding='utf-8'),
+        'prices': open(os.path.join(out_dir, 'drug_prices.csv'), 'w', newline='', encoding='utf-8'),
+        'products': open(os.path.join(out_dir, 'drug_products.csv'), 'w', newline='', encoding='utf-8'),
+        'categories': open(os.path.join(out_dir, 'drug_categories.csv'), 'w', newline='', encoding='utf-8'),
+        'transporters': open(os.path.join(out_dir, 'drug_transporters.csv'), 'w', newline='', encoding='utf-8'),
+        'carriers': open(os.path.join(out_dir, 'drug_carriers.csv'), 'w', newline='', encoding='utf-8'),
+        'pathways': open(os.path.join(out_dir, 'drug_pathways.csv'), 'w', newline='', encoding='utf-8'),
+        'dosages': open(os.path.join(out_dir, 'drug_dosages.csv'), 'w', newline='', encoding='utf-8'),
+        'atc_codes': open(os.path.join(out_dir, 'drug_atc_codes.csv'), 'w', newline='', encoding='utf-8')
     }
 
     writers = {}
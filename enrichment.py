@@ -0,0 +1,60 @@
+import sqlite3
+
+
+def get_db_connection(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def get_list_data(conn, drug_id, table, column):
+    """Helper to fetch simple lists like synonyms."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {column} FROM {table} WHERE drugbank_id = ?", (drug_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def enrich_details(db_path, drug_id, basic_info):
+    """
+    Fetches extra details for the UI, including new metabolic info.
+    """
+    conn = get_db_connection(db_path)
+    try:
+        # 1. Synonyms
+        basic_info['synonyms'] = get_list_data(conn, drug_id, 'synonyms', 'synonym')[:5]
+
+        # 2. Food Interactions
+        basic_info['food_interactions'] = get_list_data(conn, drug_id, 'food_interactions', 'interaction_text')
+
+        # 3. Dosages
+        c = conn.cursor()
+        c.execute("SELECT form, route, strength FROM dosages WHERE drugbank_id = ? LIMIT 5", (drug_id,))
+        basic_info['dosages'] = [dict(row) for row in c.fetchall()]
+
+        # 4. Pathways
+        basic_info['pathways'] = get_list_data(conn, drug_id, 'pathways', 'pathway_name')
+
+        # 5. Enzymes
+        # Crucial for explaining metabolic risks
+        c.execute("""
+                  SELECT enzyme_name, action, inhibition_strength, induction_strength
+                  FROM enzymes
+                  WHERE drugbank_id = ?
+                    AND (organism = 'Humans'
+                     OR organism IS NULL)
+                      LIMIT 5
+                  """, (drug_id,))
+        basic_info['enzymes'] = [dict(row) for row in c.fetchall()]
+
+        # 6. Targets
+        c.execute("""
+                  SELECT target_name, known_action
+                  FROM targets
+                  WHERE drugbank_id = ?
+                    AND (organism = 'Humans' OR organism IS NULL) LIMIT 5
+                  """, (drug_id,))
+        basic_info['targets'] = [dict(row) for row in c.fetchall()]
+
+    finally:
+        conn.close()
+    return basic_info
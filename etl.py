@@ -2,200 +2,346 @@ import csv
 import sqlite3
 import os
 import re
+import time
+import threading
+import multiprocessing
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from database import DrugDatabase
 
 DATA_DIR = 'data'
 
+# Pipeline tuning: rows per batch handed to the writer, max batches in flight, decoder processes
+BATCH_SIZE = 5000
+QUEUE_DEPTH = 16
+ETL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# (csv file, table, columns, insert verb, transform) -- one entry per table, all 17 of them
+TABLE_SPECS = [
+    # 1. Drugs (INSERT OR REPLACE to handle potential re-runs on the PRIMARY KEY)
+    ('drugs.csv', 'drugs',
+     ['drugbank_id', 'name', 'type', 'cas_number', 'groups', 'description', 'moa', 'half_life', 'clearance'],
+     'INSERT OR REPLACE', None),
+    # 2. Indications
+    ('drug_indications.csv', 'indications',
+     ['drugbank_id', 'indication_text'], 'INSERT', None),
+    # 3. Interactions
+    ('drug_interactions.csv', 'interactions',
+     ['drugbank_id', 'target_drug_id', 'target_drug_name', 'description'], 'INSERT', None),
+    # 4. Food Interactions
+    ('food_interactions.csv', 'food_interactions',
+     ['drugbank_id', 'interaction_text'], 'INSERT', None),
+    # 5. Toxicity
+    ('drug_toxicity.csv', 'toxicity',
+     ['drugbank_id', 'toxicity_text'], 'INSERT', None),
+    # 6. Synonyms
+    ('drug_synonyms.csv', 'synonyms',
+     ['drugbank_id', 'synonym', 'language', 'coder'], 'INSERT', None),
+    # 7. SNP Adverse Reactions
+    ('snp_adverse_reactions.csv', 'snp_adverse_reactions',
+     ['drugbank_id', 'protein_name', 'gene_symbol', 'adverse_reaction', 'description'], 'INSERT', None),
+    # 8. Enzymes
+    ('drug_enzymes.csv', 'enzymes',
+     ['drugbank_id', 'enzyme_id', 'enzyme_name', 'organism', 'action', 'inhibition_strength',
+      'induction_strength'], 'INSERT', None),
+    # 9. Targets
+    ('drug_targets.csv', 'targets',
+     ['drugbank_id', 'target_id', 'target_name', 'organism', 'known_action'], 'INSERT', None),
+    # 10. Prices (Selecting representative price per drug)
+    ('drug_prices.csv', 'prices',
+     ['drugbank_id', 'description', 'cost', 'currency', 'unit'], 'INSERT', 'prices'),
+    # 11. Products
+    ('drug_products.csv', 'products',
+     ['drugbank_id', 'product_name', 'labeller', 'dosage_form', 'strength', 'route', 'country'], 'INSERT', None),
+    # 12. Categories
+    ('drug_categories.csv', 'categories',
+     ['drugbank_id', 'category', 'mesh_id'], 'INSERT', None),
+    # 13. Transporters
+    ('drug_transporters.csv', 'transporters',
+     ['drugbank_id', 'transporter_id', 'transporter_name', 'organism', 'actions'], 'INSERT', None),
+    # 14. Carriers
+    ('drug_carriers.csv', 'carriers',
+     ['drugbank_id', 'carrier_id', 'carrier_name', 'organism', 'actions'], 'INSERT', None),
+    # 15. Pathways
+    ('drug_pathways.csv', 'pathways',
+     ['drugbank_id', 'smpdb_id', 'pathway_name', 'category'], 'INSERT', None),
+    # 16. Dosages
+    ('drug_dosages.csv', 'dosages',
+     ['drugbank_id', 'form', 'route', 'strength'], 'INSERT', None),
+    # 17. ATC Codes
+    ('drug_atc_codes.csv', 'atc_codes',
+     ['drugbank_id', 'atc_code', 'level_1', 'level_2', 'level_3', 'level_4'], 'INSERT', None),
+]
+
+
+# Helper to clean price string to float
+def parse_cost(c_str):
+    try:
+        return float(re.sub(r'[^\d.]', '', c_str))
+    except:
+        return float('inf')
+
+
+# Helper to rank units, lower is better
+def rank_unit(u_str):
+    u = u_str.lower()
+    if 'tablet' in u or 'capsule' in u: return 1
+    if 'ml' in u or 'liquid' in u or 'solution' in u: return 2
+    return 3
+
+
+def price_key(row):
+    """Sort key for a price row: Unit Rank (Tablet first), then Cost (Lowest first)."""
+    return rank_unit(row.get('unit', '')), parse_cost(row.get('cost', ''))
+
+
+def select_prices(reader, csv_keys):
+    """
+    Picks one representative price per drug: USD if available,
+    then by Unit Rank (Tablet first), then Cost (Lowest first).
+
+    Streams in one pass, relying on the parser emitting each drug's prices
+    contiguously, so only the current drug's best rows are held in memory.
+    Ties keep the earliest row, same as the stable sort it replaces.
+    """
+    current = None
+    best_usd = best_any = None
+    best_usd_key = best_any_key = None
+
+    for row in reader:
+        did = row.get('drugbank_id')
+        if not did:
+            continue
+
+        if did != current:
+            if current is not None:
+                best = best_usd if best_usd is not None else best_any
+                yield tuple(best.get(k, '') for k in csv_keys)
+            current = did
+            best_usd = best_any = None
+
+        key = price_key(row)
+        if best_any is None or key < best_any_key:
+            best_any, best_any_key = row, key
+        # Filter for USD if available
+        if row.get('currency') == 'USD' and (best_usd is None or key < best_usd_key):
+            best_usd, best_usd_key = row, key
+
+    if current is not None:
+        best = best_usd if best_usd is not None else best_any
+        yield tuple(best.get(k, '') for k in csv_keys)
+
+
+def decode_table(spec, data_dir, out_queue, batch_size):
+    """
+    Producer, runs in a worker process. Decodes one CSV into ready-to-insert
+    batches and hands them to the writer through the bounded queue.
+    Returns (table, filename, rows, decode seconds); rows is None if the file is missing.
+    """
+    filename, table_name, csv_keys, verb, transform = spec
+    path = os.path.join(data_dir, filename)
+    if not os.path.exists(path):
+        return table_name, filename, None, 0.0
+
+    placeholders = ', '.join(['?'] * len(csv_keys))
+    query = f"{verb} INTO {table_name} ({', '.join(csv_keys)}) VALUES ({placeholders})"
+
+    start = time.perf_counter()
+    blocked = 0.0
+    rows = 0
+
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        if transform == 'prices':
+            records = select_prices(reader, csv_keys)
+        else:
+            # Safely get data, defaulting to empty string if missing
+            records = (tuple(row.get(k, '') for k in csv_keys) for row in reader)
+
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                t = time.perf_counter()
+                out_queue.put((table_name, query, batch))
+                blocked += time.perf_counter() - t
+                rows += len(batch)
+                batch = []
+
+        if batch:
+            t = time.perf_counter()
+            out_queue.put((table_name, query, batch))
+            blocked += time.perf_counter() - t
+            rows += len(batch)
+
+    # Time spent waiting on a full queue is backpressure from the writer, not decoding
+    return table_name, filename, rows, time.perf_counter() - start - blocked
+
 
 class DrugETL:
     def __init__(self, db_class):
         self.db = db_class
 
-    def load_csv_to_db(self):
+    def _write_batches(self, in_queue, inserted, failed, errors):
+        """
+        Consumer, the only thread that touches SQLite. Inserts batches until the None sentinel,
+        with the indexes dropped, and builds them once the load is in. Insert counts and times
+        go to `inserted`, which only this thread writes.
+        On any error other than a per-table OperationalError it records the error in `errors`,
+        sets `failed` and keeps draining the queue so producers blocked on it can finish;
+        the load is then rolled back.
+        """
         conn = self.db.get_connection()
         cursor = conn.cursor()
-
-        def get_path(filename):
-            return os.path.join(DATA_DIR, filename)
-
-        print("Starting Full ETL Process...")
-
-        def load_table(filename, table_name, csv_keys, db_columns=None):
-            """
-            Generic loader for standard CSVs.
-            """
-            p = get_path(filename)
-            if not os.path.exists(p):
-                print(f"Skipping {filename} (not found)")
-                return
-
-            if db_columns is None:
-                db_columns = csv_keys
-
-            print(f"Loading {table_name}...")
-            with open(p, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                to_db = []
-                for row in reader:
-                    # Safely get data, defaulting to empty string if missing
-                    data = tuple(row.get(k, '') for k in csv_keys)
-                    to_db.append(data)
-
-            if not to_db:
-                print(f" - No data found in {filename}.")
-                return
-
-            placeholders = ', '.join(['?'] * len(db_columns))
-            query = f"INSERT INTO {table_name} ({', '.join(db_columns)}) VALUES ({placeholders})"
-
+        try:
+            # sqlite3 commits DDL immediately outside a transaction, so open one first:
+            # a failed load then restores the indexes along with the data
+            cursor.execute('BEGIN')
+            self.db.drop_indexes(cursor)
+            while True:
+                item = in_queue.get()
+                if item is None:
+                    break
+                if failed.is_set():
+                    continue
+
+                table_name, query, batch = item
+                start = time.perf_counter()
+                try:
+                    cursor.executemany(query, batch)
+                except sqlite3.OperationalError as e:
+                    print(f"Error loading {table_name}: {e}")
+                except Exception as e:
+                    print(f"Error loading {table_name}, rolling back the load: {e}")
+                    errors.append(e)
+                    failed.set()
+                    continue
+                inserted[table_name]['insert_s'] += time.perf_counter() - start
+                inserted[table_name]['inserted'] += len(batch)
+
+            if not failed.is_set():
+                start = time.perf_counter()
+                self.db.create_indexes(cursor)
+                print(f"Indexes built in {time.perf_counter() - start:.2f}s")
+                self.db.bump_data_version(cursor)
+                conn.commit()
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+            # Decoder processes cannot see `failed` and block on the bounded queue until it is read
             try:
-                cursor.executemany(query, to_db)
-            except sqlite3.OperationalError as e:
-                print(f"Error loading {table_name}: {e}")
-                # Optional: raise e if you want to stop on error
-
-        # Load Drugs (Custom logic for PRIMARY KEY replacement)
-        path = get_path('drugs.csv')
-        if os.path.exists(path):
-            print("Loading Drugs...")
-            with open(path, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                keys = ['drugbank_id', 'name', 'type', 'cas_number', 'groups', 'description', 'moa', 'half_life',
-                        'clearance']
-                to_db = [tuple(row.get(k, '') for k in keys) for row in reader]
-
-            # Using INSERT OR REPLACE to handle potential re-runs
-            placeholders = ', '.join(['?'] * len(keys))
-            cursor.executemany(
-                f"INSERT OR REPLACE INTO drugs ({', '.join(keys)}) VALUES ({placeholders})",
-                to_db
-            )
-        else:
-            print(f"Skipping drugs.csv (not found)")
-
-        # 2. Indications
-        load_table('drug_indications.csv', 'indications',
-                   csv_keys=['drugbank_id', 'indication_text'])
-
-        # 3. Interactions
-        load_table('drug_interactions.csv', 'interactions',
-                   csv_keys=['drugbank_id', 'target_drug_id', 'target_drug_name', 'description'])
-
-        # 4. Food Interactions
-        load_table('food_interactions.csv', 'food_interactions',
-                   csv_keys=['drugbank_id', 'interaction_text'])
+                while in_queue.get() is not None:
+                    pass
+            except Exception:
+                pass
+        finally:
+            if failed.is_set():
+                conn.rollback()
+            conn.close()
+
+    def load_csv_to_db(self, workers=ETL_WORKERS, data_dir=DATA_DIR, precompute_regimens=True):
+        """
+        Producer/consumer load: worker processes decode and transform the CSVs in
+        `data_dir`, a single writer thread inserts the batches. Returns per-table stats.
+        Raises the writer's error, with nothing committed, if an insert failed.
+        The load bumps the data version, which invalidates every precomputed regimen, so they
+        are rebuilt afterwards unless precompute_regimens=False.
+        """
+        print(f"Starting Full ETL Process ({workers} decoder processes)...")
+        wall_start = time.perf_counter()
+
+        stats = defaultdict(lambda: {'rows': 0, 'decode_s': 0.0, 'inserted': 0, 'insert_s': 0.0})
+        inserted = defaultdict(lambda: {'inserted': 0, 'insert_s': 0.0})
+        failed = threading.Event()
+        errors = []
+
+        # Largest files first so the big tables start decoding while the small ones fill the gaps
+        def file_size(spec):
+            p = os.path.join(data_dir, spec[0])
+            return os.path.getsize(p) if os.path.exists(p) else 0
+
+        specs = sorted(TABLE_SPECS, key=file_size, reverse=True)
+
+        with multiprocessing.Manager() as manager:
+            batches = manager.Queue(maxsize=QUEUE_DEPTH)
+            writer = threading.Thread(target=self._write_batches, args=(batches, inserted, failed, errors))
+            writer.start()
 
-        # 5. Toxicity
-        load_table('drug_toxicity.csv', 'toxicity',
-                   csv_keys=['drugbank_id', 'toxicity_text'])
-
-        # 6. Synonyms
-        load_table('drug_synonyms.csv', 'synonyms',
-                   csv_keys=['drugbank_id', 'synonym', 'language', 'coder'])
-
-        # 7. SNP Adverse Reactions
-        load_table('snp_adverse_reactions.csv', 'snp_adverse_reactions',
-                   csv_keys=['drugbank_id', 'protein_name', 'gene_symbol', 'adverse_reaction', 'description'])
-
-        # 8. Enzymes
-        load_table('drug_enzymes.csv', 'enzymes',
-                   csv_keys=['drugbank_id', 'enzyme_id', 'enzyme_name', 'organism', 'action', 'inhibition_strength',
-                             'induction_strength'])
-
-        # 9. Targets
-        load_table('drug_targets.csv', 'targets',
-                   csv_keys=['drugbank_id', 'target_id', 'target_name', 'organism', 'known_action'])
-
-        # 10. Prices
-        price_path = get_path('drug_prices.csv')
-        if os.path.exists(price_path):
-            print("Loading Prices (Selecting representative price per drug)...")
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(decode_table, spec, data_dir, batches, BATCH_SIZE) for spec in specs]
+                    for future in futures:
+                        table_name, filename, rows, decode_s = future.result()
+                        if rows is None:
+                            print(f"Skipping {filename} (not found)")
+                            continue
+                        if not rows:
+                            print(f" - No data found in {filename}.")
+                        stats[table_name]['rows'] = rows
+                        stats[table_name]['decode_s'] = decode_s
+            except BaseException:
+                failed.set()
+                raise
+            finally:
+                batches.put(None)
+                writer.join()
+
+        if errors:
+            raise errors[0]
+        for table_name, counts in inserted.items():
+            stats[table_name].update(counts)
+
+        wall = time.perf_counter() - wall_start
+        self._report(stats, wall)
+
+        if precompute_regimens:
+            import precompute
+            precompute.regenerate(self.db.db_name)
+        return dict(stats)
+
+    def reselect_prices(self):
+        """
+        SQL variant of select_prices for data that is already loaded: keeps one
+        row per drug in `prices` using the same USD / unit rank / cost ordering.
+        """
+        conn = self.db.get_connection()
+        conn.create_function('rank_unit', 1, lambda u: rank_unit(u or ''), deterministic=True)
+        conn.create_function('parse_cost', 1, lambda c: parse_cost(c or ''), deterministic=True)
+        cursor = conn.cursor()
 
-            # Helper to clean price string to float
-            def parse_cost(c_str):
-                try:
-                    return float(re.sub(r'[^\d.]', '', c_str))
-                except:
-                    return float('inf')
-
-            # Helper to rank units, lower is better
-            def rank_unit(u_str):
-                u = u_str.lower()
-                if 'tablet' in u or 'capsule' in u: return 1
-                if 'ml' in u or 'liquid' in u or 'solution' in u: return 2
-                return 3
-
-            price_map = defaultdict(list)
-
-            with open(price_path, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    did = row.get('drugbank_id')
-                    if did:
-                        price_map[did].append(row)
-
-            to_db_prices = []
-
-            for did, entries in price_map.items():
-                # Filter for USD if available
-                usd_entries = [e for e in entries if e.get('currency') == 'USD']
-                candidates = usd_entries if usd_entries else entries
-
-                # Sort by Unit Rank (Tablet first), then Cost (Lowest first)
-                candidates.sort(key=lambda x: (
-                    rank_unit(x.get('unit', '')),
-                    parse_cost(x.get('cost', ''))
-                ))
-
-                # Select best candidate
-                best = candidates[0]
-                to_db_prices.append((
-                    best['drugbank_id'],
-                    best.get('description', ''),
-                    best.get('cost', ''),
-                    best.get('currency', ''),
-                    best.get('unit', '')
-                ))
-
-            cursor.executemany(
-                "INSERT INTO prices (drugbank_id, description, cost, currency, unit) VALUES (?, ?, ?, ?, ?)",
-                to_db_prices
+        cursor.execute("DELETE FROM prices WHERE drugbank_id IS NULL OR drugbank_id = ''")
+        cursor.execute('''
+            DELETE FROM prices WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY drugbank_id
+                        ORDER BY CASE WHEN currency = 'USD' THEN 0 ELSE 1 END,
+                                 rank_unit(unit), parse_cost(cost), rowid
+                    ) AS rn
+                    FROM prices
+                ) WHERE rn > 1
             )
-        else:
-            print("Skipping drug_prices.csv (not found)")
-
-        # 11. Products
-        load_table('drug_products.csv', 'products',
-                   csv_keys=['drugbank_id', 'product_name', 'labeller', 'dosage_form', 'strength', 'route', 'country'])
-
-        # 12. Categories
-        load_table('drug_categories.csv', 'categories',
-                   csv_keys=['drugbank_id', 'category', 'mesh_id'])
-
-        # 13. Transporters
-        load_table('drug_transporters.csv', 'transporters',
-                   csv_keys=['drugbank_id', 'transporter_id', 'transporter_name', 'organism', 'actions'])
-
-        # 14. Carriers
-        load_table('drug_carriers.csv', 'carriers',
-                   csv_keys=['drugbank_id', 'carrier_id', 'carrier_name', 'organism', 'actions'])
-
-        # 15. Pathways
-        load_table('drug_pathways.csv', 'pathways',
-                   csv_keys=['drugbank_id', 'smpdb_id', 'pathway_name', 'category'])
+        ''')
+        removed = cursor.rowcount
+        self.db.bump_data_version(cursor)
+        conn.commit()
+        conn.close()
+        print(f"Prices reselected: removed {removed} non-representative rows.")
+        return removed
 
-        # 16. Dosages
-        load_table('drug_dosages.csv', 'dosages',
-                   csv_keys=['drugbank_id', 'form', 'route', 'strength'])
+    @staticmethod
+    def _report(stats, wall):
+        def rate(rows, seconds):
+            return f"{rows / seconds:>10,.0f}/s" if seconds > 0 else f"{'-':>12}"
 
-        # 17. ATC Codes
-        load_table('drug_atc_codes.csv', 'atc_codes',
-                   csv_keys=['drugbank_id', 'atc_code', 'level_1', 'level_2', 'level_3', 'level_4'])
+        print(f"{'table':<24}{'rows':>10}{'decode':>12}{'insert':>12}")
+        for table_name, s in sorted(stats.items(), key=lambda kv: -kv[1]['rows']):
+            print(f"{table_name:<24}{s['rows']:>10,}{rate(s['rows'], s['decode_s'])}"
+                  f"{rate(s['inserted'], s['insert_s'])}")
 
-        conn.commit()
-        conn.close()
-        print("Full ETL Complete. All files loaded.")
+        total_rows = sum(s['rows'] for s in stats.values())
+        print(f"Full ETL Complete. {total_rows:,} rows in {wall:.2f}s wall clock "
+              f"({rate(total_rows, wall).strip()} end-to-end).")
 
 
 if __name__ == "__main__":
@@ -205,4 +351,4 @@ if __name__ == "__main__":
     db.create_schema()
 
     etl = DrugETL(db)
-    etl.load_csv_to_db()
\ No newline at end of file
+    etl.load_csv_to_db()
@@ -57,7 +57,7 @@ export default function InteractiveGraph({ data, height = 800 }) {
     const processedLinks = data.links.map(link => {
       const sourceId = typeof link.source === 'object' ? link.source.id : link.source;
       const targetId = typeof link.target === 'object' ? link.target.id : link.target;
-      return { source: sourceId, target: targetId };
+      return { source: sourceId, target: targetId, type: link.type || 'coverage' };
     });
     setLinks(processedLinks);
 
@@ -122,6 +122,8 @@ export default function InteractiveGraph({ data, height = 800 }) {
          <div>• Drag nodes</div>
          <div>• Hover to focus</div>
          <div>• Scroll to zoom</div>
+         <div className="mt-1"><span className="text-red-500">━</span> Direct interaction</div>
+         <div><span className="text-amber-500">┅</span> Metabolic conflict</div>
       </div>
 
       {/* Main SVG Canvas */}
@@ -147,6 +149,10 @@ export default function InteractiveGraph({ data, height = 800 }) {
               link.source !== hoveredNode &&
               link.target !== hoveredNode;
 
+            // Conflict edges: direct interactions in red, metabolic (CYP450) clashes dashed amber
+            const isConflict = link.type === 'direct' || link.type === 'metabolic';
+            const color = link.type === 'direct' ? "#ef4444" : link.type === 'metabolic' ? "#f59e0b" : "#cbd5e1";
+
             return (
               <line
                 key={i}
@@ -154,9 +160,10 @@ export default function InteractiveGraph({ data, height = 800 }) {
                 y1={sourceNode.y}
                 x2={targetNode.x}
                 y2={targetNode.y}
-                stroke={isDimmed ? "#e2e8f0" : "#cbd5e1"}
-                strokeWidth={isDimmed ? 1 : 2}
-                strokeOpacity={isDimmed ? 0.2 : 0.6}
+                stroke={isDimmed ? "#e2e8f0" : color}
+                strokeWidth={isDimmed ? 1 : (isConflict ? 1.5 : 2)}
+                strokeDasharray={link.type === 'metabolic' ? "4 3" : undefined}
+                strokeOpacity={isDimmed ? 0.2 : (isConflict && !hoveredNode ? 0.25 : 0.6)}
                 className="transition-all duration-300"
               />
             );
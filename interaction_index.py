@@ -0,0 +1,180 @@
+import sqlite3
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from cache import DataVersion
+from metrics import log
+
+CYP_ROLES = ('substrate', 'inhibitor', 'inducer')
+
+
+class InteractionIndex:
+    """
+    In-memory neighbour index over the whole interaction graph, for conflict checks
+    against a patient's current medications. Drugs are numbered by sorted DrugBank id:
+    direct interactions are a CSR of sorted int32 neighbour arrays, and CYP450 roles
+    are sorted int32 drug arrays per (enzyme, role). Built on first use and rebuilt
+    when the database version changes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.data_version = DataVersion(db_path)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        version = self.data_version.current()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build()
+                    self._version = version
+
+    def _build(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # 1. Drug numbering and name/synonym lookup
+        cursor.execute("SELECT drugbank_id, name FROM drugs ORDER BY drugbank_id")
+        rows = cursor.fetchall()
+        ids = [rid for rid, _ in rows]
+        number = {rid: i for i, rid in enumerate(ids)}
+        names = {}
+        cursor.execute("SELECT drugbank_id, synonym FROM synonyms")
+        for rid, synonym in cursor.fetchall():
+            if synonym and rid in number:
+                names.setdefault(synonym.lower().strip(), rid)
+        for rid, name in rows:
+            if name:
+                names[name.lower().strip()] = rid  # Names win over synonyms
+
+        # 2. Direct interactions, symmetrized
+        cursor.execute("SELECT drugbank_id, target_drug_id FROM interactions")
+        src, dst = [], []
+        for da, db in cursor.fetchall():
+            if da in number and db in number and da != db:
+                src.append(number[da])
+                dst.append(number[db])
+        a, b = np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32)
+        src, dst = np.concatenate([a, b]), np.concatenate([b, a])
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+        keep = np.ones(len(src), dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        src, dst = src[keep], dst[keep]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(ids)))]).astype(np.int64)
+
+        # 3. CYP450 roles, same reading of `action` as DrugOptimizer._get_enzyme_roles
+        cursor.execute('''
+            SELECT drugbank_id, enzyme_name, action
+            FROM enzymes
+            WHERE organism = 'Humans' OR organism IS NULL OR organism = ''
+        ''')
+        roles = defaultdict(lambda: defaultdict(set))
+        drug_roles = defaultdict(set)
+        for rid, enzyme, action in cursor.fetchall():
+            if rid not in number:
+                continue
+            action_lower = action.lower() if action else ""
+            for role in CYP_ROLES:
+                if role in action_lower:
+                    roles[enzyme][role].add(number[rid])
+                    drug_roles[number[rid]].add((enzyme, role))
+        conn.close()
+
+        self.ids = ids
+        self.number = number
+        self.names = names
+        self.indptr = indptr
+        self.direct = dst
+        self.roles = {enz: {role: np.array(sorted(members), dtype=np.int32) for role, members in r.items()}
+                      for enz, r in roles.items()}
+        self.drug_roles = dict(drug_roles)
+        log(f"Interaction index: {len(ids)} drugs, {len(dst) // 2} direct pairs, {len(roles)} enzymes")
+
+    def resolve(self, medications):
+        """Maps DrugBank ids or names/synonyms to ids. Returns (ids, unresolved)."""
+        self._ensure()
+        resolved, unresolved = [], []
+        for med in medications:
+            key = med.strip()
+            rid = key.upper() if key.upper() in self.number else self.names.get(key.lower())
+            if rid is None:
+                unresolved.append(med)
+            elif rid not in resolved:
+                resolved.append(rid)
+        return resolved, unresolved
+
+    def _direct_neighbours(self, i):
+        return self.direct[self.indptr[i]:self.indptr[i + 1]]
+
+    def _metabolic_neighbours(self, i):
+        # Substrates conflict with inhibitors/inducers of the same enzyme, and vice versa
+        parts = []
+        for enzyme, role in self.drug_roles.get(i, ()):
+            partners = ('inhibitor', 'inducer') if role == 'substrate' else ('substrate',)
+            parts.extend(self.roles[enzyme][p] for p in partners if p in self.roles[enzyme])
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        neighbours = np.unique(np.concatenate(parts))
+        return neighbours[neighbours != i]
+
+    def conflicts(self, medications, candidates):
+        """
+        Conflicts between each medication and the candidates.
+        Returns {candidate: {medication: 'direct' | 'metabolic'}} for conflicting candidates only.
+        """
+        self._ensure()
+        known = [c for c in candidates if c in self.number]
+        cand = np.array([self.number[c] for c in known], dtype=np.int32)
+        found = defaultdict(dict)
+        if not len(cand):
+            return found
+
+        for med in medications:
+            if med not in self.number:
+                continue
+            i = self.number[med]
+            direct = self._direct_neighbours(i)
+            metabolic = self._metabolic_neighbours(i)
+            hit_direct = np.isin(cand, direct)
+            hit_metabolic = np.isin(cand, metabolic) & ~hit_direct
+            for k in np.flatnonzero(hit_direct):
+                found[known[k]][med] = 'direct'
+            for k in np.flatnonzero(hit_metabolic):
+                found[known[k]][med] = 'metabolic'
+        return found
+
+    def pairs(self, candidates):
+        """
+        Conflict pairs among the candidates, as sorted id tuples like _get_conflicts.
+        Returns (direct, metabolic); a pair that is both counts as direct.
+        """
+        self._ensure()
+        known = [c for c in candidates if c in self.number]
+        cand = np.array(sorted(self.number[c] for c in known), dtype=np.int32)
+        direct, metabolic = set(), set()
+        if not len(cand):
+            return direct, metabolic
+
+        # 1. Direct: each candidate's neighbour slice intersected with the candidates
+        for i in cand:
+            for j in np.intersect1d(self._direct_neighbours(i), cand, assume_unique=True):
+                if i < j:
+                    direct.add(tuple(sorted((self.ids[i], self.ids[j]))))
+
+        # 2. Metabolic: substrates against inhibitors/inducers of the same enzyme
+        by_enzyme = defaultdict(lambda: defaultdict(list))
+        for i in cand:
+            for enzyme, role in self.drug_roles.get(int(i), ()):
+                by_enzyme[enzyme][role].append(self.ids[i])
+        for roles in by_enzyme.values():
+            for sub in roles['substrate']:
+                for other in roles['inhibitor'] + roles['inducer']:
+                    pair = tuple(sorted((sub, other)))
+                    if sub != other and pair not in direct:
+                        metabolic.add(pair)
+        return direct, metabolic
@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from database import DrugDatabase
+from drugbank_parser import parse_drugbank_xml
+from etl import DrugETL
+from synthetic_drugbank import DEFAULT_VOCABULARY, SyntheticDrugBank
+
+# Port the harness starts uvicorn on
+LOADTEST_PORT = 8765
+
+# Relative weight of each scenario in the request mix
+DEFAULT_MIX = {'optimize': 6, 'optimize_greedy': 2, 'graph': 2, 'optimize_text': 1}
+
+# Conditions requests are drawn from (1-4 per request); present in real and synthetic data
+CONDITION_POOL = DEFAULT_VOCABULARY[:24]
+
+# Default SLOs, applied to every scenario and to the whole mix ('all')
+DEFAULT_SLOS = {'p95_ms': 2000.0, 'p99_ms': 5000.0, 'error_rate': 0.01}
+
+# Seconds to wait for uvicorn to answer its health check
+STARTUP_TIMEOUT = 120
+
+# Open loop: arrivals beyond this many in-flight requests are counted as errors, not sent
+MAX_INFLIGHT = 1000
+
+
+def random_conditions(rng):
+    return rng.sample(CONDITION_POOL, rng.randint(1, 4))
+
+
+def random_text(rng):
+    conditions = random_conditions(rng)
+    listed = conditions[0] if len(conditions) == 1 else f"{', '.join(conditions[:-1])} and {conditions[-1]}"
+    return f"Patient presents with {listed}. Symptoms started two weeks ago."
+
+
+# scenario -> (method, path, body factory)
+SCENARIOS = {
+    'optimize': ('POST', '/optimize', lambda rng: {'conditions': random_conditions(rng), 'mode': 'ilp'}),
+    'optimize_greedy': ('POST', '/optimize', lambda rng: {'conditions': random_conditions(rng), 'mode': 'greedy'}),
+    'optimize_text': ('POST', '/optimize/text', lambda rng: {'text': random_text(rng)}),
+    'graph': ('POST', '/graph', lambda rng: {'conditions': random_conditions(rng)}),
+}
+
+
+def parse_mix(text):
+    """'optimize=6,graph=2' -> {'optimize': 6.0, 'graph': 2.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_slos(text):
+    """'p95_ms=800,optimize.p99_ms=3000' -> {'all': {'p95_ms': 800}, 'optimize': {'p99_ms': 3000}}"""
+    slos = {}
+    for part in text.split(','):
+        key, _, value = part.partition('=')
+        scenario, _, metric = key.strip().rpartition('.')
+        if metric not in DEFAULT_SLOS:
+            raise argparse.ArgumentTypeError(f"unknown SLO {metric!r} (choose from {', '.join(DEFAULT_SLOS)})")
+        slos.setdefault(scenario or 'all', {})[metric] = float(value)
+    return slos
+
+
+def server_total_ms(header):
+    """The total;dur= entry of a Server-Timing header, or None."""
+    for part in header.split(','):
+        name, _, dur = part.strip().partition(';dur=')
+        if name == 'total' and dur:
+            return float(dur)
+    return None
+
+
+class HttpClient:
+    """
+    Minimal asyncio HTTP/1.1 client for JSON requests to one host. With keepalive,
+    connections are reused between requests; without it every request opens a new one.
+    """
+
+    def __init__(self, host, port, keepalive=True, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._idle = []
+
+    async def _connection(self):
+        if self._idle:
+            return self._idle.pop()
+        self.connections_opened += 1
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def _read_response(self, reader):
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        else:
+            body = await reader.read()
+        return status, headers, body
+
+    async def request(self, method, path, payload=None):
+        """Returns (status, headers, body)."""
+        body = json.dumps(payload).encode() if payload is not None else b''
+        reader, writer = await self._connection()
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if self.keepalive else 'close'}\r\n\r\n")
+        try:
+            writer.write(head.encode() + body)
+            await writer.drain()
+            status, headers, data = await asyncio.wait_for(self._read_response(reader), self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        if self.keepalive and headers.get('connection', '').lower() != 'close':
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return status, headers, data
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class LoadGenerator:
+    """
+    Sends the request mix to a running server and records one sample per request:
+    (scenario, start offset s, latency s, status, server total ms).
+    """
+
+    def __init__(self, host, port, mix, keepalive=True, timeout=30.0, seed=1):
+        self.host = host
+        self.port = port
+        self.mix = mix
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+
+    def _pick(self):
+        name = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        method, path, body = SCENARIOS[name]
+        return name, method, path, body(self.rng)
+
+    async def _send(self, client, samples, origin, scheduled=None):
+        name, method, path, payload = self._pick()
+        start = time.perf_counter()
+        # Open loop measures from the scheduled arrival, so time spent queued counts as latency
+        began = scheduled if scheduled is not None else start
+        try:
+            status, headers, _ = await client.request(method, path, payload)
+            server_ms = server_total_ms(headers.get('server-timing', ''))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status, server_ms = 0, None
+        samples.append((name, began - origin, time.perf_counter() - began, status, server_ms))
+
+    async def closed_loop(self, concurrency, duration):
+        """`concurrency` clients, each sending its next request when the previous one returns."""
+        samples = []
+        client = HttpClient(self.host, self.port, self.keepalive, self.timeout)
+        origin = time.perf_counter()
+
+        async def user():
+            while time.perf_counter() - origin < duration:
+                await self._send(client, samples, origin)
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        client.close()
+        return samples, client.connections_opened
+
+    async def open_loop(self, rate, duration, max_inflight=MAX_INFLIGHT):
+        """Poisson arrivals at `rate` per second, sent whether or not earlier requests have returned."""
+        samples = []
+        client = HttpClient(self.host, self.port, self.keepalive, self.timeout)
+        origin = time.perf_counter()
+        inflight = set()
+        arrival = origin
+
+        while True:
+            arrival += self.rng.expovariate(rate)
+            if arrival - origin >= duration:
+                break
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            if len(inflight) >= max_inflight:
+                samples.append((self._pick()[0], arrival - origin, 0.0, 0, None))
+                continue
+            task = asyncio.ensure_future(self._send(client, samples, origin, scheduled=arrival))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+
+        if inflight:
+            await asyncio.wait(inflight)
+        client.close()
+        return samples, client.connections_opened
+
+
+def summarize(samples, duration, warmup=0.0):
+    """Per scenario and overall ('all'): throughput, latency percentiles and error rate."""
+    kept = [s for s in samples if s[1] >= warmup]
+    window = max(duration - warmup, 1e-9)
+    groups = {'all': kept}
+    for sample in kept:
+        groups.setdefault(sample[0], []).append(sample)
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = np.array([s[2] for s in group]) * 1000
+        errors = sum(1 for s in group if not 200 <= s[3] < 300)
+        server = [s[4] for s in group if s[4] is not None]
+        summary[name] = {
+            'requests': len(group),
+            'throughput_rps': round(len(group) / window, 2),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 1) if len(group) else None,
+            'p95_ms': round(float(np.percentile(latencies, 95)), 1) if len(group) else None,
+            'p99_ms': round(float(np.percentile(latencies, 99)), 1) if len(group) else None,
+            'error_rate': round(errors / len(group), 4) if group else 0.0,
+            'server_p50_ms': round(float(np.percentile(server, 50)), 1) if server else None,
+        }
+    return summary
+
+
+def check_slos(summary, slos):
+    """Returns [(scenario, metric, limit, value)] for every SLO that is violated."""
+    failures = []
+    for name, stats in summary.items():
+        limits = dict(slos.get('all', {}), **slos.get(name, {}))
+        for metric, limit in limits.items():
+            value = stats.get(metric)
+            if value is not None and value > limit:
+                failures.append((name, metric, limit, value))
+    return failures
+
+
+def build_fixture(work_dir, drugs, interactions=20, seed=1):
+    """Synthetic database in work_dir (DB at work_dir/drug_project.db). Returns its path."""
+    data_dir = os.path.join(work_dir, 'data')
+    db_path = os.path.join(work_dir, 'drug_project.db')
+    xml_path = SyntheticDrugBank(drugs, interactions, seed=seed).write(os.path.join(data_dir, 'database.xml'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        parse_drugbank_xml(xml_path, data_dir)
+        db = DrugDatabase(db_path)
+        db.create_schema()
+        DrugETL(db).load_csv_to_db(data_dir=data_dir)
+    return db_path
+
+
+@contextlib.contextmanager
+def local_server(work_dir, port=LOADTEST_PORT, workers=1):
+    """
+    Runs uvicorn on the drug_project.db in work_dir. Server output goes to work_dir/server.log.
+    Yields the process once the health check answers.
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [repo, os.environ.get('PYTHONPATH')])))
+    with open(os.path.join(work_dir, 'server.log'), 'w') as server_log:
+        proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1',
+                                 '--port', str(port), '--workers', str(workers), '--log-level', 'warning'],
+                                cwd=work_dir, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+        try:
+            asyncio.run(wait_until_up('127.0.0.1', port, proc))
+            yield proc
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+async def wait_until_up(host, port, proc, timeout=STARTUP_TIMEOUT):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {proc.returncode} (see server.log)")
+        client = HttpClient(host, port, keepalive=False, timeout=5)
+        try:
+            status, _, _ = await client.request('GET', '/')
+            if status == 200:
+                return
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"server did not answer on {host}:{port} within {timeout}s")
+
+
+async def available_mix(host, port, mix):
+    """Drops optimize_text from the mix when the server has no NLP model (it answers 503)."""
+    if 'optimize_text' not in mix:
+        return mix
+    client = HttpClient(host, port, keepalive=False)
+    status, _, _ = await client.request('POST', '/optimize/text', {'text': 'headache'})
+    if status == 503:
+        print("⚠️ /optimize/text is unavailable (NLP model not installed), dropping it from the mix")
+        return {name: w for name, w in mix.items() if name != 'optimize_text'}
+    return mix
+
+
+def run(host, port, mix, levels, loop='closed', duration=30.0, warmup=5.0, slos=None, keepalive=True,
+        timeout=30.0, seed=1):
+    """
+    Runs one stage per level (concurrency for a closed loop, requests/s for an open loop).
+    Returns the per-stage results and the SLO failures.
+    """
+    slos = slos or {}
+    mix = asyncio.run(available_mix(host, port, mix))
+    generator = LoadGenerator(host, port, mix, keepalive, timeout, seed)
+    results, failures = [], []
+
+    for level in levels:
+        if loop == 'closed':
+            samples, connections = asyncio.run(generator.closed_loop(int(level), duration))
+        else:
+            samples, connections = asyncio.run(generator.open_loop(float(level), duration))
+        summary = summarize(samples, duration, warmup)
+        stage_failures = check_slos(summary, slos)
+        results.append({'loop': loop, 'level': level, 'connections_opened': connections, 'summary': summary,
+                        'slo_failures': [dict(zip(('scenario', 'metric', 'limit', 'value'), f))
+                                         for f in stage_failures]})
+        failures += [(level,) + f for f in stage_failures]
+        print_stage(loop, level, summary, connections)
+    return results, failures
+
+
+def print_stage(loop, level, summary, connections):
+    unit = 'concurrency' if loop == 'closed' else 'rate'
+    print(f"\n{loop} loop, {unit} {level} ({connections} connections opened)")
+    columns = ['requests', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate', 'server_p50_ms']
+    print(f"{'scenario':<16}" + "".join(f"{c:>16}" for c in columns))
+    for name in sorted(summary, key=lambda n: (n == 'all', n)):
+        print(f"{name:<16}" + "".join(f"{'-' if summary[name][c] is None else summary[name][c]:>16}"
+                                      for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API against a local uvicorn")
+    parser.add_argument('--url', help="Target an already running server (host:port) instead of starting one")
+    parser.add_argument('--db', help="Fixture database to copy (default: build a synthetic one)")
+    parser.add_argument('--drugs', type=int, default=2000, help="Synthetic fixture size")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument('--port', type=int, default=LOADTEST_PORT)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="Scenario weights, e.g. optimize=6,optimize_greedy=2,graph=2,optimize_text=1")
+    parser.add_argument('--loop', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--levels', type=lambda s: [float(x) for x in s.split(',')], default=[1, 4, 16],
+                        help="Concurrency levels (closed loop) or arrival rates per second (open loop)")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds per level")
+    parser.add_argument('--warmup', type=float, default=5, help="Leading seconds of each level left out")
+    parser.add_argument('--no-keepalive', action='store_true', help="Open a new connection per request")
+    parser.add_argument('--timeout', type=float, default=30, help="Per-request timeout (seconds)")
+    parser.add_argument('--slo', type=parse_slos, default={},
+                        help="SLO overrides, e.g. p95_ms=800,error_rate=0.001,graph.p99_ms=500")
+    parser.add_argument('--output', default='loadtest_results.json')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    slos = {'all': dict(DEFAULT_SLOS, **args.slo.get('all', {}))}
+    slos.update({name: limits for name, limits in args.slo.items() if name != 'all'})
+    levels = [int(level) if args.loop == 'closed' else level for level in args.levels]
+    options = dict(loop=args.loop, duration=args.duration, warmup=args.warmup, slos=slos,
+                   keepalive=not args.no_keepalive, timeout=args.timeout, seed=args.seed)
+
+    if args.url:
+        host, _, port = args.url.rpartition(':')
+        results, failures = run(host or '127.0.0.1', int(port), args.mix, levels, **options)
+    else:
+        work_dir = tempfile.mkdtemp(prefix='regimen-load-')
+        try:
+            if args.db:
+                shutil.copy(args.db, os.path.join(work_dir, 'drug_project.db'))
+            else:
+                print(f"Building a synthetic fixture database ({args.drugs} drugs)...")
+                build_fixture(work_dir, args.drugs, seed=args.seed)
+            with local_server(work_dir, args.port, args.workers):
+                results, failures = run('127.0.0.1', args.port, args.mix, levels, **options)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({'params': {k: v for k, v in vars(args).items() if k != 'slo'}, 'slos': slos,
+                   'results': results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if failures:
+        for level, name, metric, limit, value in failures:
+            print(f"❌ SLO failed at level {level}: {name} {metric} = {value} (limit {limit})")
+        sys.exit(1)
+    print("✅ All SLOs met.")
@@ -0,0 +1,211 @@
+import atexit
+import contextvars
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) for stage and request latency
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Log lines waiting for the writer thread; beyond this they are dropped rather than block
+LOG_QUEUE_SIZE = 10000
+
+HELP = {
+    'regimen_stage_seconds': ('histogram', "Time spent per pipeline stage"),
+    'regimen_request_seconds': ('histogram', "End-to-end request latency per route"),
+    'regimen_requests_total': ('counter', "Requests per route and status code"),
+    'regimen_candidates_total': ('counter', "Candidate drugs considered, summed over requests"),
+    'regimen_conflict_pairs_total': ('counter', "Conflict pairs among candidates, summed over requests"),
+    'regimen_log_dropped_total': ('counter', "Log lines dropped because the log queue was full"),
+}
+
+_request = contextvars.ContextVar('regimen_request', default=None)
+
+
+class RequestTimings:
+    """Spans and per-request values recorded while one request is handled."""
+
+    def __init__(self):
+        self.spans = defaultdict(float)  # stage -> seconds, summed (components may repeat a stage)
+        self.values = {}
+        self.profile = None  # ProfileSession when an admin has asked for this request to be profiled
+        self.captured = {}  # Fields the handler adds to the traffic capture record
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.spans[stage] += seconds
+
+    def server_timing(self, total=None):
+        """Server-Timing header value, durations in milliseconds."""
+        with self._lock:
+            parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.spans.items()]
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class Registry:
+    """Counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)    # (name, labels) -> value
+        self._histograms = {}                  # (name, labels) -> [bucket counts..., sum, count]
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(h) for key, h in self._histograms.items()}
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        for name, (kind, text) in HELP.items():
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            if kind == 'counter':
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{fmt(labels)} {value:g}")
+            else:
+                for (n, labels), h in sorted(histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(self.buckets, h):
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', f'{bound:g}')])} {count}")
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h[-1]}")
+                    lines.append(f"{name}_sum{fmt(labels)} {h[-2]:.6f}")
+                    lines.append(f"{name}_count{fmt(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def start_request():
+    """Starts collecting spans for the current request. Returns (timings, token)."""
+    timings = RequestTimings()
+    return timings, _request.set(timings)
+
+
+def end_request(timings, token, route, status, seconds):
+    _request.reset(token)
+    REGISTRY.observe('regimen_request_seconds', seconds, route=route)
+    REGISTRY.inc('regimen_requests_total', route=route, status=status)
+    for name, value in timings.values.items():
+        REGISTRY.inc(f'regimen_{name}_total', value)
+
+
+def current_request():
+    """RequestTimings of the request being handled, or None outside a request."""
+    return _request.get()
+
+
+def record(stage, seconds):
+    REGISTRY.observe('regimen_stage_seconds', seconds, stage=stage)
+    timings = _request.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def note(name, value):
+    """Per-request value (e.g. candidates); the last one noted counts once per request."""
+    timings = _request.get()
+    if timings is not None:
+        timings.values[name] = value
+    else:
+        REGISTRY.inc(f'regimen_{name}_total', value)
+
+
+def propagate(fn):
+    """
+    Wraps fn so that spans it records in pool threads count toward the calling request,
+    and so the pool threads are profiled along with a profiled request.
+    """
+    timings = _request.get()
+    profile = timings.profile if timings is not None else None
+
+    def run(*args, **kwargs):
+        token = _request.set(timings)
+        try:
+            if profile is not None:
+                with profile.thread():
+                    return fn(*args, **kwargs)
+            return fn(*args, **kwargs)
+        finally:
+            _request.reset(token)
+    return run
+
+
+# --- Non-blocking logging ---
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_thread = None
+_log_lock = threading.Lock()
+
+
+def _write_log():
+    while True:
+        stream, message = _log_queue.get()
+        try:
+            print(message, file=stream, flush=True)
+        except Exception:
+            pass
+        finally:
+            _log_queue.task_done()
+
+
+def log(message):
+    """
+    print() on a background thread. The stream is taken at call time, so callers that
+    redirect stdout (benchmarks, tests) still capture their messages.
+    """
+    global _log_thread
+    if _log_thread is None:
+        with _log_lock:
+            if _log_thread is None:
+                _log_thread = threading.Thread(target=_write_log, name='regimen-log', daemon=True)
+                _log_thread.start()
+    try:
+        _log_queue.put_nowait((sys.stdout, message))
+    except queue.Full:
+        REGISTRY.inc('regimen_log_dropped_total')
+
+
+def flush_log():
+    """Waits until every queued log line is written."""
+    if _log_thread is not None:
+        _log_queue.join()
+
+
+atexit.register(flush_log)
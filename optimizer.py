@@ -1,16 +1,84 @@
 import sqlite3
+import numpy as np
 import pulp
 from collections import defaultdict
 import re
+import os
+import heapq
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from cache import SingleFlight, relabel_conditions, request_key
+from class_index import ClassIndex
+from interaction_index import InteractionIndex
+from metrics import log, note, propagate, record, span
+from rules import RuleEngine
+
+# Objective weights (also part of the response cache key)
+ILP_WEIGHTS = {'count': 1000, 'direct': 500, 'metabolic': 300, 'safety': 5.0, 'price': 0.05}
+GREEDY_WEIGHTS = {'cover': 1000, 'conflict': 500, 'safety': 5.0, 'price': 0.05}
+
+# Independent sub-problems solved concurrently (each CBC run is its own process)
+ILP_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+# Per-condition candidate queries run concurrently (SQLite releases the GIL while a query runs)
+FETCH_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+# Conflict model: 'compact' (star-aggregated, see _build_model) or 'pairwise'.
+# Same optimum; compact is smaller and faster at every size measured by `benchmarks.py formulations`.
+CONFLICT_FORMULATION = 'compact'
+
+# Search terms listed in the rule file's class_terms retrieve that ATC class's drugs from the
+# class index instead of matching indication text (False searches text only)
+CLASS_RETRIEVAL = True
+
+# Interchangeable candidates listed on each selected drug
+MAX_SUBSTITUTES = 10
+
+# Pareto sweep: points between safety-first and price-first weights, and how far
+# each end moves the safety/price ratio away from ILP_WEIGHTS (factor in each direction)
+PARETO_POINTS = 7
+PARETO_SPREAD = 20.0
+
+# /graph: drugs shown per condition unless the request asks otherwise (broad conditions have hundreds)
+GRAPH_TOP_N = 25
+
+# Lagrangian mode: subgradient iteration cap, and the relative gap at which it stops early
+LAGRANGIAN_ITERATIONS = 500
+LAGRANGIAN_TOLERANCE = 1e-4
+
+# Below this much time left before the deadline, CBC is skipped in favour of greedy
+MIN_SOLVE_SECONDS = 0.05
+# Solver outcomes that depend on the deadline and must not be cached
+PARTIAL_STATUSES = {'time_limit', 'greedy_fallback'}
+
+
+def medication_key(weights, medications):
+    """Cache/coalescing weights for a solve, extended with the current medications if any."""
+    if not medications:
+        return weights
+    return dict(weights, medications=sorted({m.lower().strip() for m in medications}))
 
 
 class DrugOptimizer:
-    def __init__(self, db_path):
+    def __init__(self, db_path, cache=None, precomputed=None):
         self.db_path = db_path
+        self.cache = cache
+        self.precomputed = precomputed
+        self.flights = SingleFlight()
+        self.interactions = InteractionIndex(db_path)
+        self.rules = RuleEngine()
+        self.classes = ClassIndex(db_path)
 
     def _get_connection(self):
         return sqlite3.connect(self.db_path)
 
+    def _get_read_connection(self):
+        """Read-only connection, safe to open from worker threads."""
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(self.db_path)) + '?mode=ro'
+        return sqlite3.connect(uri, uri=True)
+
     def _clean_price(self, p_str):
         if not p_str: return 0.0
         clean = re.sub(r'[^\d.]', '', str(p_str))
@@ -29,197 +97,204 @@ class DrugOptimizer:
         if 'minute' in lower: return num / 60
         return num
 
-    def _get_search_terms(self, condition, all_conditions_text):
-        c_lower = condition.lower().strip()
-
-
-        # Bacterial: Removed generic 'antibiotic' to avoid matches like Acetohydroxamic acid)
-        if 'bacterial' in c_lower or 'infection' in c_lower:
-            return [
-                'penicillin', 'cephalosporin', 'fluoroquinolone', 'macrolide',
-                'tetracycline', 'sulfonamide', 'aminoglycoside', 'carbapenem',
-                'nitroimidazole', 'quinolone', 'lincomycin', 'glycopeptide'
-            ]
-
-        # Fungal
-        if 'fungal' in c_lower or 'fungus' in c_lower or 'yeast' in c_lower:
-            return ['antifungal', 'azole', 'echinocandin', 'allylamine']
-
-        # Stomach/GERD
-        if 'gerd' in c_lower or 'reflux' in c_lower:
-            return ['gastroesophageal', 'proton pump inhibitor', 'antacid', 'h2 antagonist']
+    def _condition_query(self, cond, all_conditions_text):
+        """
+        Candidate query for one condition. Returns (query, params, search_terms); the query
+        and params fully determine the rows, so together they key per-condition caches.
+        """
+        # Search terms, route and exclusions come from the rule table (search_rules.json)
+        search_terms, route_pref, exclusions = self.rules.expand(cond, all_conditions_text)
+
+        # Terms the rule file maps to ATC classes are answered from the class index;
+        # only the remaining terms fall back to scanning indication text
+        if CLASS_RETRIEVAL:
+            class_ids, _, text_terms = self.classes.lookup(search_terms, self.rules.class_codes)
+        else:
+            class_ids, text_terms = set(), search_terms
+        class_ids = sorted(class_ids)
+
+        # Exclusions apply to the matching indication and to the drug's MOA/description
+        indication_sql = ""
+        drug_sql = ""
+        drug_params = []
+        if exclusions:
+            # Checks Indication, MOA, and Description for the banned terms
+            indication_sql = " AND " + " AND ".join(["i.indication_text NOT LIKE ?" for _ in exclusions])
+            drug_sql = " AND " + " AND ".join(["(d.moa NOT LIKE ? AND d.description NOT LIKE ?)" for _ in exclusions])
+            for ex in exclusions:
+                drug_params.extend([f'%{ex}%', f'%{ex}%'])
+
+        params = []
+        sources = []
+        if class_ids:
+            # Class members have no matching indication row, so none of their indications may
+            # mention an excluded term (per-drug lookups on idx_indications_drug)
+            class_sql = f"""
+                SELECT c.drugbank_id FROM drugs c
+                WHERE c.drugbank_id IN ({','.join('?' for _ in class_ids)})"""
+            params.extend(class_ids)
+            if exclusions:
+                class_sql += f"""
+                AND NOT EXISTS (
+                    SELECT 1 FROM indications ix
+                    WHERE ix.drugbank_id = c.drugbank_id
+                    AND ({" OR ".join(["ix.indication_text LIKE ?" for _ in exclusions])})
+                )"""
+                params.extend(f'%{ex}%' for ex in exclusions)
+            sources.append(class_sql)
+
+        if text_terms or not class_ids:
+            likes = " OR ".join(["i.indication_text LIKE ?"] * len(text_terms))
+            sources.append(f"""
+                SELECT i.drugbank_id FROM indications i
+                WHERE ({likes})
+                {indication_sql}""")
+            params.extend(f'%{term}%' for term in text_terms)
+            params.extend(f'%{ex}%' for ex in exclusions)
+        params.extend(drug_params)
+
+        route_sql = ""
+        if route_pref:
+            route_sql = """
+                AND EXISTS (
+                    SELECT 1 FROM dosages dos 
+                    WHERE dos.drugbank_id = d.drugbank_id 
+                    AND dos.route LIKE ?
+                )
+            """
+            params.append(f'%{route_pref}%')
+
+        # Slim projection: one row per drug, ids and numeric features only. Text
+        # (description) is loaded later for the drugs that reach a response.
+        query = f"""
+            SELECT d.drugbank_id, d.name, length(t.toxicity_text), p.cost, d.half_life
+            FROM drugs d
+            LEFT JOIN toxicity t ON d.drugbank_id = t.drugbank_id
+            LEFT JOIN prices p ON d.drugbank_id = p.drugbank_id
+            WHERE d.drugbank_id IN ({" UNION ALL ".join(sources)}
+            )
+            {drug_sql}
+            AND d.groups LIKE '%approved%'
+            AND d.groups NOT LIKE '%vet_approved%'
+            AND d.groups NOT LIKE '%withdrawn%'
+            {route_sql}
+            GROUP BY d.drugbank_id
+        """
+        return query, params, search_terms
+
+    def _fetch_candidates(self, original_conditions, context=None, workers=None):
+        """
+        Candidates, coverage and drug info for the conditions. `context` is the full
+        condition list when only some of its conditions are fetched, since search terms
+        and exclusions depend on the other conditions. Conditions are queried concurrently
+        (`workers`, default FETCH_WORKERS) and merged in condition order, so the result
+        matches a sequential fetch.
+        """
+        fetch_start = time.perf_counter()
+        all_conditions_text = " ".join(context or original_conditions).lower()
+        log(f"Fetching drugs for conditions: {original_conditions}")
+
+        def fetch(cond):
+            query, params, search_terms = self._condition_query(cond, all_conditions_text)
+            conn = self._get_read_connection()
+            try:
+                rows = conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                log(f"⚠️ No drugs found for: {cond} (terms: {search_terms})")
+            return rows
 
-        if 'stomach' in c_lower or 'gastric' in c_lower:
-            return ['antacid', 'proton pump inhibitor', 'h2 antagonist', 'gastric']
+        workers = min(workers or FETCH_WORKERS, len(original_conditions))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(propagate(fetch), original_conditions))
+        else:
+            results = [fetch(cond) for cond in original_conditions]
 
-        # Hypertension
-        if 'hypertension' in c_lower or 'blood pressure' in c_lower:
-            if 'asthma' in all_conditions_text or 'copd' in all_conditions_text:
-                return ['antihypertensive', 'ace inhibitor', 'calcium channel blocker', 'diuretic', 'angiotensin']
-            else:
-                return ['antihypertensive', 'ace inhibitor', 'beta blocker', 'calcium channel blocker', 'diuretic']
-
-        # Headache
-        if 'headache' in c_lower or 'migraine' in c_lower:
-            return ['migraine', 'acetaminophen', 'paracetamol', 'triptan', 'nsaid', 'salicylate']
-
-        # --- GENERIC CATEGORY MAPPINGS ---
-        terms = [c_lower]
-        if 'pain' in c_lower or 'ache' in c_lower:
-            terms.extend(['analgesic', 'antinociceptive', 'nsaid', 'acetaminophen', 'paracetamol'])
-        if 'fever' in c_lower:
-            terms.extend(['antipyretic', 'pyrexia', 'acetaminophen', 'paracetamol'])
-        if 'diabetes' in c_lower:
-            terms.extend(['hypoglycemic', 'antidiabetic', 'insulin', 'biguanide', 'sulfonylurea'])
-        if 'anxiety' in c_lower:
-            terms.extend(['anxiolytic', 'benzodiazepine'])
-        if 'insomnia' in c_lower:
-            terms.extend(['sedative', 'hypnotic', 'sleep'])
-        if 'cholesterol' in c_lower:
-            terms.extend(['statin', 'lipid-lowering', 'fibrates'])
-
-        # Added to ensure Mianserin/SSRIs are found correctly
-        if 'depression' in c_lower:
-            terms.extend(['antidepressant', 'ssri', 'snri', 'tricyclic', 'tetracyclic', 'mao inhibitor'])
-
-        return list(set(terms))
-
-    def _get_route_filter(self, condition):
-        c_lower = condition.lower()
-
-        systemic_indicators = [
-            'headache', 'back pain', 'fever', 'diabetes', 'hypertension',
-            'cholesterol', 'gerd', 'stomach', 'anxiety', 'insomnia',
-            'bacterial', 'infection', 'depression'
-        ]
-
-        if any(x in c_lower for x in systemic_indicators):
-            return "oral"
-
-        if any(x in c_lower for x in ['eye', 'ocular', 'glaucoma']):
-            return "ophthalmic"
-        if any(x in c_lower for x in ['skin', 'rash', 'dermatitis', 'topical', 'itch', 'fungal']):
-            return "topical"
-        if 'fungal' in c_lower:
-            return ""
-
-        return "oral"
-
-    def _fetch_candidates(self, original_conditions):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        candidates = set()
+        candidates = {}  # insertion-ordered set
         coverage = defaultdict(set)
         drug_info = {}
+        for cond, rows in zip(original_conditions, results):
+            for rid, name, tox_len, price, hl in rows:
+                candidates[rid] = None
+                coverage[cond].add(rid)
 
-        all_conditions_text = " ".join(original_conditions).lower()
-        print(f"Fetching drugs for conditions: {original_conditions}")
-
-        for cond in original_conditions:
-            search_terms = self._get_search_terms(cond, all_conditions_text)
-            route_pref = self._get_route_filter(cond)
-
-            likes = " OR ".join(["i.indication_text LIKE ?"] * len(search_terms))
-            params = [f'%{term}%' for term in search_terms]
-
-            exclusions = []
-
-            # Cancer Check
-            if 'cancer' not in cond.lower() and 'tumor' not in cond.lower() and 'chemo' not in cond.lower():
-                exclusions.extend(['cancer', 'carcinoma', 'metastatic', 'chemotherapy', 'palliation'])
-
-            # Anesthetic Check
-            if 'pain' in cond.lower() or 'headache' in cond.lower() or 'ache' in cond.lower():
-                exclusions.extend(['anesthetic', 'numbing', 'local anesthesia'])
-
-            # 3. ASTHMA / BETA BLOCKER CHECK
-            if 'asthma' in all_conditions_text or 'copd' in all_conditions_text:
-                exclusions.extend(['beta blocker', 'beta-adrenergic', 'beta-blocker', 'beta antagonist'])
-
-            not_likes_sql = ""
-            if exclusions:
-                # Checks Indication, MOA, and Description for the banned terms
-                not_likes_sql = " AND " + " AND ".join([
-                    f"(i.indication_text NOT LIKE ? AND d.moa NOT LIKE ? AND d.description NOT LIKE ?)"
-                    for _ in exclusions
-                ])
-                for ex in exclusions:
-                    params.extend([f'%{ex}%', f'%{ex}%', f'%{ex}%'])
-
-            route_sql = ""
-            if route_pref:
-                route_sql = f"""
-                    AND EXISTS (
-                        SELECT 1 FROM dosages dos 
-                        WHERE dos.drugbank_id = d.drugbank_id 
-                        AND dos.route LIKE '%{route_pref}%'
-                    )
-                """
-
-            query = f"""
-                SELECT d.drugbank_id, d.name, t.toxicity_text, p.cost, d.description, d.half_life, d.clearance
-                FROM indications i
-                JOIN drugs d ON i.drugbank_id = d.drugbank_id
-                LEFT JOIN toxicity t ON d.drugbank_id = t.drugbank_id
-                LEFT JOIN prices p ON d.drugbank_id = p.drugbank_id
-                WHERE ({likes})
-                {not_likes_sql}
-                AND d.groups LIKE '%approved%'
-                AND d.groups NOT LIKE '%vet_approved%'
-                AND d.groups NOT LIKE '%withdrawn%'
-                {route_sql}
-            """
+                if rid not in drug_info:
+                    drug_info[rid] = self._drug_entry(rid, name, tox_len, price, hl)
 
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
+        record('fetch', time.perf_counter() - fetch_start)
+        return list(candidates), coverage, drug_info
 
-            if not rows:
-                print(f"⚠️ No drugs found for: {cond} (terms: {search_terms})")
+    def _drug_entry(self, rid, name, tox_len, price, hl):
+        hl_val = self._parse_half_life(hl)
+        tox_score = tox_len if tox_len else 500
+        safety_score = (tox_score / 10) + (hl_val * 0.5)
 
-            for rid, name, tox, price, desc, hl, cl in rows:
-                candidates.add(rid)
-                coverage[cond].add(rid)
+        return {
+            'id': rid,
+            'name': name,
+            'toxicity_score': safety_score,
+            'price_val': self._clean_price(price),
+            'half_life': hl_val,
+            'covered_conditions': []
+        }
 
-                if rid not in drug_info:
-                    hl_val = self._parse_half_life(hl)
-                    tox_score = len(tox) if tox else 500
-                    safety_score = (tox_score / 10) + (hl_val * 0.5)
-
-                    drug_info[rid] = {
-                        'id': rid,
-                        'name': name,
-                        'description': desc,
-                        'toxicity_score': safety_score,
-                        'price_val': self._clean_price(price),
-                        'half_life': hl_val,
-                        'covered_conditions': []
-                    }
+    def _fetch_descriptions(self, drug_ids):
+        """Descriptions for the drugs that reach a response (candidate retrieval skips them)."""
+        if not drug_ids: return {}
+        conn = self._get_connection()
+        placeholders = ','.join('?' for _ in drug_ids)
+        rows = conn.execute(f"SELECT drugbank_id, description FROM drugs WHERE drugbank_id IN ({placeholders})",
+                            list(drug_ids)).fetchall()
+        conn.close()
+        return dict(rows)
 
+    def _fetch_drugs(self, drug_ids):
+        """Drug info for specific ids (e.g. current medications), shaped like candidate info."""
+        if not drug_ids: return {}
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' for _ in drug_ids)
+        cursor.execute(f"""
+            SELECT d.drugbank_id, d.name, length(t.toxicity_text), p.cost, d.half_life, d.description
+            FROM drugs d
+            LEFT JOIN toxicity t ON d.drugbank_id = t.drugbank_id
+            LEFT JOIN prices p ON d.drugbank_id = p.drugbank_id
+            WHERE d.drugbank_id IN ({placeholders})
+        """, list(drug_ids))
+        drug_info = {}
+        for rid, name, tox_len, price, hl, desc in cursor.fetchall():
+            drug_info.setdefault(rid, dict(self._drug_entry(rid, name, tox_len, price, hl), description=desc))
         conn.close()
-        return list(candidates), coverage, drug_info
+        return drug_info
 
-    def _get_interaction_graph(self, candidates):
-        """Direct reported interactions from DB."""
+    def _get_interaction_graph(self, candidates, others=None):
+        """Direct reported interactions from DB. With `others`, only pairs between candidates and others."""
         if not candidates: return set()
         conn = self._get_connection()
         cursor = conn.cursor()
-        placeholders = ','.join('?' for _ in candidates)
 
-        query = f'''
-            SELECT drugbank_id, target_drug_id 
-            FROM interactions 
-            WHERE drugbank_id IN ({placeholders}) AND target_drug_id IN ({placeholders})
-        '''
-        cursor.execute(query, candidates * 2)
+        sides = [(candidates, candidates)] if others is None else [(candidates, others), (others, candidates)]
         interactions = set()
-        for da, db in cursor.fetchall():
-            interactions.add(tuple(sorted((da, db))))
+        for left, right in sides:
+            if not left or not right:
+                continue
+            query = f'''
+                SELECT drugbank_id, target_drug_id 
+                FROM interactions 
+                WHERE drugbank_id IN ({','.join('?' for _ in left)}) AND target_drug_id IN ({','.join('?' for _ in right)})
+            '''
+            cursor.execute(query, list(left) + list(right))
+            for da, db in cursor.fetchall():
+                interactions.add(tuple(sorted((da, db))))
         conn.close()
         return interactions
 
-    def _get_enzyme_conflicts(self, candidates):
-        """DETECTS METABOLIC CONFLICTS (CYP450 system)."""
-        if not candidates: return set()
+    def _get_enzyme_roles(self, candidates):
+        """CYP450 roles of each candidate: {enzyme: {'substrate'|'inhibitor'|'inducer': [ids]}}."""
+        enzyme_map = defaultdict(lambda: defaultdict(list))
+        if not candidates: return enzyme_map
         conn = self._get_connection()
         cursor = conn.cursor()
         placeholders = ','.join('?' for _ in candidates)
@@ -230,9 +305,7 @@ class DrugOptimizer:
             WHERE drugbank_id IN ({placeholders})
             AND (organism = 'Humans' OR organism IS NULL OR organism = '')
         '''
-        cursor.execute(query, candidates)
-
-        enzyme_map = defaultdict(lambda: defaultdict(list))
+        cursor.execute(query, list(candidates))
 
         for did, enz, action, inhib, induc in cursor.fetchall():
             action_lower = action.lower() if action else ""
@@ -244,6 +317,11 @@ class DrugOptimizer:
             if 'inducer' in action_lower:
                 enzyme_map[enz]['inducer'].append(did)
 
+        conn.close()
+        return enzyme_map
+
+    def _metabolic_pairs(self, enzyme_map, new=None):
+        """Conflict pairs implied by enzyme roles. With `new`, only pairs involving a drug in new."""
         conflicts = set()
 
         for enz, roles in enzyme_map.items():
@@ -251,115 +329,738 @@ class DrugOptimizer:
             inhibitors = roles['inhibitor']
             inducers = roles['inducer']
 
-            # Case 1: Inhibitor + Substrate (Toxicity)
+            # Case 1: Inhibitor + Substrate (Toxicity), Case 2: Inducer + Substrate (Failure)
             for sub in substrates:
-                for inh in inhibitors:
-                    if sub != inh:
-                        conflicts.add(tuple(sorted((sub, inh))))
+                for other in inhibitors + inducers:
+                    if sub != other and (new is None or sub in new or other in new):
+                        conflicts.add(tuple(sorted((sub, other))))
 
-            # Case 2: Inducer + Substrate (Failure)
-            for sub in substrates:
-                for ind in inducers:
-                    if sub != ind:
-                        conflicts.add(tuple(sorted((sub, ind))))
-
-        conn.close()
         return conflicts
 
-    def solve_ilp(self, conditions):
-        print(f"Starting ILP Optimization for: {conditions}")
+    def _get_enzyme_conflicts(self, candidates):
+        """DETECTS METABOLIC CONFLICTS (CYP450 system)."""
+        if not candidates: return set()
+        return self._metabolic_pairs(self._get_enzyme_roles(candidates))
+
+    def _get_conflicts(self, candidates):
+        """Direct and metabolic conflict pairs. Returns (direct, all)."""
+        with span('conflicts'):
+            direct_conflicts = self._get_interaction_graph(candidates)
+            metabolic_conflicts = self._get_enzyme_conflicts(candidates)
+            all_conflicts = direct_conflicts.union(metabolic_conflicts)
+        note('candidates', len(candidates))
+        note('conflict_pairs', len(all_conflicts))
+        return direct_conflicts, all_conflicts
+
+    def _load_problem(self, conditions):
+        """Returns (candidates, coverage_map, drug_info, direct_conflicts, all_conflicts)."""
         candidates, coverage_map, drug_info = self._fetch_candidates(conditions)
+        direct_conflicts, all_conflicts = self._get_conflicts(candidates)
+        return candidates, coverage_map, drug_info, direct_conflicts, all_conflicts
+
+    def graph_problem(self, conditions, top_n=None, collapse=True):
+        """
+        Drugs for the coverage graph, best first, with the conflicts among them read from
+        the interaction index. `collapse` keeps one drug per equivalence class (see
+        _collapse_equivalent); `top_n` keeps the best top_n drugs of each condition, ranked
+        by conditions covered, then by ILP safety/price cost.
+        Returns (drugs, coverage_map, drug_info, direct, metabolic, substitutes, total).
+        """
+        candidates, coverage_map, drug_info = self._fetch_candidates(conditions)
+        total = len(candidates)
+        with span('conflicts'):
+            direct, metabolic = self.interactions.pairs(candidates)
+
+        substitutes = {}
+        if collapse:
+            candidates, coverage_map, direct, all_conflicts, substitutes = self._collapse_equivalent(
+                candidates, coverage_map, drug_info, direct, direct | metabolic)
+            metabolic = all_conflicts - direct
+
+        covers = defaultdict(int)
+        for cond in conditions:
+            for d in coverage_map[cond]:
+                covers[d] += 1
+
+        def rank(d):
+            return (-covers[d], drug_info[d]['toxicity_score'] * ILP_WEIGHTS['safety'] +
+                    drug_info[d]['price_val'] * ILP_WEIGHTS['price'], d)
+
+        if top_n is None:
+            keep = set(candidates)
+        else:
+            keep = set()
+            for cond in conditions:
+                keep.update(sorted(coverage_map[cond], key=rank)[:top_n])
+
+        drugs = sorted(keep, key=rank)
+        direct = {p for p in direct if p[0] in keep and p[1] in keep}
+        metabolic = {p for p in metabolic if p[0] in keep and p[1] in keep}
+        return drugs, coverage_map, drug_info, direct, metabolic, substitutes, total
+
+    def _warm_start(self, conditions, candidates, coverage_map, drug_info, all_conflicts, substitutes,
+                    previous=None):
+        """
+        Starting regimen: drugs of the previous regimen that still cover a condition (or the
+        representative of their equivalence class), completed greedily for the rest.
+        """
+        representative = {s: rep for rep, subs in substitutes.items() for s in subs}
+        kept = set(candidates)
+        start = []
+        for d in previous or []:
+            d = representative.get(d, d)
+            if d in kept and d not in start and any(d in coverage_map[c] for c in conditions):
+                start.append(d)
+
+        uncovered = [c for c in conditions if not coverage_map[c] & set(start)]
+        greedy_ids, _ = self._greedy_select(uncovered, candidates, coverage_map, drug_info, all_conflicts)
+        return start + greedy_ids
+
+    def _cached(self, namespace, conditions, weights, solve, variant=None):
+        """
+        Serves a solve from the response cache, keyed by the condition set and weights.
+        Concurrent identical misses are coalesced into a single solve; `variant` separates
+        in-flight solves whose options (e.g. deadline) change the answer.
+        Deadline-limited answers are returned but never cached.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(namespace, conditions, weights=weights)
+            hit = self.cache.get(key)
+            if hit is not None:
+                return relabel_conditions(hit, conditions)
+
+        flight_key = request_key(namespace, conditions, mode=variant, weights=weights)
+        result, shared = self.flights.do(flight_key, lambda: solve(conditions))
+        if shared:
+            return relabel_conditions(result, conditions)
+
+        if key is not None and result.get('solver_status') not in PARTIAL_STATUSES:
+            self.cache.put(key, result)
+        return result
+
+    def solve_ilp(self, conditions, deadline_ms=None, medications=None):
+        # Frequent combinations are solved offline (precompute.py); those answers are optimal
+        if self.precomputed is not None and not medications:
+            hit = self.precomputed.get(conditions, ILP_WEIGHTS)
+            if hit is not None:
+                return relabel_conditions(hit, conditions)
+        return self._cached('ilp', conditions, medication_key(ILP_WEIGHTS, medications),
+                            lambda c: self._with_medications(
+                                c, medications, lambda cc, p: self._solve_ilp(cc, deadline_ms, problem=p)),
+                            variant=f"deadline={deadline_ms}" if deadline_ms is not None else None)
+
+    def solve_greedy(self, conditions, medications=None):
+        return self._cached('greedy', conditions, medication_key(GREEDY_WEIGHTS, medications),
+                            lambda c: self._with_medications(
+                                c, medications, lambda cc, p: self._solve_greedy(cc, problem=p)))
+
+    def solve_lagrangian(self, conditions, medications=None):
+        return self._cached('lagrangian', conditions, medication_key(ILP_WEIGHTS, medications),
+                            lambda c: self._with_medications(
+                                c, medications, lambda cc, p: self._solve_lagrangian(cc, problem=p)))
+
+    def _with_medications(self, conditions, medications, solve):
+        """
+        Runs solve(conditions, problem) around a patient's current medications: they are
+        fixed in the regimen, the conditions they already cover are dropped, and every
+        candidate pays the conflict weight of each medication it conflicts with.
+        """
+        if not medications:
+            return solve(conditions, None)
+
+        med_ids, unresolved = self.interactions.resolve(medications)
+        for med in unresolved:
+            log(f"⚠️ Unknown medication: {med}")
+
+        candidates, coverage_map, drug_info, direct_conflicts, all_conflicts = self._load_problem(conditions)
+        fixed = set(med_ids)
+        remaining = [c for c in conditions if not coverage_map[c] & fixed]
+
+        # 1. Medications leave the candidate set; the rest carry their (medication, kind) conflicts
+        med_conflicts = self.interactions.conflicts(med_ids, [d for d in candidates if d not in fixed])
+        info = dict(drug_info)
+        for d, conflicts in med_conflicts.items():
+            info[d] = dict(drug_info[d],
+                           medication_conflicts=sorted(conflicts.items()),
+                           medication_penalty=sum(ILP_WEIGHTS[kind] for kind in conflicts.values()))
+        problem = (
+            [d for d in candidates if d not in fixed],
+            defaultdict(set, {c: coverage_map[c] - fixed for c in remaining}),
+            info,
+            {p for p in direct_conflicts if p[0] not in fixed and p[1] not in fixed},
+            {p for p in all_conflicts if p[0] not in fixed and p[1] not in fixed},
+        )
+
+        if remaining:
+            result = solve(remaining, problem)
+        else:
+            result = {"status": "Success", "regimen": [], "total_cost": 0, "conflict_count": 0,
+                      "solver_status": "optimal"}
+
+        # 2. Medications head the regimen, and their conflicts join the count
+        med_info = self._fetch_drugs(med_ids)
+        current = [dict(med_info[m], current_medication=True,
+                        covered_conditions=[c for c in conditions if m in coverage_map[c]])
+                   for m in med_ids if m in med_info]
+        chosen = [d['id'] for d in result['regimen']]
+        conflict_list = [{'drug': d, 'medication': m, 'type': kind}
+                         for d in chosen for m, kind in med_conflicts.get(d, {}).items()]
+        among = self.interactions.conflicts(med_ids, med_ids)
+        conflict_list += [{'drug': d, 'medication': m, 'type': kind}
+                          for d in med_ids for m, kind in among.get(d, {}).items() if d < m]
+
+        result['regimen'] = current + result['regimen']
+        result['total_cost'] = sum(r['price_val'] for r in result['regimen'])
+        result['conflict_count'] = result.get('conflict_count', 0) + len(conflict_list)
+        result['current_medications'] = {
+            'resolved': med_ids,
+            'unresolved': unresolved,
+            'conflicts': conflict_list,
+        }
+        return result
+
+    def solve_pareto(self, conditions, points=PARETO_POINTS):
+        return self._cached('pareto', conditions, dict(ILP_WEIGHTS, points=points),
+                            lambda c: self._solve_pareto(c, points))
+
+    def _pareto_weights(self, points):
+        """Weight sets from safety-first to price-first, geometric around ILP_WEIGHTS."""
+        if points == 1:
+            return [dict(ILP_WEIGHTS)]
+        sweep = []
+        for k in range(points):
+            factor = PARETO_SPREAD ** (2 * k / (points - 1) - 1)
+            sweep.append(dict(ILP_WEIGHTS, safety=ILP_WEIGHTS['safety'] / factor,
+                              price=ILP_WEIGHTS['price'] * factor))
+        return sweep
+
+    def _solve_pareto(self, conditions, points=PARETO_POINTS):
+        """
+        Cost vs. safety trade-off. Candidates, conflicts and equivalence classes are
+        built once and shared by every weighted solve. Even points of the sweep run
+        concurrently from the greedy warm start; odd points then run concurrently,
+        each warm-started from the better of its two solved neighbours.
+        Returns the non-dominated regimens (toxicity, price, conflicts).
+        """
+        log(f"Starting Pareto sweep ({points} points) for: {conditions}")
+        candidates, coverage_map, drug_info = self._fetch_candidates(conditions)
+
+        if not candidates:
+            return {"status": "No drugs found", "frontier": [], "points": 0}
+
+        # 1. Shared model data. Weights vary per point, so equivalence classes keep
+        # every member that some weighting could prefer
+        direct_conflicts, all_conflicts = self._get_conflicts(candidates)
+        candidates, coverage_map, direct_conflicts, all_conflicts, _ = self._collapse_equivalent(
+            candidates, coverage_map, drug_info, direct_conflicts, all_conflicts, trade_off=True)
+        greedy_ids, _ = self._greedy_select(conditions, candidates, coverage_map, drug_info, all_conflicts)
+        covered = [c for c in conditions if coverage_map[c]]
+        for cond in conditions:
+            if cond not in covered:
+                log(f"⚠️ Cannot cover condition: {cond}")
+
+        sweep = self._pareto_weights(points)
+        outcomes = [None] * len(sweep)
+
+        def solve(k, warm_set):
+            outcomes[k] = self._solve_component(covered, candidates, coverage_map, drug_info, direct_conflicts,
+                                                all_conflicts, warm_set, weights=sweep[k])
+
+        def weighted_cost(selected, weights):
+            return sum(drug_info[d]['toxicity_score'] * weights['safety'] +
+                       drug_info[d]['price_val'] * weights['price'] for d in selected)
+
+        def neighbour_start(k):
+            solved = [outcomes[j]['selected'] for j in (k - 1, k + 1) if 0 <= j < len(sweep)]
+            return set(min(solved, key=lambda sel: (len(sel), weighted_cost(sel, sweep[k]))))
+
+        # 2. Even points, then odd points warm-started from their neighbours
+        with ThreadPoolExecutor(max_workers=min(ILP_WORKERS, len(sweep))) as pool:
+            list(pool.map(propagate(lambda k: solve(k, set(greedy_ids))), range(0, len(sweep), 2)))
+            list(pool.map(propagate(lambda k: solve(k, neighbour_start(k))), range(1, len(sweep), 2)))
+
+        # 3. Distinct regimens, then drop every one dominated by another
+        regimens = {}
+        for weights, outcome in zip(sweep, outcomes):
+            selected = tuple(sorted(outcome['selected']))
+            entry = regimens.setdefault(selected, {
+                "selected": selected,
+                "total_toxicity": sum(drug_info[d]['toxicity_score'] for d in selected),
+                "total_cost": sum(drug_info[d]['price_val'] for d in selected),
+                "conflict_count": outcome['conflict_count'],
+                "weights": [],
+                "solver_status": outcome['solver_status'],
+            })
+            entry['weights'].append({'safety': weights['safety'], 'price': weights['price']})
+            if outcome['solver_status'] != 'optimal':
+                entry['solver_status'] = outcome['solver_status']
+
+        def criteria(r):
+            return (r['total_toxicity'], r['total_cost'], r['conflict_count'])
+
+        frontier = [r for r in regimens.values()
+                    if not any(all(a <= b for a, b in zip(criteria(o), criteria(r))) and criteria(o) != criteria(r)
+                               for o in regimens.values())]
+        frontier.sort(key=criteria)
+
+        descriptions = self._fetch_descriptions(sorted({d for r in frontier for d in r['selected']}))
+        results = []
+        for r in frontier:
+            regimen = []
+            for d in r['selected']:
+                entry = dict(drug_info[d], description=descriptions.get(d))
+                entry['covered_conditions'] = [c for c in conditions if d in coverage_map[c]]
+                regimen.append(entry)
+            results.append({
+                "regimen": regimen,
+                "total_toxicity": round(r['total_toxicity'], 4),
+                "total_cost": round(r['total_cost'], 4),
+                "conflict_count": r['conflict_count'],
+                "weights": r['weights'],
+                "solver_status": r['solver_status'],
+            })
+
+        statuses = {r['solver_status'] for r in results}
+        return {
+            "status": "Success",
+            "frontier": results,
+            "points": len(sweep),
+            "solver_status": next(s for s in ('greedy_fallback', 'time_limit', 'optimal') if s in statuses),
+        }
+
+    def _run_cbc(self, prob, time_limit=None):
+        """
+        Solves with CBC, warm-started from any initial values set on the variables.
+        Returns (solver_status, objective, lower bound); solver_status is None when
+        CBC found no incumbent.
+        """
+        log_path = None
+        if time_limit is not None:
+            # The best bound is only reported in the CBC log
+            fd, log_path = tempfile.mkstemp(suffix='.log')
+            os.close(fd)
+
+        try:
+            prob.solve(pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit, warmStart=True, logPath=log_path))
+
+            objective = pulp.value(prob.objective) or 0.0
+            if prob.sol_status == pulp.LpSolutionOptimal:
+                return "optimal", objective, objective
+            if prob.sol_status != pulp.LpSolutionIntegerFeasible:
+                return None, None, None
+
+            bound = None
+            if log_path:
+                with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+                    match = re.search(r'Lower bound:\s*(-?[\d.eE+-]+)', f.read())
+                if match:
+                    bound = float(match.group(1))
+            return "time_limit", objective, bound
+        finally:
+            if log_path and os.path.exists(log_path):
+                os.remove(log_path)
+
+    def _collapse_equivalent(self, candidates, coverage_map, drug_info, direct_conflicts, all_conflicts,
+                             trade_off=False):
+        """
+        Symmetry reduction. Drugs with the same (covered conditions, conflict neighbours and
+        weights, (medication, kind) conflicts) signature are interchangeable: swapping one for
+        another keeps coverage and conflicts, and two of them never conflict with each other.
+        Only the cheapest member (safety + price + medication penalty) of each class is kept for
+        the solve, which leaves the optimal objective unchanged. With trade_off=True the
+        safety/price weights are not fixed, so every member not dominated on (toxicity, price)
+        within its class is kept instead.
+        Returns (candidates, coverage_map, direct_conflicts, all_conflicts, substitutes),
+        substitutes mapping each kept drug to the ranked ids it stands in for.
+        """
+        covers = defaultdict(set)
+        for cond, drugs in coverage_map.items():
+            for d in drugs:
+                covers[d].add(cond)
+
+        neighbours = defaultdict(set)
+        for d1, d2 in all_conflicts:
+            kind = 'direct' if (d1, d2) in direct_conflicts else 'metabolic'
+            neighbours[d1].add((d2, kind))
+            neighbours[d2].add((d1, kind))
+
+        def cost(d):
+            return (drug_info[d]['toxicity_score'] * ILP_WEIGHTS['safety'] +
+                    drug_info[d]['price_val'] * ILP_WEIGHTS['price'] +
+                    drug_info[d].get('medication_penalty', 0), d)
+
+        classes = defaultdict(list)
+        for d in candidates:
+            classes[(frozenset(covers[d]), frozenset(neighbours[d]),
+                     tuple(drug_info[d].get('medication_conflicts', ())))].append(d)
+
+        if len(classes) == len(candidates):
+            return candidates, coverage_map, direct_conflicts, all_conflicts, {}
+
+        keep = set()
+        substitutes = {}
+        for members in classes.values():
+            members.sort(key=cost)
+            if trade_off:
+                front = []
+                for d in members:
+                    tox, price = drug_info[d]['toxicity_score'], drug_info[d]['price_val']
+                    if not any(drug_info[f]['toxicity_score'] <= tox and drug_info[f]['price_val'] <= price
+                               for f in front):
+                        front.append(d)
+                keep.update(front)
+                continue
+            keep.add(members[0])
+            if len(members) > 1:
+                substitutes[members[0]] = members[1:]
+
+        reduced_coverage = defaultdict(set)
+        for cond, drugs in coverage_map.items():
+            reduced_coverage[cond] = drugs & keep
+        reduced_direct = {p for p in direct_conflicts if p[0] in keep and p[1] in keep}
+        reduced_all = {p for p in all_conflicts if p[0] in keep and p[1] in keep}
+
+        log(f"Collapsed {len(candidates)} candidates into {len(keep)} equivalence classes")
+        return [d for d in candidates if d in keep], reduced_coverage, reduced_direct, reduced_all, substitutes
+
+    def _components(self, conditions, candidates, coverage_map, all_conflicts):
+        """
+        Connected components of the graph joining each condition to its candidates and
+        each conflicting pair. Returns [(conditions, candidates, conflicts)] per component.
+        """
+        parent = {d: d for d in candidates}
+
+        def find(d):
+            while parent[d] != d:
+                parent[d] = parent[parent[d]]
+                d = parent[d]
+            return d
+
+        def union(a, b):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[rb] = ra
+
+        for cond in conditions:
+            drugs = list(coverage_map[cond])
+            for d in drugs[1:]:
+                union(drugs[0], d)
+        for d1, d2 in all_conflicts:
+            union(d1, d2)
+
+        components = {}
+        for d in candidates:
+            components.setdefault(find(d), ([], [], []))[1].append(d)
+        for cond in conditions:
+            if coverage_map[cond]:
+                components[find(next(iter(coverage_map[cond])))][0].append(cond)
+        for pair in all_conflicts:
+            components[find(pair[0])][2].append(pair)
+
+        return list(components.values())
+
+    def _solve_ilp(self, conditions, deadline_ms=None, problem=None, warm_start=None):
+        """
+        `problem` is a prefetched _load_problem tuple; `warm_start` a previous regimen
+        to start CBC from (sessions pass both).
+        `deadline_ms` is checked after every stage; once it has passed the greedy regimen is
+        returned. Fetching candidates and conflicts always runs, since greedy needs both.
+        """
+        log(f"Starting ILP Optimization for: {conditions}")
+        start = time.perf_counter()
+        deadline = start + deadline_ms / 1000 if deadline_ms is not None else None
+
+        def expired():
+            return deadline is not None and time.perf_counter() >= deadline
+
+        candidates, coverage_map, drug_info, direct_conflicts, all_conflicts = problem or self._load_problem(conditions)
 
         if not candidates:
             return {"status": "No drugs found", "regimen": [], "total_cost": 0}
 
-        direct_conflicts = self._get_interaction_graph(candidates)
-        metabolic_conflicts = self._get_enzyme_conflicts(candidates)
-        all_conflicts = direct_conflicts.union(metabolic_conflicts)
+        # 1. Symmetry reduction only speeds up CBC, so it is skipped when there is no time left for it
+        substitutes = {}
+        if not expired():
+            candidates, coverage_map, direct_conflicts, all_conflicts, substitutes = self._collapse_equivalent(
+                candidates, coverage_map, drug_info, direct_conflicts, all_conflicts)
+
+        # 2. Greedy solution: warm start for CBC, and the answer if CBC has no incumbent in time
+        greedy_ids = self._warm_start(conditions, candidates, coverage_map, drug_info, all_conflicts,
+                                      substitutes, warm_start)
+        greedy_set = set(greedy_ids)
 
+        for cond in conditions:
+            if not coverage_map[cond]:
+                log(f"⚠️ Cannot cover condition: {cond}")
+
+        def greedy_result(stage):
+            log(f"⚠️ Deadline reached after {stage}, using greedy")
+            conflict_count = sum(1 for d1, d2 in all_conflicts if d1 in greedy_set and d2 in greedy_set)
+            return self._regimen_result("Success (Greedy Fallback)", greedy_ids, conditions, coverage_map,
+                                        drug_info, conflict_count, substitutes, solver_status='greedy_fallback',
+                                        optimality_gap=None)
+
+        if expired():
+            return greedy_result("the warm start")
+
+        # 3. Components share no condition and no conflict, so their optimal
+        # regimens combine into the optimal regimen of the whole problem
+        components = self._components(conditions, candidates, coverage_map, all_conflicts)
+        if expired():
+            return greedy_result("splitting components")
+
+        def solve(component):
+            comp_conditions, comp_candidates, comp_conflicts = component
+            return self._solve_component(comp_conditions, comp_candidates, coverage_map, drug_info,
+                                         direct_conflicts, comp_conflicts, greedy_set, deadline)
+
+        if len(components) == 1:
+            outcomes = [solve(components[0])]
+        else:
+            log(f"Solving {len(components)} independent components in parallel")
+            with ThreadPoolExecutor(max_workers=min(ILP_WORKERS, len(components))) as pool:
+                outcomes = list(pool.map(propagate(solve), components))
+
+        selected = []
+        conflict_count = 0
+        objective = bound = 0.0
+        for outcome in outcomes:
+            selected.extend(outcome['selected'])
+            conflict_count += outcome['conflict_count']
+            if objective is not None and outcome['bound'] is not None:
+                objective += outcome['objective']
+                bound += outcome['bound']
+            else:
+                objective = bound = None
+
+        statuses = {outcome['solver_status'] for outcome in outcomes}
+        solver_status = next(s for s in ('greedy_fallback', 'time_limit', 'optimal') if s in statuses)
+        gap = None
+        if objective:
+            gap = round(max(0.0, (objective - bound) / abs(objective)), 6)
+
+        status = "Success (Greedy Fallback)" if solver_status == 'greedy_fallback' else "Success"
+        return self._regimen_result(status, selected, conditions, coverage_map, drug_info, conflict_count,
+                                    substitutes, solver_status=solver_status, optimality_gap=gap,
+                                    components=len(components))
+
+    def _conflict_stars(self, conflicts):
+        """
+        Edge-disjoint star cover of the conflict graph, taking the drug with the most
+        uncovered conflicts as the next centre. CYP inhibitors and inducers conflict with
+        every substrate of their enzyme, so they become the centres of large stars.
+        Returns [(centre, [leaves])]; every conflict pair lands in exactly one star.
+        """
+        adj = defaultdict(set)
+        for d1, d2 in conflicts:
+            adj[d1].add(d2)
+            adj[d2].add(d1)
+
+        heap = [(-len(n), d) for d, n in adj.items()]
+        heapq.heapify(heap)
+        stars = []
+        while heap:
+            neg_degree, d = heapq.heappop(heap)
+            degree = len(adj[d])
+            if degree == 0:
+                continue
+            if degree != -neg_degree:
+                # Stale entry, degrees only shrink
+                heapq.heappush(heap, (-degree, d))
+                continue
+
+            leaves = sorted(adj[d])
+            for leaf in leaves:
+                adj[leaf].discard(d)
+            adj[d] = set()
+            stars.append((d, leaves))
+        return stars
+
+    def _build_model(self, conditions, candidates, coverage_map, drug_info, direct_conflicts, all_conflicts,
+                     warm_set, out_of_time, formulation, weights=None):
+        """
+        ILP over one component, warm-started from warm_set. Returns (prob, x), or None
+        if out_of_time() fires while building. `weights` overrides ILP_WEIGHTS.
+
+        'pairwise': one binary z and one row z >= x1 + x2 - 1 per conflict pair.
+        'compact':  one continuous y and one row per star of _conflict_stars,
+                    y >= sum(w * x_leaf) - M * (1 - x_centre), M = sum(w).
+                    Exact for binary x (y is the centre's conflict penalty when it is
+                    selected and 0 otherwise), with rows ~ drugs instead of ~ pairs.
+        """
         prob = pulp.LpProblem("Drug_Opt", pulp.LpMinimize)
         x = pulp.LpVariable.dicts("drug", candidates, cat='Binary')
-        z = pulp.LpVariable.dicts("conflict", list(all_conflicts), cat='Binary')
 
         # Weights
-        W_COUNT = 1000
-        W_DIRECT = 500
-        W_METABOLIC = 300
-        W_SAFETY = 5.0
-        W_PRICE = 0.05
+        weights = weights or ILP_WEIGHTS
+        W_COUNT = weights['count']
+        W_DIRECT = weights['direct']
+        W_METABOLIC = weights['metabolic']
+        W_SAFETY = weights['safety']
+        W_PRICE = weights['price']
 
-        conflict_penalty = 0
-        for pair in all_conflicts:
-            weight = W_DIRECT if pair in direct_conflicts else W_METABOLIC
-            conflict_penalty += weight * z[pair]
+        def weight(d1, d2):
+            return W_DIRECT if tuple(sorted((d1, d2))) in direct_conflicts else W_METABOLIC
+
+        # Constraints
+        for cond in conditions:
+            prob += pulp.lpSum([x[d] for d in coverage_map[cond]]) >= 1
+
+        # Conflict variables, penalties and rows are built in one pass: with large conflict
+        # sets model construction itself is expensive, so the deadline is checked as we go
+        conflict_penalty = pulp.LpAffineExpression()
+        if formulation == 'compact':
+            for n, (centre, leaves) in enumerate(self._conflict_stars(all_conflicts)):
+                leaf_weights = {leaf: weight(centre, leaf) for leaf in leaves}
+                big_m = sum(leaf_weights.values())
+                y = pulp.LpVariable(f"star_{n}", lowBound=0, upBound=big_m)
+                conflict_penalty.addterm(y, 1)
+                # y - sum(w * x_leaf) - M * x_centre >= -M, built directly (operator overloading is slow here)
+                row = pulp.LpAffineExpression([(y, 1), (x[centre], -big_m)] +
+                                              [(x[leaf], -w) for leaf, w in leaf_weights.items()])
+                prob += row >= -big_m
+                y.setInitialValue(sum(w for leaf, w in leaf_weights.items() if leaf in warm_set)
+                                  if centre in warm_set else 0)
+                if n % 100 == 99 and out_of_time():
+                    return None
+        else:
+            for n, pair in enumerate(all_conflicts):
+                d1, d2 = pair
+                z = pulp.LpVariable(f"conflict_{n}", cat='Binary')
+                conflict_penalty.addterm(z, W_DIRECT if pair in direct_conflicts else W_METABOLIC)
+                prob += z >= x[d1] + x[d2] - 1
+                z.setInitialValue(1 if d1 in warm_set and d2 in warm_set else 0)
+                if n % 1000 == 999 and out_of_time():
+                    return None
 
         # Objective
         prob += (
                 pulp.lpSum([x[i] for i in candidates]) * W_COUNT +
                 conflict_penalty +
                 pulp.lpSum([x[i] * drug_info[i]['toxicity_score'] for i in candidates]) * W_SAFETY +
-                pulp.lpSum([x[i] * drug_info[i]['price_val'] for i in candidates]) * W_PRICE
+                pulp.lpSum([x[i] * drug_info[i]['price_val'] for i in candidates]) * W_PRICE +
+                pulp.lpSum([x[i] * drug_info[i].get('medication_penalty', 0) for i in candidates])
         )
 
-        # Constraints
-        for cond in conditions:
-            valid_drugs = coverage_map[cond]
-            if valid_drugs:
-                prob += pulp.lpSum([x[d] for d in valid_drugs]) >= 1
-            else:
-                print(f"⚠️ Cannot cover condition: {cond}")
-
-        for (d1, d2) in all_conflicts:
-            prob += z[(d1, d2)] >= x[d1] + x[d2] - 1
-
-        prob.solve(pulp.PULP_CBC_CMD(msg=False))
+        # Warm start
+        for d in candidates:
+            x[d].setInitialValue(1 if d in warm_set else 0)
+
+        return prob, x
+
+    def _solve_component(self, conditions, candidates, coverage_map, drug_info, direct_conflicts,
+                         all_conflicts, warm_set, deadline=None, formulation=None, weights=None):
+        """
+        Builds and solves the ILP for one component, warm-started from warm_set. Falls back
+        to the component's share of warm_set (the greedy regimen) when the deadline leaves
+        no time or CBC has no incumbent.
+        """
+        build_start = time.perf_counter()
+
+        def out_of_time():
+            return deadline is not None and deadline - time.perf_counter() < MIN_SOLVE_SECONDS
+
+        def conflicts_among(chosen):
+            return sum(1 for d1, d2 in all_conflicts if d1 in chosen and d2 in chosen)
+
+        def greedy_fallback(reason):
+            log(f"⚠️ {reason}, using greedy")
+            return {
+                "solver_status": "greedy_fallback",
+                "selected": [d for d in candidates if d in warm_set],
+                "conflict_count": conflicts_among(warm_set),
+                "objective": None,
+                "bound": None,
+            }
+
+        if out_of_time():
+            return greedy_fallback("Deadline reached before solving")
+
+        with span('build'):
+            model = self._build_model(conditions, candidates, coverage_map, drug_info, direct_conflicts,
+                                      all_conflicts, warm_set, out_of_time, formulation or CONFLICT_FORMULATION,
+                                      weights)
+        if model is None:
+            return greedy_fallback("Deadline reached while building the model")
+        prob, x = model
+
+        # Writing the model for CBC and reading it back costs about as much as building it,
+        # so that time is reserved out of what is left for the solve itself
+        time_limit = None
+        if deadline is not None:
+            time_limit = deadline - time.perf_counter() - (time.perf_counter() - build_start)
+            if time_limit < MIN_SOLVE_SECONDS:
+                return greedy_fallback("Deadline leaves no time for CBC")
+
+        with span('solve'):
+            solver_status, objective, bound = self._run_cbc(prob, time_limit)
+
+        if solver_status is None:
+            return greedy_fallback("CBC returned no incumbent")
+
+        selected = [d for d in candidates if (pulp.value(x[d]) or 0) > 0.5]
+        return {
+            "solver_status": solver_status,
+            "selected": selected,
+            "conflict_count": conflicts_among(set(selected)),
+            "objective": objective,
+            "bound": bound,
+        }
 
+    def _regimen_result(self, status, selected, conditions, coverage_map, drug_info, conflict_count,
+                        substitutes=None, **solver_info):
         results = []
-        selected = [d for d in candidates if pulp.value(x[d]) == 1.0]
-
+        descriptions = self._fetch_descriptions(selected)
         for d in selected:
-            entry = drug_info[d]
+            entry = dict(drug_info[d], description=descriptions.get(d))
             entry['covered_conditions'] = [c for c in conditions if d in coverage_map[c]]
+            if substitutes and d in substitutes:
+                entry['substitutes'] = [
+                    {
+                        'id': s,
+                        'name': drug_info[s]['name'],
+                        'toxicity_score': drug_info[s]['toxicity_score'],
+                        'price_val': drug_info[s]['price_val'],
+                    }
+                    for s in substitutes[d][:MAX_SUBSTITUTES]
+                ]
             results.append(entry)
 
-        return {
-            "status": "Success",
+        result = {
+            "status": status,
             "regimen": results,
             "total_cost": sum(r['price_val'] for r in results),
-            "conflict_count": sum(pulp.value(z[k]) for k in all_conflicts)
+            "conflict_count": conflict_count
         }
-
-    def solve_greedy(self, conditions):
-        print(f"Starting Greedy Optimization for: {conditions}")
-        candidates_list, coverage_map, drug_info = self._fetch_candidates(conditions)
-
-        if not candidates_list:
-            return {"status": "No drugs found", "regimen": [], "total_cost": 0}
-
-        direct_conflicts = self._get_interaction_graph(candidates_list)
-        metabolic_conflicts = self._get_enzyme_conflicts(candidates_list)
-        all_conflicts = direct_conflicts.union(metabolic_conflicts)
-
+        result.update(solver_info)
+        return result
+
+    def _greedy_select(self, conditions, candidates_list, coverage_map, drug_info, all_conflicts):
+        """
+        Greedy set cover scored by new coverage, conflicts with the drugs picked so far,
+        toxicity and price. Returns (selected drug ids, conflicts among them).
+        """
         conflict_map = defaultdict(set)
         for d1, d2 in all_conflicts:
             conflict_map[d1].add(d2)
             conflict_map[d2].add(d1)
 
         uncovered = set(conditions)
-        selected_drugs = []
+        selected_ids = []
         total_conflicts_found = 0
 
         # Weights
-        W_COVER = 1000
-        W_CONFLICT = 500
-        W_SAFETY = 5.0
-        W_PRICE = 0.05
+        W_COVER = GREEDY_WEIGHTS['cover']
+        W_CONFLICT = GREEDY_WEIGHTS['conflict']
+        W_SAFETY = GREEDY_WEIGHTS['safety']
+        W_PRICE = GREEDY_WEIGHTS['price']
 
         while uncovered:
             valid_candidates = []
             for d_id in candidates_list:
                 can_cover = [c for c in uncovered if d_id in coverage_map[c]]
-                if can_cover and d_id not in [s['id'] for s in selected_drugs]:
+                if can_cover and d_id not in selected_ids:
                     valid_candidates.append(d_id)
 
             if not valid_candidates:
@@ -372,10 +1073,12 @@ class DrugOptimizer:
                 info = drug_info[d_id]
                 new_coverage_count = len([c for c in uncovered if d_id in coverage_map[c]])
                 current_conflicts = 0
-                for selected in selected_drugs:
-                    if selected['id'] in conflict_map[d_id]:
+                for selected in selected_ids:
+                    if selected in conflict_map[d_id]:
                         current_conflicts += 1
 
+                current_conflicts += len(info.get('medication_conflicts', ()))
+
                 score = (new_coverage_count * W_COVER) - \
                         (current_conflicts * W_CONFLICT) - \
                         (info['toxicity_score'] * W_SAFETY) - \
@@ -387,22 +1090,165 @@ class DrugOptimizer:
 
             if best_candidate:
                 covered_now = [c for c in uncovered if best_candidate in coverage_map[c]]
-                for selected in selected_drugs:
-                    if selected['id'] in conflict_map[best_candidate]:
+                for selected in selected_ids:
+                    if selected in conflict_map[best_candidate]:
                         total_conflicts_found += 1
 
-                drug_entry = drug_info[best_candidate]
-                drug_entry['covered_conditions'] = [c for c in conditions if best_candidate in coverage_map[c]]
-                selected_drugs.append(drug_entry)
+                selected_ids.append(best_candidate)
 
                 for c in covered_now:
                     uncovered.remove(c)
             else:
                 break
 
-        return {
-            "status": "Success (Greedy)",
-            "regimen": selected_drugs,
-            "total_cost": sum(d['price_val'] for d in selected_drugs),
-            "conflict_count": total_conflicts_found
-        }
\ No newline at end of file
+        return selected_ids, total_conflicts_found
+
+    def _solve_greedy(self, conditions, problem=None):
+        log(f"Starting Greedy Optimization for: {conditions}")
+        candidates_list, coverage_map, drug_info, direct_conflicts, all_conflicts = \
+            problem or self._load_problem(conditions)
+
+        if not candidates_list:
+            return {"status": "No drugs found", "regimen": [], "total_cost": 0}
+
+        candidates_list, coverage_map, _, all_conflicts, substitutes = self._collapse_equivalent(
+            candidates_list, coverage_map, drug_info, direct_conflicts, all_conflicts)
+        with span('solve'):
+            selected_ids, total_conflicts_found = self._greedy_select(conditions, candidates_list, coverage_map,
+                                                                      drug_info, all_conflicts)
+
+        return self._regimen_result("Success (Greedy)", selected_ids, conditions, coverage_map, drug_info,
+                                    total_conflicts_found, substitutes, solver_status="heuristic")
+
+    def _solve_lagrangian(self, conditions, iterations=LAGRANGIAN_ITERATIONS, problem=None, warm_start=None):
+        """
+        Lagrangian relaxation of the ILP's coverage rows. For multipliers lam >= 0,
+        sum(lam) + sum(min(0, cost - lam @ A)) is a lower bound on the ILP optimum
+        (conflict penalties are non-negative and dropped). Subgradient steps raise the
+        bound; each relaxed solution is repaired into a feasible regimen, the best of
+        which is returned with the bound and the gap between them.
+        """
+        log(f"Starting Lagrangian Optimization for: {conditions}")
+        candidates, coverage_map, drug_info, direct_conflicts, all_conflicts = problem or self._load_problem(conditions)
+
+        if not candidates:
+            return {"status": "No drugs found", "regimen": [], "total_cost": 0}
+
+        candidates, coverage_map, direct_conflicts, all_conflicts, substitutes = self._collapse_equivalent(
+            candidates, coverage_map, drug_info, direct_conflicts, all_conflicts)
+        greedy_ids = self._warm_start(conditions, candidates, coverage_map, drug_info, all_conflicts,
+                                      substitutes, warm_start)
+
+        covered = [c for c in conditions if coverage_map[c]]
+        for cond in conditions:
+            if cond not in covered:
+                log(f"⚠️ Cannot cover condition: {cond}")
+
+        # 1. Coverage matrix, per-drug cost and conflict edge arrays
+        solve_start = time.perf_counter()
+        candidates = list(candidates)
+        index = {d: i for i, d in enumerate(candidates)}
+        n = len(candidates)
+        A = np.zeros((len(covered), n))
+        for row, cond in enumerate(covered):
+            A[row, [index[d] for d in coverage_map[cond]]] = 1
+
+        cost = np.array([ILP_WEIGHTS['count'] +
+                         drug_info[d]['toxicity_score'] * ILP_WEIGHTS['safety'] +
+                         drug_info[d]['price_val'] * ILP_WEIGHTS['price'] +
+                         drug_info[d].get('medication_penalty', 0) for d in candidates])
+        pairs = sorted(all_conflicts)
+        edge_a = np.array([index[d1] for d1, _ in pairs], dtype=int)
+        edge_b = np.array([index[d2] for _, d2 in pairs], dtype=int)
+        edge_w = np.array([ILP_WEIGHTS['direct'] if p in direct_conflicts else ILP_WEIGHTS['metabolic']
+                           for p in pairs], dtype=float)
+
+        # Neighbour index (CSR): conflicts of drug i are nbr[start[i]:start[i + 1]]
+        src = np.concatenate([edge_a, edge_b])
+        order = np.argsort(src, kind='stable')
+        nbr = np.concatenate([edge_b, edge_a])[order]
+        nbr_w = np.concatenate([edge_w, edge_w])[order]
+        start = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))])
+
+        def neighbours(i):
+            return nbr[start[i]:start[i + 1]], nbr_w[start[i]:start[i + 1]]
+
+        def objective(x):
+            chosen = np.flatnonzero(x)
+            penalty = sum(w[x[j]].sum() for j, w in map(neighbours, chosen)) / 2
+            return cost[chosen].sum() + penalty
+
+        def repair(x):
+            x = x.copy()
+            # Per drug: penalty it would pay with the drugs selected so far
+            load = np.zeros(n)
+            for i in np.flatnonzero(x):
+                j, w = neighbours(i)
+                np.add.at(load, j, w)
+            # Cover what is missing, cheapest (cost + conflicts) per newly covered condition first
+            uncovered = A @ x == 0
+            while uncovered.any():
+                gain = A[uncovered].sum(axis=0)
+                price = np.where(gain > 0, (cost + load) / np.maximum(gain, 1), np.inf)
+                best = int(np.argmin(price))
+                x[best] = True
+                uncovered &= A[:, best] == 0
+                j, w = neighbours(best)
+                np.add.at(load, j, w)
+            # Drop drugs whose conditions are all covered by another selected drug, dearest first
+            counts = A @ x
+            for i in sorted(np.flatnonzero(x), key=lambda i: -(cost[i] + load[i])):
+                rows = A[:, i] > 0
+                if (counts[rows] > 1).all():
+                    x[i] = False
+                    counts -= A[:, i]
+            return x
+
+        # 2. Subgradient ascent on the multipliers, Polyak step against the best regimen
+        warm = np.zeros(n, dtype=bool)
+        warm[[index[d] for d in greedy_ids]] = True
+        best_x = repair(warm)
+        upper = objective(best_x)
+        lower = -np.inf
+        lam = np.array([cost[A[row] > 0].min() for row in range(len(covered))])
+        theta, stall = 2.0, 0
+        repaired = set()
+
+        for iteration in range(1, iterations + 1):
+            reduced = cost - lam @ A
+            x = reduced < 0
+            bound = lam.sum() + reduced[x].sum()
+            if bound > lower + 1e-9:
+                lower, stall = bound, 0
+            else:
+                stall += 1
+                if stall >= 20:
+                    theta, stall = theta / 2, 0
+
+            # The relaxed solution often repeats between steps; repair each one once
+            key = x.tobytes()
+            if key not in repaired:
+                repaired.add(key)
+                candidate = repair(x)
+                value = objective(candidate)
+                if value < upper:
+                    upper, best_x = value, candidate
+
+            if upper - lower <= LAGRANGIAN_TOLERANCE * abs(upper) or theta < 1e-4:
+                break
+            g = 1 - A @ x
+            norm = g @ g
+            if norm == 0:
+                break
+            lam = np.maximum(0, lam + theta * (upper - bound) / norm * g)
+        record('solve', time.perf_counter() - solve_start)
+
+        selected = [candidates[i] for i in np.flatnonzero(best_x)]
+        conflict_count = int(sum(best_x[neighbours(i)[0]].sum() for i in np.flatnonzero(best_x)) // 2)
+        lower = max(lower, 0.0)
+        gap = round(max(0.0, (upper - lower) / upper), 6) if upper else 0.0
+
+        return self._regimen_result("Success (Lagrangian)", selected, conditions, coverage_map, drug_info,
+                                    conflict_count, substitutes, solver_status="lagrangian",
+                                    objective=round(float(upper), 4), lower_bound=round(float(lower), 4),
+                                    optimality_gap=gap, iterations=iteration)
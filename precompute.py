@@ -0,0 +1,123 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import condition_set, request_key
+from capture import CAPTURE_DIR, read_capture
+from database import DB_NAME, DrugDatabase
+from optimizer import DrugOptimizer, ILP_WEIGHTS, PARTIAL_STATUSES
+from rules import RuleEngine
+from vocabulary import ConditionVocabulary
+
+# Combinations always precomputed: a JSON list of condition lists
+COMBINATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'precomputed_conditions.json')
+
+# Most frequent captured combinations to add to the configured ones
+PRECOMPUTE_TOP = 500
+
+# Combinations solved concurrently (each solve also runs its own CBC processes)
+PRECOMPUTE_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+_engine = None
+
+
+def load_combinations(path=COMBINATIONS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def mine_capture(paths, top=PRECOMPUTE_TOP):
+    """The `top` most requested ILP condition sets in traffic captures, most frequent first."""
+    paths = [p for p in paths if p and os.path.exists(p)]
+    counts = Counter()
+    for record in read_capture(paths) if paths else []:
+        mode = (record['payload'].get('mode') or 'ilp').lower()
+        if record['route'] != '/optimize' or mode in ('greedy', 'lagrangian'):
+            continue
+        key = tuple(condition_set(record['payload'].get('conditions', [])))
+        if key:
+            counts[key] += 1
+    return [list(key) for key, _ in counts.most_common(top)]
+
+
+def _init_worker(db_path):
+    global _engine
+    _engine = DrugOptimizer(db_path)
+
+
+def _solve(conditions):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return conditions, _engine.solve_ilp(conditions)
+
+
+def regenerate(db_path=DB_NAME, combinations=None, workers=PRECOMPUTE_WORKERS):
+    """
+    Solves each distinct combination with solve_ilp and replaces the contents of
+    precomputed_regimens with the results, stamped with the current data version.
+    Returns the number of rows stored.
+    """
+    if combinations is None:
+        combinations = load_combinations() + mine_capture([CAPTURE_DIR])
+
+    # 1. Distinct condition sets, normalized as the server normalizes requests
+    vocabulary = ConditionVocabulary(db_path, RuleEngine())
+    unique = {}
+    for conditions in combinations:
+        conditions, _, _ = vocabulary.normalize_all(conditions)
+        key = request_key('precomputed', conditions, weights=ILP_WEIGHTS)
+        if condition_set(conditions) and key not in unique:
+            unique[key] = conditions
+    db = DrugDatabase(db_path)
+    version = db.get_data_version()
+    workers = max(1, min(workers, len(unique)))
+    print(f"Precomputing {len(unique)} condition combinations ({workers} workers)...")
+    start = time.perf_counter()
+
+    # 2. Solve in parallel; this process is the only writer
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as pool:
+            solved = list(pool.map(_solve, unique.values()))
+    else:
+        _init_worker(db_path)
+        solved = [_solve(conditions) for conditions in unique.values()]
+
+    rows = []
+    for conditions, result in solved:
+        if result.get('solver_status') in PARTIAL_STATUSES:
+            print(f"⚠️ Not storing {conditions}: {result.get('solver_status')}")
+            continue
+        rows.append((request_key('precomputed', conditions, weights=ILP_WEIGHTS), json.dumps(conditions),
+                     version, json.dumps(result), time.time()))
+
+    # 3. Swap the table contents in one transaction
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM precomputed_regimens")
+    cursor.executemany("INSERT INTO precomputed_regimens (key, conditions, data_version, result, solved_at) "
+                       "VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    print(f"Precomputed {len(rows)} regimens in {time.perf_counter() - start:.1f}s (data version {version}).")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the precomputed regimen table")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--capture', nargs='*', default=[CAPTURE_DIR],
+                        help="Traffic capture files or directories to mine (default: REGIMEN_CAPTURE_DIR)")
+    parser.add_argument('--top', type=int, default=PRECOMPUTE_TOP)
+    parser.add_argument('--workers', type=int, default=PRECOMPUTE_WORKERS)
+    args = parser.parse_args()
+
+    DrugDatabase(args.db).create_schema()
+    combinations = load_combinations() + mine_capture(args.capture, args.top)
+    regenerate(args.db, combinations, workers=args.workers)
@@ -0,0 +1,394 @@
+import cProfile
+import functools
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from metrics import current_request, log
+
+# Profiling modes: 'sample' walks thread stacks on a timer, 'cprofile' traces every call
+PROFILE_MODES = ('sample', 'cprofile')
+
+# Stack sampling period while a sampled request is running
+SAMPLE_INTERVAL = 0.005
+
+# Finished profiles kept for download (oldest dropped first)
+PROFILE_KEEP = 50
+
+# Functions listed in the text report
+PROFILE_TOP = 40
+
+# Requests to these paths are never profiled
+PROFILE_EXCLUDED = ('/admin', '/metrics')
+
+# Frames recorded per allocation, and tracemalloc snapshots kept for diffs
+MEMORY_FRAMES = 25
+MEMORY_SNAPSHOTS = 5
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Frames of the profiling plumbing itself, dropped from the root of sampled stacks
+PLUMBING_FILES = {os.path.join(REPO_DIR, 'profiling.py'), os.path.join(REPO_DIR, 'metrics.py')}
+
+
+def frame_label(code):
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}"
+
+
+def fold_stack(frame):
+    """
+    Stack of `frame` as 'outer;...;inner', starting at the outermost frame in this
+    repository so thread pool and server internals are left out.
+    """
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+
+    start = next((i for i, c in enumerate(codes) if c.co_filename.startswith(REPO_DIR)), 0)
+    while start < len(codes) - 1 and codes[start].co_filename in PLUMBING_FILES:
+        start += 1
+    return ";".join(frame_label(c) for c in codes[start:])
+
+
+class ProfileSession:
+    """Profile of one request: stack samples or cProfile data from every thread that worked on it."""
+
+    def __init__(self, profile_id, mode, method, path):
+        self.id = profile_id
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.route = path
+        self.status = None
+        self.duration_ms = None
+        self.started = time.time()
+        self.samples = 0
+        self.stacks = Counter()      # folded stack -> samples
+        self.profiles = []           # cProfile.Profile per thread segment
+        self.skipped = 0             # thread segments another profiler was already tracing
+        self._threads = {}           # thread ident -> nesting depth
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def thread(self):
+        """Profiles the calling thread while the block runs."""
+        ident = threading.get_ident()
+        with self._lock:
+            nested = ident in self._threads
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+        profiler = None
+        if self.mode == 'cprofile' and not nested:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                profiler = None
+                self.skipped += 1
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            with self._lock:
+                if profiler is not None:
+                    self.profiles.append(profiler)
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def sample(self, frames):
+        with self._lock:
+            idents = list(self._threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+                self.samples += 1
+
+    def finish(self, route, status, seconds):
+        self.route = route
+        self.status = status
+        self.duration_ms = round(seconds * 1000, 2)
+
+    def root(self):
+        return f"{self.method} {self.route}"
+
+    def stats(self):
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0])
+        for profiler in self.profiles[1:]:
+            stats.add(profiler)
+        return stats
+
+    def info(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'route': self.root(),
+            'status': self.status,
+            'duration_ms': self.duration_ms,
+            'started': round(self.started, 3),
+            'samples': self.samples if self.mode == 'sample' else None,
+            'threads': len(self.profiles) if self.mode == 'cprofile' else None,
+        }
+
+
+def sample_report(stacks, top=PROFILE_TOP):
+    """Functions by inclusive and self samples."""
+    total = sum(stacks.values())
+    inclusive = Counter()
+    own = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for f in set(frames):
+            inclusive[f] += count
+
+    lines = [f"{total} samples, {SAMPLE_INTERVAL * 1000:g} ms apart", "",
+             f"{'total %':>8} {'self %':>8}  function"]
+    for f, count in inclusive.most_common(top):
+        lines.append(f"{count / total:8.1%} {own[f] / total:8.1%}  {f}")
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    Profiles the next `requests` requests, or a random `fraction` of them until
+    `requests` have been profiled. Armed and read through the admin endpoints.
+    """
+
+    def __init__(self, keep=PROFILE_KEEP, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.mode = 'sample'
+        self.fraction = 1.0
+        self.routes = []
+        self.remaining = 0
+        self.results = deque(maxlen=keep)
+        self._next_id = 1
+        self._active = set()
+        self._sampler = None
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def arm(self, mode='sample', requests=10, fraction=1.0, routes=None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of {', '.join(PROFILE_MODES)}.")
+        if requests < 1:
+            raise ValueError("requests must be at least 1.")
+        if not 0 < fraction <= 1:
+            raise ValueError("fraction must be in (0, 1].")
+        with self._lock:
+            self.mode = mode
+            self.remaining = requests
+            self.fraction = fraction
+            self.routes = list(routes or [])
+        log(f"Profiling {requests} request(s) ({mode}, fraction {fraction:g})")
+        return self.status()
+
+    def disarm(self):
+        with self._lock:
+            self.remaining = 0
+
+    def clear(self):
+        self.disarm()
+        self.results.clear()
+
+    def claim(self, method, path):
+        """A ProfileSession if this request is to be profiled, else None."""
+        if not self.remaining or path.startswith(PROFILE_EXCLUDED):
+            return None
+        with self._lock:
+            if self.remaining <= 0 or (self.routes and path not in self.routes):
+                return None
+            if self.fraction < 1 and self._random.random() >= self.fraction:
+                return None
+            self.remaining -= 1
+            session = ProfileSession(self._next_id, self.mode, method, path)
+            self._next_id += 1
+            if session.mode == 'sample':
+                self._active.add(session)
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+                    self._sampler.start()
+        return session
+
+    def finish(self, session, route, status, seconds):
+        session.finish(route, status, seconds)
+        with self._lock:
+            self._active.discard(session)
+            self.results.append(session)
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                sessions = list(self._active)
+            frames = sys._current_frames()
+            for session in sessions:
+                session.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+    def get(self, profile_id):
+        for session in self.results:
+            if session.id == profile_id:
+                return session
+        raise KeyError(profile_id)
+
+    def status(self):
+        return {
+            'armed': self.remaining > 0,
+            'mode': self.mode,
+            'remaining': self.remaining,
+            'fraction': self.fraction,
+            'routes': self.routes,
+            'profiles': [s.info() for s in self.results],
+        }
+
+    def export(self, profile_id, fmt):
+        """
+        (content, media_type, filename) of one profile, or of all sampled ones for
+        profile_id 'all'. Formats: 'folded' (flamegraph.pl, speedscope), 'text', and
+        for cProfile runs 'pstats' (snakeviz, flameprof, python -m pstats).
+        """
+        if profile_id == 'all':
+            sessions = [s for s in self.results if s.mode == 'sample']
+            if fmt not in ('folded', 'text'):
+                raise ValueError("Combined profiles are available as 'folded' or 'text'.")
+        else:
+            sessions = [self.get(int(profile_id))]
+        name = f"profile-{profile_id}"
+
+        if sessions and sessions[0].mode == 'cprofile':
+            stats = sessions[0].stats()
+            if stats is None:
+                raise ValueError("The profile recorded no data (another profiler was active).")
+            if fmt == 'pstats':
+                return marshal.dumps(stats.stats), 'application/octet-stream', f"{name}.prof"
+            if fmt == 'text':
+                out = io.StringIO()
+                stats.stream = out
+                stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+                return out.getvalue(), 'text/plain', f"{name}.txt"
+            raise ValueError("cProfile runs are available as 'pstats' or 'text'; use mode 'sample' for folded stacks.")
+
+        stacks = Counter()
+        for session in sessions:
+            for stack, count in session.stacks.items():
+                stacks[f"{session.root()};{stack}"] += count
+        if fmt == 'folded':
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), 'text/plain', \
+                f"{name}.folded"
+        if fmt == 'text':
+            if not stacks:
+                return "0 samples\n", 'text/plain', f"{name}.txt"
+            return sample_report(stacks), 'text/plain', f"{name}.txt"
+        raise ValueError("Sampled profiles are available as 'folded' or 'text'.")
+
+
+def profiled(fn):
+    """Endpoint decorator: runs the handler under the request's profile, if it has one."""
+    @functools.wraps(fn)
+    def handler(*args, **kwargs):
+        timings = current_request()
+        session = timings.profile if timings is not None else None
+        if session is None:
+            return fn(*args, **kwargs)
+        with session.thread():
+            return fn(*args, **kwargs)
+    return handler
+
+
+class MemoryTracker:
+    """tracemalloc snapshots taken on demand, diffed against each other."""
+
+    def __init__(self, keep=MEMORY_SNAPSHOTS, frames=MEMORY_FRAMES):
+        self.frames = frames
+        self.snapshots = deque(maxlen=keep)   # (id, time, snapshot)
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """Takes a snapshot, starting tracemalloc first if it is off."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                log(f"tracemalloc started ({self.frames} frames per allocation)")
+            snap = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self.snapshots.append((snapshot_id, time.time(), snap))
+
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'id': snapshot_id,
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'snapshots': [s[0] for s in self.snapshots],
+        }
+
+    def _get(self, snapshot_id):
+        for sid, _, snap in self.snapshots:
+            if sid == snapshot_id:
+                return snap
+        raise KeyError(snapshot_id)
+
+    def diff(self, base=None, target=None, group='lineno', limit=25):
+        """
+        Allocation growth from snapshot `base` to `target` (default: the last two).
+        Returns (rows, folded): largest differences first, and the positive size
+        differences by traceback in folded-stack form for an allocation flamegraph.
+        """
+        if group not in ('lineno', 'filename', 'traceback'):
+            raise ValueError("group must be 'lineno', 'filename' or 'traceback'.")
+        with self._lock:
+            if base is None or target is None:
+                if len(self.snapshots) < 2:
+                    raise ValueError("Take two snapshots before diffing.")
+                base = self.snapshots[-2][0] if base is None else base
+                target = self.snapshots[-1][0] if target is None else target
+            old, new = self._get(base), self._get(target)
+
+        rows = []
+        for stat in new.compare_to(old, group)[:limit]:
+            frame = stat.traceback[-1]
+            rows.append({
+                'location': f"{frame.filename}:{frame.lineno}" if group != 'filename' else frame.filename,
+                'size_diff_bytes': stat.size_diff,
+                'size_bytes': stat.size,
+                'count_diff': stat.count_diff,
+                'count': stat.count,
+            })
+
+        folded = []
+        for stat in new.compare_to(old, 'traceback'):
+            if stat.size_diff <= 0:
+                continue
+            frames = [f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback]
+            folded.append(f"{';'.join(frames)} {stat.size_diff}")
+        return {'base': base, 'target': target, 'group': group, 'top': rows}, "\n".join(folded) + "\n"
+
+    def stop(self):
+        with self._lock:
+            self.snapshots.clear()
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                log("tracemalloc stopped")
@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import print_table
+from cache import DataVersion, PrecomputedRegimens
+from capture import read_capture
+from loadtest import HttpClient, server_total_ms
+from metrics import end_request, start_request
+from optimizer import DrugOptimizer, GRAPH_TOP_N, PARETO_POINTS
+from vocabulary import ConditionVocabulary
+
+DB_PATH = 'drug_project.db'
+
+# Requests replayed at once when pacing direct replays (HTTP replays are not limited)
+REPLAY_WORKERS = 8
+
+# Requests listed per section of a diff
+DIFF_SHOW = 10
+
+# Timing changes smaller than this (ms) are not listed as slowdowns
+DIFF_MIN_MS = 5.0
+
+
+def summarize_result(route, result):
+    """The parts of a response that two builds must agree on (drug ids, statuses, cost)."""
+    if not isinstance(result, dict):
+        return None
+    if route == '/graph':
+        drugs = [n['id'] for n in result.get('nodes', []) if n.get('group') == 'drug']
+        return {'drugs': sorted(drugs), 'links': len(result.get('links', []))}
+    if 'frontier' in result:
+        return {'frontier': sorted(sorted(d['id'] for d in point['regimen']) for point in result['frontier'])}
+    summary = {
+        'status': result.get('status'),
+        'regimen': sorted(d['id'] for d in result.get('regimen', [])),
+        'solver_status': result.get('solver_status'),
+    }
+    if result.get('total_cost') is not None:
+        summary['total_cost'] = round(result['total_cost'], 2)
+    return summary
+
+
+class DirectReplayer:
+    """Runs captured requests through DrugOptimizer the way server.py handles them, minus the response cache."""
+
+    def __init__(self, db_path):
+        self.engine = DrugOptimizer(db_path, precomputed=PrecomputedRegimens(db_path))
+        self.vocabulary = ConditionVocabulary(db_path, self.engine.rules)
+        self.data_version = DataVersion(db_path).current()
+
+    def replay(self, record):
+        """Returns (status, result); status None means the request cannot be replayed directly."""
+        route, payload = record['route'], record['payload']
+        if route == '/optimize/text':
+            # NER is not replayed; the conditions it extracted are solved as server.optimize_text does
+            if 'conditions' not in payload:
+                return None, None
+            if not payload['conditions']:
+                return 200, {'status': "No Medical Conditions Found", 'regimen': []}
+
+        conditions, _, _ = self.vocabulary.normalize_all(payload.get('conditions', []))
+        mode = (payload.get('mode') or 'ilp').lower()
+        medications = payload.get('current_medications', [])
+
+        if route == '/graph':
+            # Same node and link sets as server.build_graph + page_graph, without the display fields
+            drugs, coverage, _, direct, metabolic, _, _ = self.engine.graph_problem(
+                conditions, top_n=payload.get('top_n', GRAPH_TOP_N), collapse=payload.get('collapse', True))
+            offset, limit = payload.get('offset', 0), payload.get('limit')
+            end = len(drugs) if limit is None else offset + limit
+            position = {d: i for i, d in enumerate(drugs)}
+            page = drugs[offset:end]
+            shown = set(page)
+            links = [(c, d) for c in conditions for d in coverage[c] if d in shown]
+            links += [p for p in direct | metabolic if p[0] != p[1] and offset <= max(map(position.get, p)) < end]
+            return 200, {'nodes': [{'id': d, 'group': 'drug'} for d in page], 'links': links}
+        if route == '/optimize/pareto':
+            return 200, self.engine.solve_pareto(conditions, points=payload.get('points', PARETO_POINTS))
+        if mode == 'greedy':
+            return 200, self.engine.solve_greedy(conditions, medications=medications)
+        if mode == 'lagrangian':
+            return 200, self.engine.solve_lagrangian(conditions, medications=medications)
+        return 200, self.engine.solve_ilp(conditions, deadline_ms=payload.get('deadline_ms'),
+                                          medications=medications)
+
+    def run_one(self, index, record, scheduled=None):
+        timings, token = start_request()
+        start = time.perf_counter()
+        try:
+            status, result = self.replay(record)
+        except Exception as e:
+            status, result = 500, {'error': str(e)}
+        seconds = time.perf_counter() - (scheduled or start)
+        end_request(timings, token, record['route'], status, seconds)
+        return entry(index, record, status, seconds, result,
+                     server_ms=round(sum(timings.spans.values()) * 1000, 2))
+
+    def run(self, records, speed=0.0, workers=REPLAY_WORKERS):
+        if not speed:
+            return [self.run_one(i, r) for i, r in enumerate(records)]
+        # Paced: submit each request at its (scaled) original offset
+        origin = time.perf_counter()
+        t0 = records[0]['ts'] if records else 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for i, record in enumerate(records):
+                scheduled = origin + (record['ts'] - t0) / speed
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+                futures.append(pool.submit(self.run_one, i, record, scheduled))
+            return [f.result() for f in futures]
+
+
+class HttpReplayer:
+    """Sends captured requests to a running server."""
+
+    def __init__(self, host, port, timeout=60.0):
+        self.client = HttpClient(host, port, timeout=timeout)
+        self.data_version = None
+
+    async def run_one(self, index, record, scheduled=None):
+        start = time.perf_counter()
+        route, payload = record['route'], record['payload']
+        if route == '/optimize/text' and 'text' not in payload:
+            # The note itself was not captured, so its extracted conditions go to /optimize
+            if not payload.get('conditions'):
+                return entry(index, record, None, 0.0, None)
+            route = '/optimize'
+        try:
+            status, headers, body = await self.client.request('POST', route, payload)
+            result = json.loads(body) if 200 <= status < 300 else None
+            server_ms = server_total_ms(headers.get('server-timing', ''))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"⚠️ Request {index} failed: {e}")
+            status, result, server_ms = 0, None, None
+        return entry(index, record, status, time.perf_counter() - (scheduled or start), result, server_ms)
+
+    async def _run(self, records, speed):
+        if not speed:
+            results = [await self.run_one(i, r) for i, r in enumerate(records)]
+        else:
+            origin = time.perf_counter()
+            t0 = records[0]['ts'] if records else 0
+            tasks = []
+            for i, record in enumerate(records):
+                scheduled = origin + (record['ts'] - t0) / speed
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                tasks.append(asyncio.ensure_future(self.run_one(i, record, scheduled)))
+            results = list(await asyncio.gather(*tasks))
+        self.client.close()
+        return results
+
+    def run(self, records, speed=0.0):
+        return asyncio.run(self._run(records, speed))
+
+
+def entry(index, record, status, seconds, result, server_ms=None):
+    return {
+        'index': index,
+        'route': record['route'],
+        'mode': record.get('mode'),
+        'payload': record['payload'],
+        'status': status,
+        'latency_ms': round(seconds * 1000, 2),
+        'server_ms': server_ms,
+        'original_ms': record.get('duration_ms'),
+        'summary': summarize_result(record['route'], result) if status == 200 else None,
+        'error': result.get('error') if status not in (None, 200) and isinstance(result, dict) else None,
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+
+def route_timings(results):
+    routes = {}
+    for r in results:
+        if r['status'] is not None:
+            routes.setdefault(r['route'], []).append(r['latency_ms'])
+    return {route: {'requests': len(v), 'p50_ms': round(statistics.median(v), 2), 'p95_ms': percentile(v, 0.95)}
+            for route, v in routes.items()}
+
+
+def diff_runs(a, b, show=DIFF_SHOW, min_ms=DIFF_MIN_MS):
+    """
+    Compares two replays of the same capture. Returns (differences, timing rows, slowdowns):
+    requests whose results differ, per-route latency before/after, and the requests that
+    slowed down the most.
+    """
+    if len(a['results']) != len(b['results']):
+        print(f"⚠️ Runs replayed different captures ({len(a['results'])} vs {len(b['results'])} requests)")
+    pairs = [(x, y) for x, y in zip(a['results'], b['results'])
+             if x['status'] is not None and y['status'] is not None]
+
+    differences = [(x, y) for x, y in pairs if (x['status'], x['summary']) != (y['status'], y['summary'])]
+
+    before, after = route_timings([x for x, _ in pairs]), route_timings([y for _, y in pairs])
+    timing_rows = []
+    for route in sorted(before):
+        old, new = before[route], after[route]
+        timing_rows.append({
+            'route': route,
+            'requests': old['requests'],
+            'a_p50_ms': old['p50_ms'],
+            'b_p50_ms': new['p50_ms'],
+            'a_p95_ms': old['p95_ms'],
+            'b_p95_ms': new['p95_ms'],
+            'p50_ratio': round(new['p50_ms'] / old['p50_ms'], 2) if old['p50_ms'] else '-',
+        })
+
+    slowdowns = sorted((p for p in pairs if p[1]['latency_ms'] - p[0]['latency_ms'] > min_ms),
+                       key=lambda p: p[1]['latency_ms'] / max(p[0]['latency_ms'], 1e-3), reverse=True)[:show]
+    return differences, timing_rows, slowdowns
+
+
+def print_diff(a, b, differences, timing_rows, slowdowns, show=DIFF_SHOW):
+    print(f"A: {a.get('label')} (data version {a.get('data_version')})")
+    print(f"B: {b.get('label')} (data version {b.get('data_version')})\n")
+    print_table(timing_rows)
+
+    print(f"\n{len(differences)} request(s) with different results")
+    for x, y in differences[:show]:
+        print(f"  #{x['index']} {x['route']} {x['payload'].get('conditions') or x['payload'].get('text')}")
+        if x['status'] != y['status'] or not (x['summary'] and y['summary']):
+            print(f"     status {x['status']} -> {y['status']} {y['error'] or x['error'] or ''}")
+            continue
+        for field in x['summary']:
+            old, new = x['summary'][field], y['summary'].get(field)
+            if old == new:
+                continue
+            if isinstance(old, list) and old and not isinstance(old[0], list):
+                print(f"     {field}: -{sorted(set(old) - set(new))} +{sorted(set(new) - set(old))}")
+            else:
+                print(f"     {field}: {old} -> {new}")
+
+    if slowdowns:
+        print("\nLargest slowdowns (A -> B)")
+        for x, y in slowdowns:
+            print(f"  #{x['index']} {x['route']} {x['latency_ms']:.1f} ms -> {y['latency_ms']:.1f} ms  "
+                  f"{x['payload'].get('conditions') or x['payload'].get('text')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured traffic and compare runs")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Replay a capture against a database or a server")
+    run_parser.add_argument('capture', nargs='+', help="Capture files or directories")
+    run_parser.add_argument('--db', default=DB_PATH, help="Database for direct replay")
+    run_parser.add_argument('--url', help="Replay over HTTP against host:port instead of calling the optimizer")
+    run_parser.add_argument('--speed', type=float, default=0.0,
+                            help="Pace relative to the capture (1 = original, 10 = 10x faster, 0 = back to back)")
+    run_parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+    run_parser.add_argument('--label', help="Name for this run in diffs (default: target)")
+    run_parser.add_argument('--output', default='replay_results.json')
+
+    diff_parser = commands.add_parser('diff', help="Compare two replay runs of the same capture")
+    diff_parser.add_argument('a')
+    diff_parser.add_argument('b')
+    diff_parser.add_argument('--show', type=int, default=DIFF_SHOW)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        records = read_capture(args.capture)[:args.limit]
+        if args.url:
+            host, _, port = args.url.replace('http://', '').rstrip('/').rpartition(':')
+            replayer = HttpReplayer(host or '127.0.0.1', int(port))
+        else:
+            replayer = DirectReplayer(args.db)
+        print(f"Replaying {len(records)} requests against {args.url or args.db} "
+              f"({'back to back' if not args.speed else f'{args.speed}x original pace'})...")
+
+        if args.url:
+            results = replayer.run(records, args.speed)
+        else:
+            # Optimizer progress lines would drown the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = replayer.run(records, args.speed)
+        failed = sum(1 for r in results if r['status'] not in (None, 200))
+        if failed:
+            print(f"⚠️ {failed} requests failed")
+        skipped = sum(1 for r in results if r['status'] is None)
+        if skipped:
+            print(f"⚠️ {skipped} /optimize/text requests skipped (captured without their extracted conditions)")
+        with open(args.output, 'w') as f:
+            json.dump({'label': args.label or args.url or args.db, 'target': args.url or args.db,
+                       'data_version': replayer.data_version, 'speed': args.speed, 'capture': args.capture,
+                       'results': results}, f, indent=2)
+        print_table([dict(route=route, **stats) for route, stats in route_timings(results).items()])
+        print(f"Results written to {args.output}")
+
+    elif args.command == 'diff':
+        with open(args.a) as f:
+            run_a = json.load(f)
+        with open(args.b) as f:
+            run_b = json.load(f)
+        differences, timing_rows, slowdowns = diff_runs(run_a, run_b, args.show)
+        print_diff(run_a, run_b, differences, timing_rows, slowdowns, args.show)
+        sys.exit(1 if differences else 0)
@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+import threading
+from collections import deque
+
+from metrics import log
+
+# Rule table; REGIMEN_RULES points the server at another file
+RULES_PATH = os.environ.get('REGIMEN_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'search_rules.json'))
+# Expected expansions recorded from the hard-coded rules this table replaced
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules_corpus.json')
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: one pass over a text reports every keyword it contains."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.out[state].add(keyword)
+
+        # Breadth-first failure links; each state also reports its failure state's keywords
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def find(self, text):
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.out[state]:
+                found |= self.out[state]
+        return found
+
+
+class CompiledRules:
+    """A rule table compiled into one automaton plus keyword -> rule lookups."""
+
+    def __init__(self, table):
+        self.replace = table.get('replace_terms', [])
+        self.extend = table.get('extend_terms', [])
+        self.routes = table.get('routes', [])
+        self.default_route = table.get('default_route', '')
+        self.exclusions = table.get('exclusions', [])
+        self.contexts = table.get('contexts', {})
+        # search term -> ATC code prefixes of the therapeutic class it names
+        self.class_terms = {term.lower(): codes for term, codes in table.get('class_terms', {}).items()}
+
+        # keyword -> [(section, rule index)]
+        self.index = {}
+        sections = {'replace': self.replace, 'extend': self.extend, 'route': self.routes,
+                    'exclude': self.exclusions}
+        for section, rules in sections.items():
+            for i, rule in enumerate(rules):
+                for keyword in rule.get('keywords', []) + rule.get('unless', []):
+                    self.index.setdefault(keyword.lower(), []).append((section, i))
+        for name, keywords in self.contexts.items():
+            for keyword in keywords:
+                self.index.setdefault(keyword.lower(), []).append(('context', name))
+
+        self.automaton = KeywordAutomaton(self.index)
+
+    def _matches(self, text):
+        matched = {'replace': set(), 'extend': set(), 'route': set(), 'exclude': set(), 'context': set()}
+        for keyword in self.automaton.find(text):
+            for section, key in self.index[keyword]:
+                matched[section].add(key)
+        return matched
+
+    def expand(self, condition, all_conditions_text):
+        """Returns (search_terms, route, exclusions) for one condition."""
+        c_lower = condition.lower()
+        hits = self._matches(c_lower)
+        contexts = self._matches(all_conditions_text)['context']
+
+        # 1. Search terms: the first matching replace rule wins, else the condition plus extensions
+        if hits['replace']:
+            rule = self.replace[min(hits['replace'])]
+            terms = rule['terms']
+            for name, context_terms in rule.get('context_terms', {}).items():
+                if name in contexts:
+                    terms = context_terms
+                    break
+            search_terms = list(terms)
+        else:
+            search_terms = [c_lower.strip()]
+            for i in sorted(hits['extend']):
+                search_terms.extend(t for t in self.extend[i]['terms'] if t not in search_terms)
+
+        # 2. Route: first matching route rule
+        route = self.routes[min(hits['route'])]['route'] if hits['route'] else self.default_route
+
+        # 3. Exclusions: every rule whose keywords, unless-keywords and context all agree
+        exclusions = []
+        for i, rule in enumerate(self.exclusions):
+            keyword_hit = i in hits['exclude']
+            if rule.get('keywords') and not keyword_hit:
+                continue
+            if rule.get('unless') and keyword_hit:
+                continue
+            if rule.get('context') and rule['context'] not in contexts:
+                continue
+            exclusions.extend(rule['terms'])
+
+        return search_terms, route, exclusions
+
+
+class RuleEngine:
+    """
+    Serves expansions from the rule file, recompiling it when it changes on disk.
+    A file that fails to load keeps the previous rules in service.
+    """
+
+    def __init__(self, path=RULES_PATH):
+        self.path = path
+        self._signature = None
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    try:
+                        with open(self.path) as f:
+                            self._compiled = CompiledRules(json.load(f))
+                        log(f"Loaded search rules from {self.path}")
+                    except (OSError, ValueError, KeyError, TypeError) as e:
+                        if self._compiled is None:
+                            raise
+                        log(f"⚠️ Could not reload search rules ({e}), keeping the previous rules")
+                    self._signature = signature
+        return self._compiled
+
+    def expand(self, condition, all_conditions_text):
+        return self.current().expand(condition, all_conditions_text)
+
+    def class_codes(self, term):
+        """ATC code prefixes curated for a search term, or None if it names no class."""
+        return self.current().class_terms.get(term.lower().strip())
+
+    def keywords(self):
+        return list(self.current().index)
+
+    def recognises(self, text):
+        """True if any rule keyword occurs in the (lower-case) text."""
+        return bool(self.current().automaton.find(text))
+
+
+def check_corpus(rules_path=RULES_PATH, corpus_path=CORPUS_PATH):
+    """Expands every corpus entry with the rule file. Returns the mismatches."""
+    engine = RuleEngine(rules_path)
+    with open(corpus_path) as f:
+        corpus = json.load(f)
+
+    mismatches = []
+    for case in corpus:
+        conditions = case['conditions']
+        terms, route, exclusions = engine.expand(conditions[0], " ".join(conditions).lower())
+        got = {'search_terms': sorted(set(terms)), 'route': route, 'exclusions': exclusions}
+        for field, value in got.items():
+            if value != case[field]:
+                mismatches.append((conditions, field, case[field], value))
+
+    print(f"Checked {len(corpus)} corpus entries against {rules_path}.")
+    for conditions, field, expected, value in mismatches:
+        print(f"❌ {conditions} {field}: expected {expected}, got {value}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check_corpus(*sys.argv[1:2]) else 0)
@@ -1,9 +1,20 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-import sqlite3
-from optimizer import DrugOptimizer
+import hmac
+import os
+import time
+from capture import CAPTURE_DIR, TrafficCapture
+from metrics import REGISTRY, current_request, end_request, log, span, start_request
+from profiling import MemoryTracker, Profiler, profiled
+from optimizer import (DrugOptimizer, ILP_WEIGHTS, GREEDY_WEIGHTS, GRAPH_TOP_N, PARTIAL_STATUSES, PARETO_POINTS,
+                       medication_key)
+from cache import DataVersion, PrecomputedRegimens, ResponseCache, SingleFlight, relabel_conditions
+from enrichment import enrich_details
+from sessions import SessionStore
+from vocabulary import ConditionVocabulary
 
 # --- NLP Setup ---
 try:
@@ -24,81 +35,124 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """
+    Per-stage spans of each request, returned in a Server-Timing header and exported on /metrics.
+    With traffic capture on, replayable requests are also recorded with their timings.
+    Requests picked by an armed profiler are profiled.
+    """
+    timings, token = start_request()
+    timings.profile = profiler.claim(request.method, request.url.path)
+    start = time.perf_counter()
+    status = 500
+    body = None
+    if traffic_capture is not None and traffic_capture.wants(request.method, request.url.path):
+        body = await request.body()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers['Server-Timing'] = timings.server_timing(time.perf_counter() - start)
+        return response
+    finally:
+        seconds = time.perf_counter() - start
+        # Route templates, not raw paths, so session ids do not become label values
+        route = getattr(request.scope.get('route'), 'path', request.url.path)
+        end_request(timings, token, route, status, seconds)
+        if timings.profile is not None:
+            profiler.finish(timings.profile, route, status, seconds)
+        if body is not None:
+            traffic_capture.record(route, body, status, seconds, timings.spans, response_cache.data_version.current(),
+                                   extracted=timings.captured)
+
+
 DB_PATH = 'drug_project.db'
-optimizer_engine = DrugOptimizer(DB_PATH)
+
+# --- Response Cache ---
+# Set REGIMEN_CACHE_DB to a file path to share cached responses across workers.
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 600
+response_cache = ResponseCache(
+    DataVersion(DB_PATH),
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL_SECONDS,
+    disk_path=os.environ.get('REGIMEN_CACHE_DB')
+)
+
+# --- Traffic Capture ---
+# Set REGIMEN_CAPTURE_DIR to record sanitized requests for `python replay.py` (rotating JSONL)
+traffic_capture = TrafficCapture(CAPTURE_DIR) if CAPTURE_DIR else None
+
+# --- Profiling ---
+# Set REGIMEN_ADMIN_TOKEN to enable the /admin endpoints (sent as the X-Admin-Token header)
+ADMIN_TOKEN = os.environ.get('REGIMEN_ADMIN_TOKEN')
+profiler = Profiler()
+memory_tracker = MemoryTracker()
+
+# Offline ILP answers for frequent combinations (`python precompute.py`, also run by the ETL)
+precomputed_regimens = PrecomputedRegimens(DB_PATH)
+
+optimizer_engine = DrugOptimizer(DB_PATH, cache=response_cache, precomputed=precomputed_regimens)
+
+# Identical texts submitted concurrently share one NER inference
+nlp_flights = SingleFlight()
+
+# Incremental re-optimization sessions (bounded, idle ones are evicted)
+session_store = SessionStore(optimizer_engine, data_version=DataVersion(DB_PATH))
+
+# Typos and run-together words are mapped onto known terms before candidate retrieval
+condition_vocabulary = ConditionVocabulary(DB_PATH, optimizer_engine.rules)
 
 
 # --- Data Models ---
 class OptimizeRequest(BaseModel):
     conditions: List[str]
-    mode: str = "ilp"  # Options: 'ilp', 'greedy'
+    mode: str = "ilp"  # Options: 'ilp', 'greedy', 'lagrangian'
+    deadline_ms: Optional[int] = None  # ILP only: cap solve time, return best incumbent or greedy
+    current_medications: List[str] = []  # DrugBank ids or names, kept in the regimen
 
 
-class TextRequest(BaseModel):
-    text: str
-    mode: str = "ilp"
+class ParetoRequest(BaseModel):
+    conditions: List[str]
+    points: int = PARETO_POINTS  # Weight settings swept from safety-first to price-first
 
 
-# --- Database Helpers ---
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+class ProfileRequest(BaseModel):
+    mode: str = "sample"  # Options: 'sample' (stack sampling), 'cprofile' (every call)
+    requests: int = 10  # Requests to profile before disarming
+    fraction: float = 1.0  # Chance that each request is picked
+    routes: List[str] = []  # Only these paths, e.g. ["/optimize"]; empty means all
 
 
-def get_list_data(conn, drug_id, table, column):
-    """Helper to fetch simple lists like synonyms."""
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT {column} FROM {table} WHERE drugbank_id = ?", (drug_id,))
-    return [row[0] for row in cursor.fetchall()]
+class SessionRequest(BaseModel):
+    conditions: List[str] = []
+    mode: str = "ilp"  # Options: 'ilp', 'greedy', 'lagrangian'
+    deadline_ms: Optional[int] = None
 
 
-def enrich_details(drug_id, basic_info):
-    """
-    Fetches extra details for the UI, including new metabolic info.
-    """
-    conn = get_db_connection()
-    try:
-        # 1. Synonyms
-        basic_info['synonyms'] = get_list_data(conn, drug_id, 'synonyms', 'synonym')[:5]
-
-        # 2. Food Interactions
-        basic_info['food_interactions'] = get_list_data(conn, drug_id, 'food_interactions', 'interaction_text')
-
-        # 3. Dosages
-        c = conn.cursor()
-        c.execute("SELECT form, route, strength FROM dosages WHERE drugbank_id = ? LIMIT 5", (drug_id,))
-        basic_info['dosages'] = [dict(row) for row in c.fetchall()]
-
-        # 4. Pathways
-        basic_info['pathways'] = get_list_data(conn, drug_id, 'pathways', 'pathway_name')
-
-        # 5. Enzymes
-        # Crucial for explaining metabolic risks
-        c.execute("""
-                  SELECT enzyme_name, action, inhibition_strength, induction_strength
-                  FROM enzymes
-                  WHERE drugbank_id = ?
-                    AND (organism = 'Humans'
-                     OR organism IS NULL)
-                      LIMIT 5
-                  """, (drug_id,))
-        basic_info['enzymes'] = [dict(row) for row in c.fetchall()]
-
-        # 6. Targets
-        c.execute("""
-                  SELECT target_name, known_action
-                  FROM targets
-                  WHERE drugbank_id = ?
-                    AND (organism = 'Humans' OR organism IS NULL) LIMIT 5
-                  """, (drug_id,))
-        basic_info['targets'] = [dict(row) for row in c.fetchall()]
+class SessionUpdate(BaseModel):
+    add: List[str] = []
+    remove: List[str] = []
+    deadline_ms: Optional[int] = None
 
-    finally:
-        conn.close()
-    return basic_info
 
+class GraphRequest(BaseModel):
+    conditions: List[str]
+    top_n: Optional[int] = GRAPH_TOP_N  # Drugs kept per condition, best first; null keeps every candidate
+    collapse: bool = True  # One node per set of interchangeable drugs, listing the others as substitutes
+    offset: int = 0  # Drug nodes to skip (pagination)
+    limit: Optional[int] = None  # Drug nodes per page; null returns the whole graph
+
+
+class TextRequest(BaseModel):
+    text: str
+    mode: str = "ilp"
+    deadline_ms: Optional[int] = None
+    current_medications: List[str] = []
 
+
+# --- Database Helpers ---
 def merge_subwords(results):
     """
     Reconstructs words split by the tokenizer (e.g., 'stomach' + '##ache' -> 'stomachache').
@@ -137,32 +191,166 @@ def merge_subwords(results):
     return merged
 
 
+def build_graph(conditions, coverage, drug_info, drugs=None, direct=(), metabolic=(), substitutes=None):
+    """
+    Nodes/links of the Condition -> Drug coverage network, plus Drug - Drug conflict links.
+    `drugs` limits and orders the drug nodes (default: every drug in drug_info);
+    `substitutes` lists the equivalent drugs each node stands for.
+    """
+    nodes = []
+    links = []
+    existing_nodes = set()
+    drugs = list(drug_info) if drugs is None else drugs
+    shown = set(drugs)
+
+    # Condition Nodes
+    for c in conditions:
+        if c not in existing_nodes:
+            nodes.append({"id": c, "name": c, "group": "condition"})
+            existing_nodes.add(c)
+
+        # Links: Condition -> Drug
+        for d_id in coverage[c]:
+            if d_id in shown:
+                links.append({"source": c, "target": d_id, "value": 1, "type": "coverage"})
+
+    # Drug Nodes
+    for d_id in drugs:
+        if d_id not in existing_nodes:
+            info = drug_info[d_id]
+            node = {
+                "id": d_id,
+                "name": info['name'],
+                "group": "drug",
+                "toxicity": info['toxicity_score']
+            }
+            if substitutes and d_id in substitutes:
+                node['substitutes'] = [{"id": s, "name": drug_info[s]['name']} for s in substitutes[d_id]]
+            nodes.append(node)
+            existing_nodes.add(d_id)
+
+    # Links: Drug - Drug conflicts
+    for kind, pairs in (("direct", direct), ("metabolic", metabolic)):
+        for d1, d2 in sorted(pairs):
+            if d1 != d2 and d1 in shown and d2 in shown:
+                links.append({"source": d1, "target": d2, "value": 1, "type": kind})
+
+    return {"nodes": nodes, "links": links}
+
+
+def page_graph(graph, offset=0, limit=None):
+    """
+    Drug nodes [offset, offset + limit) of a graph, with every condition node, the
+    coverage links of those drugs and the conflict links that end on them. A conflict
+    link is sent with the later of its two drugs, so pages fetched in order add up to
+    the whole graph with no link repeated.
+    """
+    drugs = [n for n in graph['nodes'] if n['group'] == 'drug']
+    end = len(drugs) if limit is None else offset + limit
+    position = {n['id']: i for i, n in enumerate(drugs)}
+    page = {n['id'] for n in drugs[offset:end]}
+
+    links = []
+    for link in graph['links']:
+        if link['type'] == 'coverage':
+            if link['target'] in page:
+                links.append(link)
+        elif max(position[link['source']], position[link['target']]) in range(offset, end):
+            links.append(link)
+
+    nodes = [n for n in graph['nodes'] if n['group'] != 'drug'] + drugs[offset:end]
+    return dict(graph, nodes=nodes, links=links, offset=offset, next_offset=end if end < len(drugs) else None)
+
+
+def enrich_regimen(result):
+    with span('enrich'):
+        result['regimen'] = [enrich_details(DB_PATH, drug['id'], drug) for drug in result['regimen']]
+    return result
+
+
 # --- Endpoints ---
 
+def canonical_conditions(conditions):
+    """
+    Normalized conditions, the {input: canonical} rewrites made and the
+    {input: [suggestions]} of inputs with words the vocabulary does not know.
+    """
+    conditions, changes, unmatched = condition_vocabulary.normalize_all(conditions)
+    if changes:
+        log(f"Normalized conditions: {changes}")
+    if unmatched:
+        log(f"⚠️ Unrecognised conditions: {unmatched}")
+    return conditions, changes, unmatched
+
+
 @app.post("/optimize")
+@profiled
 def optimize_regimen(req: OptimizeRequest):
     """
-    Main endpoint. Switches between ILP (Precise) and Greedy (Fast).
+    Main endpoint. Switches between ILP (Precise), Lagrangian (Bounded) and Greedy (Fast).
     """
-    print(f"Received request: {req.conditions} (Mode: {req.mode})")
+    log(f"Received request: {req.conditions} (Mode: {req.mode})")
+    conditions, changes, unmatched = canonical_conditions(req.conditions)
+
+    mode = req.mode.lower() if req.mode.lower() in ('greedy', 'lagrangian') else 'ilp'
+    weights = medication_key(GREEDY_WEIGHTS if mode == 'greedy' else ILP_WEIGHTS, req.current_medications)
+    cache_key = response_cache.make_key('optimize', conditions, mode=mode, weights=weights)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return dict(relabel_conditions(cached, conditions), normalized_conditions=changes,
+                    unmatched_conditions=unmatched)
 
     # Choose Algorithm
-    if req.mode.lower() == 'greedy':
-        result = optimizer_engine.solve_greedy(req.conditions)
+    medications = req.current_medications
+    if mode == 'greedy':
+        result = optimizer_engine.solve_greedy(conditions, medications=medications)
+    elif mode == 'lagrangian':
+        result = optimizer_engine.solve_lagrangian(conditions, medications=medications)
     else:
-        result = optimizer_engine.solve_ilp(req.conditions)
+        result = optimizer_engine.solve_ilp(conditions, deadline_ms=req.deadline_ms, medications=medications)
 
     # Enrich Result with DB Details
     final_regimen = []
-    for drug in result['regimen']:
-        enriched = enrich_details(drug['id'], drug)
-        final_regimen.append(enriched)
+    with span('enrich'):
+        for drug in result['regimen']:
+            enriched = enrich_details(DB_PATH, drug['id'], drug)
+            final_regimen.append(enriched)
 
     result['regimen'] = final_regimen
+    if result.get('solver_status') not in PARTIAL_STATUSES:
+        response_cache.put(cache_key, result)
+    result['normalized_conditions'] = changes
+    result['unmatched_conditions'] = unmatched
+    return result
+
+
+@app.post("/optimize/pareto")
+@profiled
+def optimize_pareto(req: ParetoRequest):
+    """
+    Cost vs. safety trade-off: the non-dominated ILP regimens over a sweep of weights.
+    """
+    if not 1 <= req.points <= 25:
+        raise HTTPException(status_code=400, detail="points must be between 1 and 25.")
+
+    conditions, changes, unmatched = canonical_conditions(req.conditions)
+    result = optimizer_engine.solve_pareto(conditions, points=req.points)
+
+    # Drugs recur across frontier points, so each is enriched once
+    enriched = {}
+    with span('enrich'):
+        for point in result['frontier']:
+            for i, drug in enumerate(point['regimen']):
+                if drug['id'] not in enriched:
+                    enriched[drug['id']] = enrich_details(DB_PATH, drug['id'], dict(drug))
+                point['regimen'][i] = dict(enriched[drug['id']], covered_conditions=drug['covered_conditions'])
+    result['normalized_conditions'] = changes
+    result['unmatched_conditions'] = unmatched
     return result
 
 
 @app.post("/optimize/text")
+@profiled
 def optimize_text(req: TextRequest):
     """
     Extracts entities, reconstructs fragmented words, filters context, and optimizes.
@@ -171,16 +359,18 @@ def optimize_text(req: TextRequest):
         raise HTTPException(status_code=503, detail="NLP Model not available.")
 
     # Get Raw Results
-    results = nlp_pipeline(req.text)
+    with span('ner'):
+        results, _ = nlp_flights.do(('ner', req.text), lambda: nlp_pipeline(req.text))
 
     # Merge Fragmented Tokens (Fixes 'stomach' + '##ache')
-    merged_results = merge_subwords(results)
+    with span('merge_subwords'):
+        merged_results = merge_subwords(results)
 
     # Filter for Relevant Conditions
     TARGET_LABELS = {'Disease_disorder', 'Sign_symptom', 'Diagnostic_procedure'}
 
     entities = set()
-    print(f"DEBUG: Processing {len(merged_results)} potential entities...")
+    log(f"DEBUG: Processing {len(merged_results)} potential entities...")
 
     for entity in merged_results:
         label = entity['entity_group']
@@ -191,11 +381,17 @@ def optimize_text(req: TextRequest):
             clean_word = word.strip()
             if len(clean_word) > 2:
                 entities.add(clean_word)
-                print(f" -> KEEP: {clean_word} ({label}, {score:.2f})")
+                log(f" -> KEEP: {clean_word} ({label}, {score:.2f})")
         else:
-            print(f" -> SKIP: {word} ({label}, {score:.2f})")
+            log(f" -> SKIP: {word} ({label}, {score:.2f})")
 
     cleaned_entities = list(entities)
+    conditions, changes, unmatched = canonical_conditions(cleaned_entities)
+
+    # Traffic capture keeps the extracted conditions, not the clinical note
+    timings = current_request()
+    if timings is not None:
+        timings.captured['conditions'] = conditions
 
     if not cleaned_entities:
         return {
@@ -205,55 +401,211 @@ def optimize_text(req: TextRequest):
         }
 
     # Optimization
+    medications = req.current_medications
     if req.mode.lower() == 'greedy':
-        result = optimizer_engine.solve_greedy(cleaned_entities)
+        result = optimizer_engine.solve_greedy(conditions, medications=medications)
+    elif req.mode.lower() == 'lagrangian':
+        result = optimizer_engine.solve_lagrangian(conditions, medications=medications)
     else:
-        result = optimizer_engine.solve_ilp(cleaned_entities)
+        result = optimizer_engine.solve_ilp(conditions, deadline_ms=req.deadline_ms, medications=medications)
 
     # Enrichment
     final_regimen = []
-    for drug in result['regimen']:
-        enriched = enrich_details(drug['id'], drug)
-        final_regimen.append(enriched)
+    with span('enrich'):
+        for drug in result['regimen']:
+            enriched = enrich_details(DB_PATH, drug['id'], drug)
+            final_regimen.append(enriched)
 
     result['regimen'] = final_regimen
     result['nlp_source_entities'] = cleaned_entities
+    result['normalized_conditions'] = changes
+    result['unmatched_conditions'] = unmatched
     return result
 
 @app.post("/graph")
-def get_graph(req: OptimizeRequest):
+@profiled
+def get_graph(req: GraphRequest):
     """
-    Generates nodes/links for visualization.
-    Uses the optimizer's internal candidate fetcher to map Conditions -> Drugs.
+    Generates nodes/links for visualization: Condition -> Drug coverage and Drug - Drug
+    (direct, metabolic) conflicts, pruned to the best `top_n` drugs per condition and
+    optionally one page of drug nodes at a time. The pruned graph is cached per condition
+    set and options, so later pages are served from the cache.
     """
-    candidates, coverage, drug_info = optimizer_engine._fetch_candidates(req.conditions)
+    if req.top_n is not None and req.top_n < 1:
+        raise HTTPException(status_code=400, detail="top_n must be at least 1.")
+    if req.offset < 0 or (req.limit is not None and req.limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1.")
+
+    conditions, _, _ = canonical_conditions(req.conditions)
+    options = {'top_n': req.top_n, 'collapse': req.collapse}
+    cache_key = response_cache.make_key('graph', conditions, weights=options)
+    graph = response_cache.get(cache_key)
+    if graph is not None:
+        graph = relabel_conditions(graph, conditions)
+    else:
+        drugs, coverage, drug_info, direct, metabolic, substitutes, total = optimizer_engine.graph_problem(
+            conditions, top_n=req.top_n, collapse=req.collapse)
+        graph = build_graph(conditions, coverage, drug_info, drugs, direct, metabolic, substitutes)
+        graph['total_candidates'] = total
+        graph['drug_nodes'] = len(drugs)
+        response_cache.put(cache_key, graph)
+    return page_graph(graph, req.offset, req.limit)
 
-    nodes = []
-    links = []
-    existing_nodes = set()
 
-    # Condition Nodes
-    for c in req.conditions:
-        if c not in existing_nodes:
-            nodes.append({"id": c, "name": c, "group": "condition"})
-            existing_nodes.add(c)
+def get_session(session_id):
+    try:
+        return session_store.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found or expired.")
+
+
+def solve_session(session, add=None, remove=None, deadline_ms=None):
+    add, added_changes, added_unmatched = canonical_conditions(add or [])
+    remove, removed_changes, _ = canonical_conditions(remove or [])
+    with session.lock:
+        try:
+            session.update(add=add, remove=remove)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = enrich_regimen(session.solve(deadline_ms))
+        result['session'] = session.info()
+    result['normalized_conditions'] = dict(added_changes, **removed_changes)
+    result['unmatched_conditions'] = added_unmatched
+    return result
 
-        # Links: Condition -> Drug
-        for d_id in coverage[c]:
-            links.append({"source": c, "target": d_id, "value": 1})
 
-    # Drug Nodes
-    for d_id, info in drug_info.items():
-        if d_id not in existing_nodes:
-            nodes.append({
-                "id": d_id,
-                "name": info['name'],
-                "group": "drug",
-                "toxicity": info['toxicity_score']
-            })
-            existing_nodes.add(d_id)
+@app.post("/sessions")
+@profiled
+def create_session(req: SessionRequest):
+    """
+    Starts an incremental session. Later changes re-fetch only the conditions they
+    affect and re-solve from the previous regimen.
+    """
+    try:
+        session = session_store.create(req.mode.lower())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return solve_session(session, add=req.conditions, deadline_ms=req.deadline_ms)
 
-    return {"nodes": nodes, "links": links}
+
+@app.patch("/sessions/{session_id}")
+@profiled
+def update_session(session_id: str, req: SessionUpdate):
+    """Adds/removes conditions and re-optimizes."""
+    return solve_session(get_session(session_id), add=req.add, remove=req.remove, deadline_ms=req.deadline_ms)
+
+
+@app.get("/sessions/{session_id}")
+def session_info(session_id: str):
+    return get_session(session_id).info()
+
+
+@app.get("/sessions/{session_id}/graph")
+@profiled
+def session_graph(session_id: str):
+    """Coverage graph of the session's conditions, from its cached candidates."""
+    session = get_session(session_id)
+    with session.lock:
+        _, coverage, drug_info, direct, all_conflicts = session.problem()
+        return build_graph(session.conditions, coverage, drug_info, direct=direct, metabolic=all_conflicts - direct)
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired.")
+    return {"status": "deleted"}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit rates per cache namespace (optimize, graph, ilp, greedy) and request coalescing rates."""
+    stats = response_cache.stats()
+    stats['coalescing'] = {
+        'solver': optimizer_engine.flights.stats(),
+        'nlp': nlp_flights.stats(),
+    }
+    stats['sessions'] = session_store.stats()
+    stats['precomputed'] = precomputed_regimens.stats()
+    return stats
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Stage and request latency histograms and per-request counters, in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+# --- Admin: Profiling ---
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints do not exist unless REGIMEN_ADMIN_TOKEN is set, and need that token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+def arm_profiler(req: ProfileRequest):
+    """Profiles the next `requests` requests (or a `fraction` of them) without a restart."""
+    try:
+        return profiler.arm(req.mode.lower(), req.requests, req.fraction, req.routes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+def profiler_status():
+    return profiler.status()
+
+
+@app.get("/admin/profile/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str, format: str = "folded"):
+    """One profile, or 'all' sampled ones combined, as folded stacks, text or pstats."""
+    if profile_id != 'all' and not profile_id.isdigit():
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    try:
+        content, media_type, filename = profiler.export(profile_id, format)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content, media_type=media_type,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+def clear_profiles():
+    profiler.clear()
+    return {"status": "cleared"}
+
+
+@app.post("/admin/memory/snapshot", dependencies=[Depends(require_admin)])
+def memory_snapshot():
+    """tracemalloc snapshot; the first call starts tracing, so take one before the workload."""
+    return memory_tracker.snapshot()
+
+
+@app.get("/admin/memory/diff", dependencies=[Depends(require_admin)])
+def memory_diff(base: Optional[int] = None, target: Optional[int] = None, group: str = "lineno",
+                limit: int = 25, format: str = "json"):
+    """Allocation growth between two snapshots (default: the last two); format=folded for a flamegraph."""
+    try:
+        diff, folded = memory_tracker.diff(base, target, group, limit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Snapshot not found.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == 'folded':
+        return Response(folded, media_type='text/plain',
+                        headers={'Content-Disposition': 'attachment; filename="memory.folded"'})
+    return diff
+
+
+@app.delete("/admin/memory", dependencies=[Depends(require_admin)])
+def stop_memory_tracking():
+    memory_tracker.stop()
+    return {"status": "stopped"}
 
 
 @app.get("/")
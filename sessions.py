@@ -0,0 +1,210 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from metrics import note, span
+
+# Live sessions kept in memory; the least recently used is evicted beyond this
+SESSION_MAX = 256
+# Sessions untouched for this long are dropped
+SESSION_IDLE_SECONDS = 1800
+# Conditions per session (bounds the candidate set and conflict subgraph a session holds)
+SESSION_MAX_CONDITIONS = 50
+
+SESSION_MODES = ('ilp', 'greedy', 'lagrangian')
+
+
+class RegimenSession:
+    """
+    A condition list that changes one condition at a time. Keeps each condition's
+    candidates, the drug info and the conflict subgraph of their union, so a change
+    only queries the conditions whose candidate query changed and the conflicts of
+    drugs that entered the union. Re-solves start from the previous regimen.
+    """
+
+    def __init__(self, session_id, optimizer, mode='ilp', data_version=None):
+        self.session_id = session_id
+        self.optimizer = optimizer
+        self.mode = mode
+        self.data_version = data_version
+        self.conditions = []
+        self.regimen = []
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self._stats = defaultdict(int)
+        self._reset()
+
+    def _reset(self):
+        self._fetched = {}  # condition -> (query signature, covering drug ids)
+        self._members = set()  # union of candidates the conflict subgraph covers
+        self._drug_info = {}
+        self._direct = set()
+        self._all = set()
+        self._enzymes = defaultdict(lambda: defaultdict(list))
+
+    def update(self, add=None, remove=None):
+        """Applies the condition changes and fetches only what they invalidate."""
+        drop = {c.lower().strip() for c in remove or []}
+        conditions = [c for c in self.conditions if c.lower().strip() not in drop]
+        for cond in add or []:
+            cond = cond.strip()
+            if cond and cond.lower() not in {c.lower() for c in conditions}:
+                conditions.append(cond)
+        if len(conditions) > SESSION_MAX_CONDITIONS:
+            raise ValueError(f"A session holds at most {SESSION_MAX_CONDITIONS} conditions.")
+
+        self.conditions = conditions
+        self._sync()
+
+    def reload(self, data_version):
+        """Drops everything fetched from an older database and fetches it again."""
+        self.data_version = data_version
+        self._reset()
+        self._sync()
+        self._stats['reloads'] += 1
+
+    def _sync(self):
+        # 1. Conditions whose candidate query changed (new, or context such as asthma changed)
+        text = " ".join(self.conditions).lower()
+        signatures = {}
+        for cond in self.conditions:
+            query, params, _ = self.optimizer._condition_query(cond, text)
+            signatures[cond] = (query, tuple(params))
+
+        stale = [c for c in self.conditions if c not in self._fetched or self._fetched[c][0] != signatures[c]]
+        for cond in list(self._fetched):
+            if cond not in signatures:
+                del self._fetched[cond]
+
+        self._stats['conditions_reused'] += len(self.conditions) - len(stale)
+        self._stats['conditions_fetched'] += len(stale)
+        if stale:
+            _, coverage, drug_info = self.optimizer._fetch_candidates(stale, context=self.conditions)
+            for cond in stale:
+                self._fetched[cond] = (signatures[cond], set(coverage[cond]))
+            for d, info in drug_info.items():
+                self._drug_info.setdefault(d, info)
+
+        # 2. Conflict subgraph: drop departed drugs, query only for arrivals
+        union = set().union(*(drugs for _, drugs in self._fetched.values()))
+        arrived = union - self._members
+
+        if self._members - union:
+            self._direct = {p for p in self._direct if p[0] in union and p[1] in union}
+            self._all = {p for p in self._all if p[0] in union and p[1] in union}
+            for roles in self._enzymes.values():
+                for role in roles:
+                    roles[role] = [d for d in roles[role] if d in union]
+            self._drug_info = {d: info for d, info in self._drug_info.items() if d in union}
+
+        self._stats['drugs_reused'] += len(union) - len(arrived)
+        self._stats['drugs_fetched'] += len(arrived)
+        if arrived:
+            with span('conflicts'):
+                direct = self.optimizer._get_interaction_graph(list(arrived), list(union))
+                for enz, roles in self.optimizer._get_enzyme_roles(list(arrived)).items():
+                    for role, drugs in roles.items():
+                        self._enzymes[enz][role].extend(drugs)
+                metabolic = self.optimizer._metabolic_pairs(self._enzymes, new=arrived)
+                self._direct |= direct
+                self._all |= direct | metabolic
+        self._members = union
+        note('candidates', len(union))
+        note('conflict_pairs', len(self._all))
+
+    def problem(self):
+        """The session's data as a _load_problem tuple."""
+        coverage_map = defaultdict(set)
+        for cond, (_, drugs) in self._fetched.items():
+            coverage_map[cond] = set(drugs)
+        return list(self._members), coverage_map, self._drug_info, set(self._direct), set(self._all)
+
+    def solve(self, deadline_ms=None):
+        problem = self.problem()
+        if self.mode == 'greedy':
+            result = self.optimizer._solve_greedy(self.conditions, problem=problem)
+        elif self.mode == 'lagrangian':
+            result = self.optimizer._solve_lagrangian(self.conditions, problem=problem, warm_start=self.regimen)
+        else:
+            result = self.optimizer._solve_ilp(self.conditions, deadline_ms, problem=problem,
+                                               warm_start=self.regimen)
+        self.regimen = [d['id'] for d in result['regimen']]
+        return result
+
+    def info(self):
+        return {
+            'session_id': self.session_id,
+            'mode': self.mode,
+            'conditions': list(self.conditions),
+            'regimen': list(self.regimen),
+            'candidates': len(self._members),
+            'conflict_pairs': len(self._all),
+            'idle_seconds': round(time.time() - self.last_used, 1),
+            'reuse': dict(self._stats),
+        }
+
+
+class SessionStore:
+    """
+    Live sessions, LRU-bounded to max_sessions and dropped after idle_seconds without use.
+    With a DataVersion, a session is refetched on first use after the database is rebuilt.
+    """
+
+    def __init__(self, optimizer, data_version=None, max_sessions=SESSION_MAX, idle_seconds=SESSION_IDLE_SECONDS):
+        self.optimizer = optimizer
+        self.data_version = data_version
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = defaultdict(int)
+
+    def create(self, mode='ilp'):
+        if mode not in SESSION_MODES:
+            raise ValueError(f"mode must be one of {', '.join(SESSION_MODES)}.")
+        session = RegimenSession(uuid.uuid4().hex, self.optimizer, mode, self._current_version())
+        with self._lock:
+            self._evict_idle()
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._evictions['capacity'] += 1
+        return session
+
+    def get(self, session_id):
+        """Returns the session and marks it used; raises KeyError if unknown or expired."""
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions[session_id]
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.time()
+
+        version = self._current_version()
+        with session.lock:
+            if version != session.data_version:
+                session.reload(version)
+        return session
+
+    def _current_version(self):
+        return self.data_version.current() if self.data_version else None
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_seconds
+        for session_id in [s for s, session in self._sessions.items() if session.last_used < cutoff]:
+            del self._sessions[session_id]
+            self._evictions['idle'] += 1
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle()
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'idle_seconds': self.idle_seconds,
+                'evictions': dict(self._evictions),
+            }
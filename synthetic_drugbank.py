@@ -0,0 +1,255 @@
+import argparse
+import os
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+# Indication vocabulary: condition and drug-class phrases, most common first (drawn Zipf-like)
+DEFAULT_VOCABULARY = [
+    'hypertension', 'pain', 'bacterial infection', 'type 2 diabetes', 'depression', 'anxiety',
+    'hypercholesterolemia', 'asthma', 'insomnia', 'migraine', 'fever', 'headache',
+    'gastroesophageal reflux disease', 'fungal infection', 'glaucoma', 'allergic rhinitis',
+    'heart failure', 'angina', 'atrial fibrillation', 'epilepsy', 'schizophrenia', 'bipolar disorder',
+    'rheumatoid arthritis', 'osteoarthritis', 'psoriasis', 'acne', 'eczema', 'skin rash', 'nausea',
+    'peptic ulcer', 'constipation', 'diarrhea', 'urinary tract infection', 'pneumonia', 'tuberculosis',
+    'hiv infection', 'herpes', 'influenza', 'osteoporosis', 'hypothyroidism', 'gout', 'parkinson disease',
+    'alzheimer disease', 'adhd', 'obesity', 'smoking cessation', 'cancer', 'anemia', 'cough',
+]
+
+# Drug class phrases mixed into indications, as DrugBank indications often name the class
+CLASS_PHRASES = [
+    'ace inhibitor', 'beta blocker', 'diuretic', 'nsaid', 'analgesic', 'antipyretic', 'insulin',
+    'biguanide', 'benzodiazepine', 'sedative', 'statin', 'penicillin', 'macrolide', 'cephalosporin',
+    'antifungal', 'azole', 'proton pump inhibitor', 'antacid', 'ssri', 'antihistamine',
+    'corticosteroid', 'bronchodilator', 'anticoagulant', 'antiemetic', 'antiviral',
+]
+
+# (code prefix, level names from most to least specific); each drug gets one class
+ATC_CLASSES = [
+    ('C09AA', ('ACE inhibitors, plain', 'ACE INHIBITORS, PLAIN',
+               'AGENTS ACTING ON THE RENIN-ANGIOTENSIN SYSTEM', 'CARDIOVASCULAR SYSTEM')),
+    ('C07AB', ('Beta blocking agents, selective', 'BETA BLOCKING AGENTS', 'BETA BLOCKING AGENTS',
+               'CARDIOVASCULAR SYSTEM')),
+    ('C10AA', ('HMG CoA reductase inhibitors', 'LIPID MODIFYING AGENTS, PLAIN', 'LIPID MODIFYING AGENTS',
+               'CARDIOVASCULAR SYSTEM')),
+    ('A10BA', ('Biguanides', 'BLOOD GLUCOSE LOWERING DRUGS, EXCL. INSULINS', 'DRUGS USED IN DIABETES',
+               'ALIMENTARY TRACT AND METABOLISM')),
+    ('A02BC', ('Proton pump inhibitors', 'DRUGS FOR PEPTIC ULCER AND GASTRO-OESOPHAGEAL REFLUX DISEASE (GORD)',
+               'DRUGS FOR ACID RELATED DISORDERS', 'ALIMENTARY TRACT AND METABOLISM')),
+    ('J01FA', ('Macrolides', 'MACROLIDES, LINCOSAMIDES AND STREPTOGRAMINS', 'ANTIBACTERIALS FOR SYSTEMIC USE',
+               'ANTIINFECTIVES FOR SYSTEMIC USE')),
+    ('J01CA', ('Penicillins with extended spectrum', 'BETA-LACTAM ANTIBACTERIALS, PENICILLINS',
+               'ANTIBACTERIALS FOR SYSTEMIC USE', 'ANTIINFECTIVES FOR SYSTEMIC USE')),
+    ('N06AB', ('Selective serotonin reuptake inhibitors', 'ANTIDEPRESSANTS', 'PSYCHOANALEPTICS',
+               'NERVOUS SYSTEM')),
+    ('N05BA', ('Benzodiazepine derivatives', 'ANXIOLYTICS', 'PSYCHOLEPTICS', 'NERVOUS SYSTEM')),
+    ('N02BE', ('Anilides', 'OTHER ANALGESICS AND ANTIPYRETICS', 'ANALGESICS', 'NERVOUS SYSTEM')),
+    ('M01AE', ('Propionic acid derivatives', 'ANTIINFLAMMATORY AND ANTIRHEUMATIC PRODUCTS, NON-STEROIDS',
+               'ANTIINFLAMMATORY AND ANTIRHEUMATIC PRODUCTS', 'MUSCULO-SKELETAL SYSTEM')),
+    ('D01AC', ('Imidazole and triazole derivatives', 'ANTIFUNGALS FOR TOPICAL USE',
+               'ANTIFUNGALS FOR DERMATOLOGICAL USE', 'DERMATOLOGICALS')),
+    ('S01ED', ('Beta blocking agents', 'ANTIGLAUCOMA PREPARATIONS AND MIOTICS', 'OPHTHALMOLOGICALS',
+               'SENSORY ORGANS')),
+    ('R03AC', ('Selective beta-2-adrenoreceptor agonists', 'ADRENERGICS, INHALANTS',
+               'DRUGS FOR OBSTRUCTIVE AIRWAY DISEASES', 'RESPIRATORY SYSTEM')),
+    ('V03AX', ('Other therapeutic products', 'ALL OTHER THERAPEUTIC PRODUCTS', 'ALL OTHER THERAPEUTIC PRODUCTS',
+               'VARIOUS')),
+]
+
+# Class phrases naming one of the ATC classes above: as in DrugBank, a drug whose indication
+# names the class carries its ATC code
+PHRASE_ATC = {
+    'ace inhibitor': 'C09AA', 'beta blocker': 'C07AB', 'statin': 'C10AA', 'biguanide': 'A10BA',
+    'proton pump inhibitor': 'A02BC', 'macrolide': 'J01FA', 'penicillin': 'J01CA', 'ssri': 'N06AB',
+    'benzodiazepine': 'N05BA', 'analgesic': 'N02BE', 'antipyretic': 'N02BE', 'nsaid': 'M01AE',
+    'antifungal': 'D01AC', 'azole': 'D01AC', 'bronchodilator': 'R03AC',
+}
+
+# Classes for drugs whose phrase names none of the modelled classes
+OTHER_ATC_CLASSES = [code for code, _ in ATC_CLASSES if code not in PHRASE_ATC.values()]
+
+ENZYMES = ['Cytochrome P450 3A4', 'Cytochrome P450 2D6', 'Cytochrome P450 2C9', 'Cytochrome P450 2C19',
+           'Cytochrome P450 1A2', 'Cytochrome P450 2E1', 'Cytochrome P450 2B6', 'Cytochrome P450 2C8']
+
+# Probability of each enzyme action per entry; an entry that draws none is a substrate
+DEFAULT_ENZYME_ROLES = {'substrate': 0.65, 'inhibitor': 0.25, 'inducer': 0.05}
+
+# (route, weight); the rule table's default route is oral
+ROUTES = [('Oral', 6), ('Intravenous', 2), ('Topical', 1), ('Ophthalmic', 1), ('Inhalation', 1)]
+GROUPS = [('approved', 14), ('approved; investigational', 3), ('approved; withdrawn', 1),
+          ('experimental', 2), ('vet_approved', 1)]
+UNITS = ['tablet', 'capsule', 'ml', 'vial', 'g', '']
+
+SYLLABLES = ['al', 'be', 'ca', 'do', 'fe', 'ga', 'li', 'mo', 'na', 'pi', 'ra', 'so', 'ti', 'vo', 'xa', 'ze']
+SUFFIXES = ['pril', 'olol', 'statin', 'formin', 'prazole', 'mycin', 'cillin', 'oxetine', 'azepam',
+            'profen', 'conazole', 'terol', 'sartan', 'dipine', 'vir', 'mab']
+
+
+def drug_id(i):
+    return f"DB{i + 1:05d}"
+
+
+def drug_name(i):
+    # Unique per index: base-16 syllable spelling of i plus a class-like suffix
+    stem = ''
+    n = i
+    while True:
+        stem += SYLLABLES[n % len(SYLLABLES)]
+        n //= len(SYLLABLES)
+        if not n:
+            break
+    return (stem + SUFFIXES[i % len(SUFFIXES)]).capitalize()
+
+
+def parse_roles(text):
+    """'substrate=0.6,inhibitor=0.3' -> {'substrate': 0.6, 'inhibitor': 0.3}"""
+    roles = {}
+    for part in text.split(','):
+        role, _, p = part.partition('=')
+        roles[role.strip()] = float(p)
+    return roles
+
+
+class SyntheticDrugBank:
+    """
+    Deterministic DrugBank-schema XML at a chosen scale. The same parameters and seed
+    always produce the same file, so benchmark runs on different machines see the same data.
+
+    drugs: number of <drug> elements
+    interactions: mean drug-drug interactions per drug (listed on both drugs, as DrugBank does)
+    enzymes_per_drug: mean CYP450 entries per drug
+    enzyme_roles: probability of each action (substrate/inhibitor/inducer) per enzyme entry
+    vocabulary: indication phrases, most common first
+    """
+
+    def __init__(self, drugs=1000, interactions=20, enzymes_per_drug=2, enzyme_roles=None,
+                 vocabulary=None, seed=1):
+        self.drugs = drugs
+        self.interactions = interactions
+        self.enzymes_per_drug = enzymes_per_drug
+        self.enzyme_roles = enzyme_roles or DEFAULT_ENZYME_ROLES
+        self.vocabulary = vocabulary or DEFAULT_VOCABULARY
+        self.seed = seed
+
+    def _interaction_graph(self, rng):
+        # Uniform random pairs until the mean degree is reached; symmetric like DrugBank
+        n = self.drugs
+        target = min(int(n * self.interactions / 2), n * (n - 1) // 2)
+        pairs = set()
+        while len(pairs) < target:
+            a, b = rng.randrange(n), rng.randrange(n)
+            if a != b:
+                pairs.add((min(a, b), max(a, b)))
+        neighbours = [[] for _ in range(n)]
+        for a, b in sorted(pairs):
+            neighbours[a].append(b)
+            neighbours[b].append(a)
+        return neighbours
+
+    def _enzymes(self, rng):
+        count = min(len(ENZYMES), max(0, round(rng.expovariate(1 / self.enzymes_per_drug))
+                                      if self.enzymes_per_drug else 0))
+        entries = []
+        for enzyme in rng.sample(ENZYMES, count):
+            actions = [role for role, p in self.enzyme_roles.items() if rng.random() < p]
+            entries.append((f"BE{ENZYMES.index(enzyme):07d}", enzyme, actions or ['substrate']))
+        return entries
+
+    def _drug(self, i, rng, neighbours, weights):
+        did = drug_id(i)
+        conditions = rng.choices(self.vocabulary, weights=weights, k=rng.randint(1, 3))
+        conditions = list(dict.fromkeys(conditions))
+        phrase = rng.choice(CLASS_PHRASES)
+        indication = f"{phrase.capitalize()} indicated for the treatment of {' and '.join(conditions)}."
+        groups = rng.choices([g for g, _ in GROUPS], weights=[w for _, w in GROUPS])[0]
+        atc_code = PHRASE_ATC.get(phrase) or OTHER_ATC_CLASSES[i % len(OTHER_ATC_CLASSES)]
+        levels = dict(ATC_CLASSES)[atc_code]
+        routes = rng.choices([r for r, _ in ROUTES], weights=[w for _, w in ROUTES], k=rng.randint(1, 2))
+
+        out = ['<drug type="small molecule" created="2005-06-13" updated="2024-01-01">',
+               f'<drugbank-id primary="true">{did}</drugbank-id>',
+               f'<drugbank-id>APRD{i:05d}</drugbank-id>',
+               f'<name>{drug_name(i)}</name>',
+               f'<description>{drug_name(i)} belongs to the {escape(phrase)} class and is used in '
+               f'{escape(conditions[0])}.</description>',
+               f'<cas-number>{1000 + i}-{i % 97:02d}-{i % 10}</cas-number>',
+               '<groups>' + ''.join(f'<group>{g.strip()}</group>' for g in groups.split(';')) + '</groups>',
+               f'<indication>{escape(indication)}</indication>',
+               f'<mechanism-of-action>{escape(phrase.capitalize())} activity.</mechanism-of-action>',
+               f'<toxicity>{"Overdose may cause adverse effects. " * rng.randint(0, 20)}</toxicity>',
+               f'<half-life>{rng.randint(1, 48)} hours</half-life>',
+               '<clearance>Renal</clearance>']
+
+        out.append('<synonyms>' + ''.join(
+            f'<synonym language="english" coder="INN">{drug_name(i)} {k}</synonym>'
+            for k in range(rng.randint(0, 3))) + '</synonyms>')
+        out.append('<drug-interactions>' + ''.join(
+            f'<drug-interaction><drugbank-id>{drug_id(j)}</drugbank-id><name>{drug_name(j)}</name>'
+            f'<description>{drug_name(j)} may increase the adverse effects of {drug_name(i)}.</description>'
+            f'</drug-interaction>' for j in neighbours[i]) + '</drug-interactions>')
+        out.append('<food-interactions><food-interaction>Take with food.</food-interaction></food-interactions>')
+        out.append('<enzymes>' + ''.join(
+            f'<enzyme position="{k + 1}"><id>{eid}</id><name>{name}</name><organism>Humans</organism>'
+            f'<actions>' + ''.join(f'<action>{a}</action>' for a in actions) + '</actions>'
+            f'<inhibition-strength>{"moderate" if "inhibitor" in actions else "unknown"}</inhibition-strength>'
+            f'<induction-strength>{"moderate" if "inducer" in actions else "unknown"}</induction-strength>'
+            f'</enzyme>' for k, (eid, name, actions) in enumerate(self._enzymes(rng))) + '</enzymes>')
+        out.append(f'<targets><target position="1"><id>BE{9000000 + i % 500:07d}</id><name>Target {i % 500}</name>'
+                   f'<organism>Humans</organism><known-action>yes</known-action></target></targets>')
+        out.append('<prices>' + ''.join(
+            f'<price><description>{drug_name(i)} {10 * (k + 1)} mg</description>'
+            f'<cost currency="{rng.choice(["USD", "USD", "CAD"])}">{rng.randint(5, 5000) / 10}</cost>'
+            f'<unit>{rng.choice(UNITS)}</unit></price>' for k in range(rng.randint(0, 4))) + '</prices>')
+        out.append('<products>' + ''.join(
+            f'<product><name>{drug_name(i)}</name><labeller>Labeller {i % 50}</labeller>'
+            f'<dosage-form>Tablet</dosage-form><strength>{10 * (k + 1)} mg</strength><route>{r}</route>'
+            f'<country>US</country></product>' for k, r in enumerate(routes)) + '</products>')
+        out.append(f'<categories><category><category>{escape(phrase.title())}s</category>'
+                   f'<mesh-id>D{CLASS_PHRASES.index(phrase):06d}</mesh-id></category></categories>')
+        out.append(f'<pathways><pathway><smpdb-id>SMP{i % 300:05d}</smpdb-id><name>{drug_name(i)} Pathway</name>'
+                   f'<category>drug_action</category></pathway></pathways>')
+        out.append('<dosages>' + ''.join(
+            f'<dosage><form>Tablet</form><route>{r}</route><strength>10 mg</strength></dosage>'
+            for r in dict.fromkeys(routes)) + '</dosages>')
+        codes = [atc_code, *(atc_code[:n] for n in (4, 3, 1))]
+        out.append(f'<atc-codes><atc-code code={quoteattr(f"{atc_code}{i % 100:02d}")}>' + ''.join(
+            f'<level code="{code}">{escape(name)}</level>' for code, name in zip(codes, levels)) +
+                   '</atc-code></atc-codes>')
+        out.append('</drug>')
+        return "".join(out)
+
+    def write(self, path):
+        """Writes the XML to path, one drug at a time. Returns the path."""
+        rng = random.Random(self.seed)
+        neighbours = self._interaction_graph(rng)
+        weights = [1 / (rank + 1) for rank in range(len(self.vocabulary))]
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<drugbank xmlns="http://www.drugbank.ca" version="5.1" exported-on="2024-01-01">\n')
+            for i in range(self.drugs):
+                f.write(self._drug(i, rng, neighbours, weights))
+                f.write('\n')
+            f.write('</drugbank>\n')
+        return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write deterministic synthetic DrugBank XML")
+    parser.add_argument('--out', default='data/database.xml')
+    parser.add_argument('--drugs', type=int, default=1000)
+    parser.add_argument('--interactions', type=float, default=20, help="Mean interactions per drug")
+    parser.add_argument('--enzymes', type=float, default=2, help="Mean CYP450 entries per drug")
+    parser.add_argument('--roles', type=parse_roles, default=None,
+                        help="Enzyme action probabilities, e.g. substrate=0.65,inhibitor=0.25,inducer=0.05")
+    parser.add_argument('--vocabulary', help="File with one indication phrase per line, most common first")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    vocabulary = None
+    if args.vocabulary:
+        with open(args.vocabulary) as f:
+            vocabulary = [line.strip() for line in f if line.strip()]
+
+    generator = SyntheticDrugBank(args.drugs, args.interactions, args.enzymes, args.roles, vocabulary, args.seed)
+    print(f"Wrote {generator.drugs} drugs to {generator.write(args.out)}")
@@ -0,0 +1,181 @@
+import contextlib
+import io
+import re
+import sqlite3
+
+import pytest
+
+import optimizer
+from cache import DataVersion, PrecomputedRegimens, ResponseCache
+from database import DrugDatabase
+from drugbank_parser import parse_drugbank_xml
+from enrichment import enrich_details
+from etl import DrugETL
+from optimizer import DrugOptimizer, ILP_WEIGHTS
+from sessions import SessionStore
+from synthetic_drugbank import SyntheticDrugBank
+from vocabulary import ConditionVocabulary
+
+# Conditions chosen to hit every branch of the search-term, class, route and exclusion logic
+PROBE_CONDITIONS = [
+    ['hypertension', 'asthma'],
+    ['headache', 'fever', 'diabetes'],
+    ['glaucoma', 'skin rash', 'fungal infection'],
+    ['bacterial infection', 'gerd', 'depression', 'cancer pain'],
+]
+
+# Synthetic database the plans are taken on
+PLAN_DRUGS = 300
+
+# Tables a per-request query may scan, with the reason. Anything else scanning fails.
+REQUEST_SCANS = {
+    'indications': "free-text LIKE '%term%' search drives candidate retrieval",
+}
+
+# Tables read whole once per data version to build in-memory state, with the reason
+LOAD_SCANS = {
+    'drugs': "interaction index id/name table and condition vocabulary drug names",
+    'synonyms': "interaction index name resolution and condition vocabulary drug names",
+    'interactions': "interaction index neighbour lists",
+    'enzymes': "interaction index enzyme roles",
+    'atc_codes': "class index and condition vocabulary class names",
+    'categories': "condition vocabulary category names",
+    'indications': "condition vocabulary indication words",
+    'precomputed_regimens': "loaded whole per data version; precompute.py stamps every row with it",
+}
+
+# Tables every run must have queried, so a path that stops being driven fails the test
+EXPECTED_TABLES = ['toxicity', 'prices', 'dosages', 'enzymes', 'synonyms', 'food_interactions', 'pathways',
+                   'targets', 'interactions', 'atc_codes', 'categories', 'meta', 'precomputed_regimens',
+                   'response_cache']
+
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+@contextlib.contextmanager
+def traced(statements):
+    """Records (database path, SQL with parameters bound) for every statement run meanwhile."""
+    real_connect = sqlite3.connect
+
+    def traced_connect(database, *args, **kwargs):
+        conn = real_connect(database, *args, **kwargs)
+        conn.set_trace_callback(lambda sql: statements.append((database, sql)))
+        return conn
+
+    sqlite3.connect = traced_connect
+    try:
+        yield
+    finally:
+        sqlite3.connect = real_connect
+
+
+def selects(statements):
+    seen = []
+    for database, sql in statements:
+        if sql.lstrip().upper().startswith('SELECT') and (database, sql) not in seen:
+            seen.append((database, sql))
+    return seen
+
+
+def full_scans(conn, sql):
+    """Returns (table, plan detail) for every full scan in the query plan."""
+    aliases = dict(re.findall(r'\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)', sql, re.IGNORECASE))
+    aliases = {alias: table for table, alias in aliases.items()}
+
+    scans = []
+    for _, _, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        match = SCAN_RE.match(detail)
+        if match:
+            name = match.group(1)
+            scans.append((aliases.get(name, name), detail))
+    return scans
+
+
+def violations(queries, allowed):
+    found = []
+    for database, sql in queries:
+        conn = sqlite3.connect(database)
+        for table, detail in full_scans(conn, sql):
+            if table not in allowed:
+                found.append(f"Full scan on {table}: {detail}\n{' '.join(sql.split())}")
+        conn.close()
+    return found
+
+
+@pytest.fixture(scope='module')
+def db_path(tmp_path_factory):
+    work = tmp_path_factory.mktemp('plans')
+    data_dir = str(work / 'data')
+    xml_path = SyntheticDrugBank(PLAN_DRUGS, 10, seed=1).write(str(work / 'data' / 'database.xml'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        parse_drugbank_xml(xml_path, data_dir)
+        db = DrugDatabase(str(work / 'drug_project.db'))
+        db.create_schema()
+        DrugETL(db).load_csv_to_db(workers=1, data_dir=data_dir, precompute_regimens=False)
+    return db.db_name
+
+
+@pytest.fixture(scope='module')
+def queries(db_path, tmp_path_factory):
+    """
+    Drives the optimizer, enrichment, session, vocabulary and cache read paths against
+    the synthetic database. Returns (load queries, per-request queries), each a list of
+    distinct (database path, SQL).
+    """
+    load, request = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 1. Once per data version: in-memory indexes, vocabulary, precomputed table
+        with traced(load):
+            engine = DrugOptimizer(db_path)
+            version = DataVersion(db_path)
+            version.current()
+            engine.interactions._ensure()
+            engine.classes._ensure()
+            ConditionVocabulary(db_path, engine.rules).normalize_all(['hypertension'])
+            PrecomputedRegimens(db_path).get(['hypertension'], ILP_WEIGHTS)
+
+        # 2. Per request: candidates (class and text retrieval), conflicts, enrichment,
+        # session deltas and the disk response cache
+        drug_ids = [row[0] for row in sqlite3.connect(db_path).execute(
+            "SELECT drugbank_id FROM drugs ORDER BY drugbank_id LIMIT 3")]
+        with traced(request):
+            for class_retrieval in (True, False):
+                optimizer.CLASS_RETRIEVAL = class_retrieval
+                for conditions in PROBE_CONDITIONS:
+                    engine.solve_ilp(conditions)
+            optimizer.CLASS_RETRIEVAL = True
+            engine.graph_problem(PROBE_CONDITIONS[0], top_n=5)
+            engine._get_interaction_graph(drug_ids)
+            engine._get_enzyme_conflicts(drug_ids)
+            engine._fetch_descriptions(drug_ids)
+            engine._fetch_drugs(drug_ids)
+            enrich_details(db_path, drug_ids[0], {'id': drug_ids[0]})
+
+            session = SessionStore(engine).create()
+            session.update(add=['hypertension'])
+            session.update(add=['diabetes'])
+            session.update(remove=['hypertension'], add=['depression'])
+
+            cache_path = str(tmp_path_factory.mktemp('cache') / 'response_cache.db')
+            ResponseCache(version, disk_path=cache_path).put('key', {'status': 'Success'})
+            ResponseCache(version, disk_path=cache_path).get('key')
+    return selects(load), selects(request)
+
+
+def test_request_queries_use_indexes(queries):
+    _, request = queries
+    found = violations(request, REQUEST_SCANS)
+    assert not found, "\n\n".join(found)
+
+
+def test_load_queries_scan_only_listed_tables(queries):
+    load, _ = queries
+    found = violations(load, LOAD_SCANS)
+    assert not found, "\n\n".join(found)
+
+
+def test_every_read_path_was_driven(queries):
+    load, request = queries
+    sql = " ".join(s for _, s in load + request).lower()
+    missing = [t for t in EXPECTED_TABLES if not re.search(rf'\b{t}\b', sql)]
+    assert not missing, f"No query touched: {missing}"
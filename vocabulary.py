@@ -0,0 +1,249 @@
+import re
+import sqlite3
+import string
+import threading
+from collections import defaultdict
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from cache import DataVersion, normalize_condition
+from metrics import log
+
+# Indication words and word pairs must appear for this many drugs to enter the vocabulary
+VOCAB_MIN_DRUGS = 2
+
+# Shorter tokens are never spelling-corrected
+MIN_CORRECT_LENGTH = 4
+
+# rapidfuzz scores (0-100) needed to accept a correction; matches scoring at least the
+# SUGGEST_ scores but below these are only offered as suggestions, never applied
+WORD_SCORE = 85
+PHRASE_SCORE = 88
+SUGGEST_WORD_SCORE = 75
+SUGGEST_PHRASE_SCORE = 75
+
+# Prefixes with opposite meanings: a correction may never swap one for the other
+# ('hypotension' is not a misspelling of 'hypertension')
+OPPOSING_PREFIXES = (('hyper', 'hypo'), ('tachy', 'brady'), ('micro', 'macro'))
+
+# Strings scored per lookup, taken from those sharing the most character trigrams
+BLOCK_SIZE = 20
+
+# Normalized conditions remembered between requests
+NORMALIZE_MEMO = 4096
+
+STOPWORDS = {
+    'a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'into', 'is', 'its', 'of', 'on', 'or',
+    'the', 'to', 'with', 'used', 'use', 'treatment', 'management', 'patients', 'associated',
+    'indicated', 'therapy', 'adjunct', 'due', 'other', 'such', 'this', 'that', 'which', 'also',
+}
+
+TOKEN = re.compile(r"[a-z][a-z0-9\-]*[a-z0-9]|[a-z]")
+
+
+def flips_prefix(text, target):
+    """True if `target` swaps a prefix of `text` for its opposite (hypotension -> hypertension)."""
+    text_words, target_words = text.split(), target.split()
+    for a, b in OPPOSING_PREFIXES:
+        for mine, opposite in ((a, b), (b, a)):
+            if any(w.startswith(mine) for w in text_words) and not any(w.startswith(mine) for w in target_words) \
+                    and any(w.startswith(opposite) for w in target_words):
+                return True
+    return False
+
+
+def best_match(text, choices, scorer, cutoff):
+    """(choice, score) of the best-scoring choice that does not flip a prefix of `text`, or None."""
+    for choice, score, _ in process.extract(text, choices, scorer=scorer, score_cutoff=cutoff, limit=5):
+        if not flips_prefix(text, choice):
+            return choice, score
+    return None
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GramIndex:
+    """Character-trigram inverted index over a fixed list of strings."""
+
+    def __init__(self, strings):
+        self.strings = list(strings)
+        postings = defaultdict(list)
+        for i, s in enumerate(self.strings):
+            for gram in trigrams(s):
+                postings[gram].append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def block(self, text, limit=BLOCK_SIZE):
+        """The (at most `limit`) strings sharing the most trigrams with the text."""
+        lists = [self.postings[g] for g in trigrams(text) if g in self.postings]
+        if not lists:
+            return []
+        counts = np.bincount(np.concatenate(lists), minlength=len(self.strings))
+        top = np.argpartition(counts, -limit)[-limit:] if len(counts) > limit else np.arange(len(counts))
+        return [self.strings[i] for i in top if counts[i]]
+
+
+class ConditionVocabulary:
+    """
+    Maps free-text conditions (NER entities, typed input) onto terms candidate retrieval can
+    find: rule keywords and indication words/word pairs. Category and ATC level names add
+    spelling targets; drug names and synonyms are known words that are never "corrected".
+    Fuzzy lookups only score the strings that share the most trigrams with the input.
+    Built on first use, rebuilt when the database version or the rule table changes.
+    """
+
+    def __init__(self, db_path, rules):
+        self.db_path = db_path
+        self.rules = rules
+        self.data_version = DataVersion(db_path)
+        self._built_for = None
+        self._lock = threading.Lock()
+        self._memo = {}
+
+    def _ensure(self):
+        built_for = (self.data_version.current(), id(self.rules.current()))
+        if built_for != self._built_for:
+            with self._lock:
+                if built_for != self._built_for:
+                    self._build()
+                    self._memo = {}
+                    self._built_for = built_for
+
+    def _build(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # 1. Indication words and adjacent word pairs, counted per drug
+        word_drugs = defaultdict(set)
+        pair_drugs = defaultdict(set)
+        cursor.execute("SELECT drugbank_id, indication_text FROM indications")
+        for rid, text in cursor.fetchall():
+            tokens = TOKEN.findall(text.lower()) if text else []
+            for t in tokens:
+                if len(t) > 2 and t not in STOPWORDS:
+                    word_drugs[t].add(rid)
+            for a, b in zip(tokens, tokens[1:]):
+                if a not in STOPWORDS and b not in STOPWORDS:
+                    pair_drugs[f"{a} {b}"].add(rid)
+
+        phrases = {w for w, rids in word_drugs.items() if len(rids) >= VOCAB_MIN_DRUGS}
+        phrases |= {p for p, rids in pair_drugs.items() if len(rids) >= VOCAB_MIN_DRUGS}
+        phrases |= set(self.rules.keywords())
+
+        # 2. Spelling targets: words of the phrases, categories and ATC level names
+        words = {w for p in phrases for w in p.split()}
+        cursor.execute("SELECT DISTINCT category FROM categories")
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT level_1 FROM atc_codes UNION SELECT DISTINCT level_2 FROM atc_codes "
+                       "UNION SELECT DISTINCT level_3 FROM atc_codes UNION SELECT DISTINCT level_4 FROM atc_codes")
+        names += [row[0] for row in cursor.fetchall()]
+        for name in names:
+            if name:
+                words.update(t for t in TOKEN.findall(name.lower()) if len(t) > 2 and t not in STOPWORDS)
+
+        # 3. Drug names and synonyms: recognised as-is, never targets
+        known = set(words)
+        cursor.execute("SELECT name FROM drugs UNION SELECT synonym FROM synonyms")
+        for (name,) in cursor.fetchall():
+            if name:
+                known.update(TOKEN.findall(name.lower()))
+        conn.close()
+
+        self.phrases = phrases
+        self.words = words
+        self.known = known
+        self.phrase_index = GramIndex(sorted(phrases))
+        self.word_index = GramIndex(sorted(w for w in words if len(w) >= MIN_CORRECT_LENGTH))
+        log(f"Condition vocabulary: {len(phrases)} phrases, {len(words)} words, {len(known)} known words")
+
+    def _split_compound(self, word):
+        # Run-together words: 'stomachache' -> 'stomach ache'
+        for i in range(len(word) - 3, 2, -1):
+            head, tail = word[:i], word[i:]
+            if head in self.words and tail in self.words:
+                return f"{head} {tail}"
+        return None
+
+    def _correct_word(self, word):
+        """(correction, suggestion) for an unknown word; either may be None."""
+        match = best_match(word, self.word_index.block(word), fuzz.ratio, SUGGEST_WORD_SCORE)
+        if match is None:
+            return None, None
+        return (match[0], None) if match[1] >= WORD_SCORE else (None, match[0])
+
+    def normalize(self, condition):
+        """
+        Returns (canonical text, how, suggestions). how is None (understood as is), 'spelling',
+        'phrase', or 'unmatched' when the text still holds words the vocabulary does not know;
+        suggestions are then the low-confidence corrections, which are not applied.
+        Only unknown words are corrected, so a vocabulary term is never turned into another.
+        """
+        self._ensure()
+        text = normalize_condition(condition)
+        if text in self._memo:
+            return self._memo[text]
+
+        # 1. Already understood: a rule keyword occurs in it, or it is a vocabulary phrase
+        if not text or self.rules.recognises(text) or text in self.phrases:
+            found = (text, None, [])
+        else:
+            # 2. Per-word repair of unknown words
+            fixed, suggested, unknown = [], [], False
+            for token in text.split():
+                core = token.strip(string.punctuation)
+                if len(core) < MIN_CORRECT_LENGTH or core in self.known:
+                    fixed.append(token)
+                    suggested.append(token)
+                    continue
+                split = self._split_compound(core)
+                correction, suggestion = (split, None) if split else self._correct_word(core)
+                fixed.append(correction or token)
+                suggested.append(correction or suggestion or token)
+                unknown = unknown or correction is None
+            repaired, hint = " ".join(fixed), " ".join(suggested)
+            suggestions = [hint] if hint != repaired else []
+
+            # 3. Whole-phrase match, only for text with unknown words that no word repair fixed
+            if not unknown:
+                found = (repaired, 'spelling' if repaired != text else None, [])
+            elif repaired != text:
+                found = (repaired, 'unmatched', suggestions)
+            else:
+                match = best_match(text, self.phrase_index.block(text), fuzz.token_sort_ratio, SUGGEST_PHRASE_SCORE)
+                if match and match[1] >= PHRASE_SCORE:
+                    found = (match[0], 'phrase', [])
+                else:
+                    if match and match[0] not in suggestions:
+                        suggestions.append(match[0])
+                    found = (text, 'unmatched', suggestions)
+
+        if len(self._memo) >= NORMALIZE_MEMO:
+            self._memo.clear()
+        self._memo[text] = found
+        return found
+
+    def normalize_all(self, conditions):
+        """
+        Normalizes a condition list. Unchanged conditions keep the caller's spelling, and
+        conditions that normalize to the same term are merged. Returns (conditions, changes,
+        unmatched): changes maps each rewritten input to its canonical term, unmatched maps
+        each input with words the vocabulary does not know to suggested spellings (possibly none).
+        """
+        result, seen, changes, unmatched = [], set(), {}, {}
+        for condition in conditions:
+            canonical, how, suggestions = self.normalize(condition)
+            rewritten = how is not None and canonical != normalize_condition(condition)
+            label = canonical if rewritten else condition
+            if rewritten:
+                changes[condition] = canonical
+            if how == 'unmatched':
+                unmatched[condition] = suggestions
+            key = normalize_condition(label)
+            if key not in seen:
+                seen.add(key)
+                result.append(label)
+        return result, changes, unmatched